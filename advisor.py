@@ -26,6 +26,9 @@ _ROUND_COUNT=10
 _ADV_CURRENT = 0 #produce advice for current player
 _ADV_EACH = 1 #produce separate advice for each player in game
 _ADV_ALL = 2 #produce one advice accessible by all players
+_SEARCH_WORKERS = min(4,os.cpu_count() or 1) #processes for the longer power/action suggestion searches
+_SEARCH_SECONDS = 15 #wall-clock budget for the longer searches, which stop sooner once their choice is settled
+_searchBots = {} #suggestion search bots by phase, kept so later searches in this process can carry on the last tree
 
 couchip = '127.0.0.1:5984'
 credentials = 'admin:elderberry'
@@ -109,7 +112,7 @@ def archiveAdvice(jsonObject):
 def generateAdviceFor(jsonObject):
   log('starting advice')
   assert(jsonObject.get('turninfo','')!='')
-  thisGame = el_grande.ElGrandeGame({"game_state_json":pyspiel.GameParameter(json.dumps(jsonObject))})
+  thisGame = el_grande.ElGrandeGame({},game_state_doc=jsonObject)
   thisGameState = thisGame.new_initial_state()
   players = thisGameState._num_players
   regions = pieces._NUM_EXT_REGIONS
@@ -218,16 +221,18 @@ def generateRequestedAdvice(requestJSON):
     if foundDoc == None:
         advice['advice'] = ["Problem finding game history data for " + requestJSON['advicetype'] + " advice."]
     else:
-        thisGame =  el_grande.ElGrandeGame({"game_state_json":pyspiel.GameParameter(json.dumps(foundDoc))})
+        thisGame =  el_grande.ElGrandeGame({},game_state_doc=foundDoc)
         thisState = thisGame.new_initial_state()
         if requestJSON['advicetype']=='action_suggestion':
             #find which of the legal actions matches the requested trial action, and play it.
             playedAct = False
-            for act in thisState.legal_actions():
-                if thisState.action_to_string(act,withPlayer=False)==requestJSON['requestdata']:
-                    thisState.do_apply_action(act)
-                    playedAct = True
-                    break
+            try:
+                act = thisState.string_to_action(requestJSON['requestdata'])
+            except ValueError:
+                act = None
+            if act is not None and act in thisState.legal_actions():
+                thisState.do_apply_action(act)
+                playedAct = True
             if playedAct:
                 suggestion = initAdviceStructure(requestJSON['player'], 'suggestion', foundDoc)
                 suggestionAdvice(requestJSON['player'],thisState,foundDoc,suggestion,False)
@@ -282,7 +287,7 @@ def cardActionValueAdvice(player, gameState, jsonObject, advice):
     phase = gameState._get_current_phase_name()
     playerID = gameState._get_pid(player)
     simGame = gameState.clone()
-    simGame._end_turn = 3*((turn-1)//3) + 3 #next scoring round from where we are
+    simGame.set_horizon('scoring')
     rng = np.random.RandomState()
     eval=mcts.RandomRolloutEvaluator(2,rng)
  
@@ -374,7 +379,7 @@ def castilloAdvice(player, gameState, jsonObject, advice):
             cgs=cg.new_initial_state()
             rng=np.random.RandomState()
             eval=mcts.RandomRolloutEvaluator(1,rng)
-            mbot = mcts.MCTSBot(cg,2,1000,eval,random_state=rng,solve=True,verbose=False)
+            mbot = mcts.MCTSBot(cg,2,1000,eval,random_state=rng,solve=True,verbose=False,reuse_tree=False,time_limit=_SEARCH_SECONDS) #independent runs
             for i in range(sim_count):
                 c,cc,vc=mbot.multi_step(cgs,True) #do sim runs, reporting back whole game history
                 optpad=np.full(gameState._num_players-len(cc),9).tolist() #pad out truncated multi-steps, where not all players have castillo pieces
@@ -501,12 +506,13 @@ def scoreCalculationAdvice(player, gameState, jsonObject, advice):
     if jsonObject.get('scorehistory',[])==[]:
         return
 
+    regionScores=gameState._region_scores()
     for p in range(gameState._num_players):
         pchr=gameState._players[p]
         scores={}
         for r in range(pieces._NUM_EXT_REGIONS):
             oldScores=jsonObject['scorehistory'][pchr].get(pieces._REGIONS[r],[])
-            newScore=gameState._score_one_region(r)
+            newScore=regionScores[r]
             if len(oldScores)>0 or newScore[p]>0:
                 scores[pieces._REGIONS[r]]={"old":sum(sc for sc in oldScores if sc!=None),"new":int(newScore[p])}
         advice['advice'][pchr]=scores
@@ -539,22 +545,16 @@ def suggestionAdvice(player, gameState, jsonObject, advice, saveMe=True):
 
     #power phase - give a range of possibilities, to make up for the instability that's exhibited in power card choice
     if advicePhase == "power":
-        mc_sims=800
-        rng = np.random.RandomState()
-        eval=mcts.RandomRolloutEvaluator(2,rng)
-        mbot = mcts.MCTSBot(gameState._game,2,mc_sims,eval,random_state=rng,solve=True,verbose=False)
-        gameState._end_turn = 3*((turn-1)//3) + 3 #next scoring round from where we are
+        mbot = searchBot(gameState._game,advicePhase,800)
+        gameState.set_horizon('scoring')
         power_results,recommend_gap = mbot.step_with_recommend_gap(gameState)
         #print(recommend_gap)
         conf_str = 'mild' if recommend_gap<1 else 'moderate' if recommend_gap<5 else 'strong'
         advice['advice'] = [gameState.action_to_string(power_results,withPlayer=False) + " ("+conf_str+" recommendation)"]    
     else:
-        mc_sims = 1000
         simGame = gameState.clone()
-        simGame._end_turn = 3*((turn-1)//3) + 3 #next scoring round from where we are
-        rng = np.random.RandomState()
-        eval=mcts.RandomRolloutEvaluator(2,rng)
-        mbot = mcts.MCTSBot(simGame._game,2,mc_sims,eval,random_state=rng,solve=True,verbose=False)
+        simGame.set_horizon('scoring')
+        mbot = searchBot(simGame._game,advicePhase,1000)
         act, actList, returns = mbot.multi_step(simGame)
         actReport=[] #string actions to return as advice
         phase2flag=False #first time we fall into a "phase 2" state, add this info to the returned strings
@@ -576,6 +576,15 @@ def suggestionAdvice(player, gameState, jsonObject, advice, saveMe=True):
         saveAdvice(advice)
     log("suggestionAdvice finished all simulations")
 
+#MCTS bot for suggestion searches in this phase, built once per process - generateRequestedAdvice runs in the main
+#process, so repeated requests on the same position reuse the tree (advice made in a child process starts afresh)
+def searchBot(game, phase, mc_sims):
+    if phase not in _searchBots:
+        rng = np.random.RandomState()
+        eval=mcts.RandomRolloutEvaluator(2,rng)
+        _searchBots[phase] = mcts.MCTSBot(game,2,mc_sims,eval,random_state=rng,solve=True,verbose=False,num_workers=_SEARCH_WORKERS,time_limit=_SEARCH_SECONDS)
+    return _searchBots[phase]
+
 #specific alert of problems that might come up
 def alertAdvice(player, gameState, thisHistory, jsonObject, advice):
     #setNice(-5)
@@ -630,11 +639,9 @@ def addRelevantGameHistory(gameState, gameHistory):
    
     if phase=='start':
         gameHistory["pieces"][:,:,turn] = gameState._board_state[:regions,:players]
-        for r in range(regions):
-            #rank everything last by default
-            rd=gameState._rank_region(r)
-            ranks=[rd.get(i,players) for i in range(players)]
-            gameHistory["ranks"][r,:,turn]=ranks
+        #rank everything last by default
+        ranks=gameState._region_ranks()
+        gameHistory["ranks"][:,:,turn]=np.where(ranks>0,ranks,players)
 
     #keep just one round of old state for alertable states
     gameHistory['last']={}
@@ -679,13 +686,13 @@ def reportTargets(gameState, player, stopRegion=-1, stopStep=5, validList=None):
         #each round, work out how best to improve the point gap
         testState = gameState.clone()
         testState._board_state[:regions,player]+=testPieces
-        defaultPoints=[testState._score_one_region(r) for r in range(regions)]
+        defaultPoints=testState._region_scores()[:regions]
         defaultPointGap = getPointGap(sum(defaultPoints),player)
         bestPointGap = defaultPointGap #floor for improvement
         bestRegion = -2 #equivalent to 'stay in court'
         
         testState._board_state[:regions,player]+=1
-        testPoints=[testState._score_one_region(r) for r in range(regions)]
+        testPoints=testState._region_scores()[:regions]
         for r in validRegions:
             #check the effect on the point gap of subbing in each testPoints in turn
             testArray=[testPoints[reg] if reg==r else defaultPoints[reg] for reg in range(regions)]
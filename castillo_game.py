@@ -1,5 +1,6 @@
 import copy
 import pickle
+import struct
 
 import numpy as np
 import json
@@ -10,6 +11,10 @@ import el_grande_pieces as pieces
 _MAX_PLAYERS = 5
 _NUM_REGIONS = pieces._NUM_REGIONS
 _ZERO_CHAR = 'A'
+#compact state serialisation - header, board string, history, then win points
+_SERIAL_MAGIC = b'CGS'
+_SERIAL_VERSION = 1
+_SERIAL_HEADER = struct.Struct('<3sBBbBB') #magic,version,players,current player,terminal,history length
 #region order "Aragon","Castilla la Nueva","Castilla la Vieja","Cataluna","Galicia","Granada","Pais Vasco","Sevilla","Valencia"
 #_DEFAULT_REGION_REWARDS = [(5,4,1),(7,4,2),(6,4,2),(4,2,1),(4,2,0),(6,3,1),(5,3,1),(4,3,1),(5,3,2)]
 #_DEFAULT_PLAYERS = 4
@@ -257,7 +262,9 @@ class CastilloGameState(pyspiel.State):
         return self._game.get_type()
 
     def serialize(self):
-        return pickle.dumps(self)
+        """Compact versioned byte encoding - only the parts play changes, the rest comes from the game"""
+        header = _SERIAL_HEADER.pack(_SERIAL_MAGIC,_SERIAL_VERSION,self._num_players,self._cur_player,self._is_terminal,len(self._history))
+        return b''.join([header,self._board.encode('ascii'),bytes(self._history),np.asarray(self._win_points,'<f8').tobytes()])
 
     def resample_from_infostate(self):
         return [self.clone()]
@@ -293,11 +300,14 @@ class CastilloGame(pyspiel.Game):
 
     def __init__(self,params={"state":pyspiel.GameParameter('')}):
         super().__init__(self, _GAME_TYPE, _GAME_INFO, params or dict())
+        self._num_players=4 #players in _DEFAULT_STATE
         #state input as json with keys players,rewards,board,grandes,king
         if params.get("state",None) is not None:
             state=params["state"].string_value() 
             if state=='':
                 state=_DEFAULT_STATE
+            else:
+                self._num_players=json.loads(state)["players"]
             self._parent_game_state=state 
 
     def new_initial_state(self):
@@ -352,7 +362,25 @@ class CastilloGame(pyspiel.Game):
         return pyspiel.TensorLayout.CHW
 
     def deserialize_state(self, string):
-        return pickle.loads(string)
+        buf = memoryview(string)
+        if bytes(buf[:1]) == b'\x80':
+            #older pickled states
+            return pickle.loads(string)
+        magic,version,num_players,cur_player,is_terminal,history_len = _SERIAL_HEADER.unpack_from(buf)
+        if magic != _SERIAL_MAGIC or version != _SERIAL_VERSION:
+            raise ValueError("Unsupported Castillo state format " + str((magic,version)))
+        state = CastilloGameState(self)
+        assert(num_players==state._num_players)
+        pos = _SERIAL_HEADER.size
+        board_len = len(state._board)
+        state._board = bytes(buf[pos:pos+board_len]).decode('ascii')
+        pos += board_len
+        state._history = list(buf[pos:pos+history_len])
+        pos += history_len
+        state._win_points = np.frombuffer(buf,dtype='<f8',count=num_players,offset=pos).copy()
+        state._cur_player = pyspiel.PlayerId.TERMINAL if is_terminal else cur_player
+        state._is_terminal = bool(is_terminal)
+        return state
 
     def max_game_length(self):
         return self._num_players
@@ -1,6 +1,7 @@
-import copy
 import pickle
 import json
+import collections
+import struct
 
 import numpy as np
 import random
@@ -48,6 +49,8 @@ _ST_BDY_SECRET = _ST_BDY_GRANDE_KING + 1 #secret region vote (1 bit per player)
 _ST_BDY_END = _ST_BDY_SECRET + _MAX_PLAYERS
 
 _ST_MASK_KING = _MAX_PLAYERS #in the king/grande mask, king is at end
+_PLAYER_BIT = [1 << p for p in range(_MAX_PLAYERS)] #per-player bit in the grande, secret and power card masks
+_KING_BIT = 1 << _ST_MASK_KING
 
 #Action card state - int indicators per-card 
 _ST_AC_UNPLAYED = 0
@@ -85,6 +88,59 @@ _ST_TN_END = _ST_TN_SCORES + _MAX_PLAYERS
 
 _ST_IDCH = 32 #highest number in the matrix should be 2^5
 
+#Packed state - every part of the state lives in one contiguous int16 buffer, with named views into it,
+#so that copy, compare and transport are each a single memcpy
+_PK_DTYPE = np.int16
+_PK_BOARD = 0 #board matrix, _ST_BDX_END x _ST_BDY_END
+_PK_ACARD = _PK_BOARD + (_ST_BDX_END * _ST_BDY_END) #action card states
+_PK_ACARD_ROUND = _PK_ACARD + _NUM_ACTION_CARDS #round each action card is dealt in
+_PK_PCARD = _PK_ACARD_ROUND + _NUM_ACTION_CARDS #power cards held this round (1 bit per player)
+_PK_PAST_PCARD = _PK_PCARD + _NUM_POWER_CARDS #power cards already played (1 bit per player)
+_PK_TURN = _PK_PAST_PCARD + _NUM_POWER_CARDS #turn state
+_PK_REWARDS = _PK_TURN + _ST_TN_END #1st/2nd/3rd place points per extended region
+_PK_SCOREBOARDS = _PK_REWARDS + (_NUM_EXT_REGIONS * 3) #region each movable scoreboard is in, -1 if not placed
+_PK_LEFT = _PK_SCOREBOARDS + _NUM_SCOREBOARDS #queue of players still to play in this phase
+_PK_DONE = _PK_LEFT + _MAX_PLAYERS #players who have already played in this phase
+_PK_LOCATIONS = _PK_DONE + _MAX_PLAYERS #cached region of the king, each grande and each secret choice, -1 if none
+_LOC_KING = 0
+_LOC_GRANDES = _LOC_KING + 1
+_LOC_SECRETS = _LOC_GRANDES + _MAX_PLAYERS
+_LOC_END = _LOC_SECRETS + _MAX_PLAYERS
+_PK_META = _PK_LOCATIONS + _LOC_END #single values, indexed by _PK_M_*
+_PK_M_PLAYER = 0 #current player
+_PK_M_TERMINAL = 1
+_PK_M_NUM_LEFT = 2 #length of the players-left queue
+_PK_M_NUM_DONE = 3 #length of the players-done list
+_PK_M_CARD = 4 #id of the currently chosen action card, -1 if none
+_PK_M_HORIZON = 5 #search horizon, indexed into _HORIZON_NAMES
+_PK_M_HORIZON_MARK = 6 #round or phase stage the horizon was set in
+_PK_M_PLIES_LEFT = 7 #actions left before the horizon, 0 if no ply limit
+_PK_M_END = 8
+_PK_END = _PK_META + _PK_M_END
+
+#Zobrist-style hashing of the packed buffer - each (slot,value) pair gets a 64-bit key from a splitmix64 mix
+#of (slot<<16 | value), and a buffer's hash is the xor of its keys, so changing a slot only needs its old and new keys
+_MASK64 = (1<<64)-1
+_ZOB_SLOTS = np.arange(_PK_END,dtype=np.uint64) << np.uint64(16)
+
+def _mix64(x):
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+def _packed_zobrist(packed):
+    #_mix64 over every slot at once - uint64 arithmetic wraps just like the masked python version
+    x = (_ZOB_SLOTS | packed.astype(np.uint16).astype(np.uint64)) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return int(np.bitwise_xor.reduce(x ^ (x >> np.uint64(31))))
+
+#shared all-zero step rewards by player count - state returns are only ever replaced, never modified in place
+_NO_REWARDS = [np.zeros(n) for n in range(_MAX_PLAYERS+1)]
+for _r in _NO_REWARDS:
+    _r.flags.writeable = False
+
 #list of action numbers from 0 up
 
 _ACT_CARDS = 0 #start of 'select a card' actions
@@ -102,6 +158,107 @@ _ACT_SKIP = _ACT_CAB_MOVES + (_NUM_CAB_AREAS * _NUM_CAB_AREAS * _MAX_PLAYERS) #c
 _ACT_TRIGGER = _ACT_SKIP + 1 #explicitly trigger an instant card action
 _ACT_END = _ACT_TRIGGER + 1 
 
+#bit sets of players covered by a movement pattern, by [pattern player+1 (0 for any player)][allowed] - see _MoveTracker.matches
+_PATTERN_PLAYER_BITS = [[(1<<_MAX_PLAYERS)-1]*2] + [[((1<<_MAX_PLAYERS)-1) & ~(1<<p),1<<p] for p in range(_MAX_PLAYERS)]
+_CAB_MOVES_PER_FROM = _NUM_CAB_AREAS*_MAX_PLAYERS
+_BYTE_BITS = [tuple(b for b in range(8) if (v >> b) & 1) for v in range(256)] #set bit positions of each byte value
+
+def _cab_move_actions(moves):
+    #sorted cab move action ids from a bitset over cab move offsets, a byte at a time from the lowest set byte
+    if not moves:
+        return []
+    first = ((moves & -moves).bit_length() - 1) >> 3
+    moves >>= first*8
+    base = _ACT_CAB_MOVES + first*8
+    data = moves.to_bytes((moves.bit_length()+7) >> 3,'little')
+    return [base + 8*i + b for i,byte in enumerate(data) if byte for b in _BYTE_BITS[byte]]
+
+def _cab_move_bits(actions):
+    #inverse of _cab_move_actions
+    moves = 0
+    for action in actions:
+        moves |= 1 << (action - _ACT_CAB_MOVES)
+    return moves
+
+#action decoding - each action id maps to (kind, arg1, arg2, arg3), built once at import
+_AK_CARD = 0 #action card
+_AK_POWER = 1 #power card
+_AK_RETRIEVE = 2 #power card
+_AK_DECIDE_CAB = 3
+_AK_DECIDE_ACT = 4 #1 for the 'OR' card's second action
+_AK_SECRET = 5 #region
+_AK_GRANDE = 6 #region
+_AK_KING = 7 #region
+_AK_SCOREBOARD = 8 #scoreboard, region
+_AK_CAB_MOVE = 9 #from region, to region, of player
+_AK_SKIP = 10
+_AK_TRIGGER = 11
+
+def _build_action_table():
+    table = np.zeros((_ACT_END,4),np.int16)
+    def fill(start,kind,args):
+        table[start:start+len(args),0] = kind
+        table[start:start+len(args),1:1+len(args[0])] = args
+    fill(_ACT_CARDS,_AK_CARD,[(c,) for c in range(_NUM_ACTION_CARDS)])
+    fill(_ACT_POWERS,_AK_POWER,[(c,) for c in range(_NUM_POWER_CARDS)])
+    fill(_ACT_RETRIEVE_POWERS,_AK_RETRIEVE,[(c,) for c in range(_NUM_POWER_CARDS)])
+    fill(_ACT_DECIDE_CAB,_AK_DECIDE_CAB,[(0,)])
+    fill(_ACT_DECIDE_ACT,_AK_DECIDE_ACT,[(0,),(1,)])
+    fill(_ACT_CHOOSE_SECRETS,_AK_SECRET,[(r,) for r in range(_NUM_REGIONS)])
+    fill(_ACT_MOVE_GRANDES,_AK_GRANDE,[(r,) for r in range(_NUM_REGIONS)])
+    fill(_ACT_MOVE_KINGS,_AK_KING,[(r,) for r in range(_NUM_REGIONS)])
+    fill(_ACT_MOVE_SCOREBOARDS,_AK_SCOREBOARD,[(b,r) for b in range(_NUM_SCOREBOARDS) for r in range(_NUM_REGIONS)])
+    fill(_ACT_CAB_MOVES,_AK_CAB_MOVE,[(f,t,p) for f in range(_NUM_CAB_AREAS) for t in range(_NUM_CAB_AREAS) for p in range(_MAX_PLAYERS)])
+    fill(_ACT_SKIP,_AK_SKIP,[(0,)])
+    fill(_ACT_TRIGGER,_AK_TRIGGER,[(0,)])
+    table.flags.writeable = False
+    return table
+
+_ACT_TABLE = _build_action_table()
+_ACT_DECODE = [tuple(row) for row in _ACT_TABLE.tolist()] #python tuples, for scalar lookups
+
+def _action_label(kind,arg1,arg2,arg3,players):
+    if kind==_AK_CARD:
+        return "Action "+pieces._CARDS[pieces._CARDTRACK[arg1]]['name']
+    elif kind==_AK_POWER:
+        return "Power "+str(arg1+1)
+    elif kind==_AK_RETRIEVE:
+        return "Retrieve Power "+str(arg1+1)
+    elif kind==_AK_DECIDE_CAB:
+        return "Caballero placement before card action"
+    elif kind==_AK_DECIDE_ACT:
+        return "Card action (2nd choice) before caballero placement" if arg1 else "Card action before caballero placement"
+    elif kind==_AK_SECRET:
+        return "Choose "+pieces._REGIONS[arg1]
+    elif kind==_AK_GRANDE:
+        return "Grande to "+pieces._REGIONS[arg1]
+    elif kind==_AK_KING:
+        return "King to "+pieces._REGIONS[arg1]
+    elif kind==_AK_SCOREBOARD:
+        return "Move scoreboard "+str(pieces._SCOREBOARDS[arg1]['points'])+" to "+pieces._REGIONS[arg2]
+    elif kind==_AK_SKIP:
+        return "Skip this step"
+    elif kind==_AK_TRIGGER:
+        return "Trigger card action"
+    else:
+        #moves of caballeros belonging to players not in this game can never be legal
+        owner = players[arg3] if arg3 < len(players) else "P"+str(arg3)
+        return owner + " caballero from " + pieces._REGIONS[arg1] + " to " + pieces._REGIONS[arg2]
+
+_LABEL_CACHE = {}
+_LABEL_CACHE_SIZE = 64
+
+def _action_labels(players):
+    #action strings (without player) and the reverse string->action index, built once per list of player names
+    key = tuple(players)
+    labels = _LABEL_CACHE.get(key)
+    if labels is None:
+        if len(_LABEL_CACHE) >= _LABEL_CACHE_SIZE:
+            _LABEL_CACHE.clear()
+        names = [_action_label(*row,players) for row in _ACT_DECODE]
+        labels = _LABEL_CACHE[key] = (names,{name:a for a,name in enumerate(names)})
+    return labels
+
 
 
 _GAME_TYPE = pyspiel.GameType(
@@ -129,62 +286,505 @@ _GAME_INFO = pyspiel.GameInfo(
     utility_sum=1.0,
     max_game_length=_MAX_PLAYERS*_MAX_TURNS*_NUM_PHASES + 15*_NUM_PHASES + 40) #total phases + cabs out + card sub-actions 
 
+def _rank_regions(cabs):
+    """Ranks every player in every region at once.
+    Args:
+      cabs: (..., regions, players) caballero counts
+    Returns:
+      (..., regions, players) ranks, 0 where the player has no caballeros. A player's rank is
+      the number of present players with at least as many caballeros, so tied players share
+      the lower place.
+    """
+    cabs = np.asarray(cabs)
+    present = cabs > 0
+    ranks = ((cabs[...,None,:] >= cabs[...,:,None]) & present[...,None,:]).sum(-1)
+    ranks[~present] = 0
+    return ranks
+
+def _score_regions(cabs, rewards, grande_king, top_only=False):
+    """Scores every region for every player at once.
+    Args:
+      cabs: (..., regions, players) caballero counts
+      rewards: (..., regions, 3) points for first, second and third place, broadcast against cabs
+      grande_king: (..., regions) grande/king bitmask column of the board, broadcast against cabs
+      top_only: award points for first place only (grande and king bonuses still apply)
+    Returns:
+      (..., regions, players) integer score matrix
+    """
+    ranks = _rank_regions(cabs)
+    num_players = ranks.shape[-1]
+    placed = (ranks==1) if top_only else (ranks>0) & (ranks<=3)
+    rewards = np.broadcast_to(np.asarray(rewards,dtype=np.int64), ranks.shape[:-1]+(3,))
+    points = np.take_along_axis(rewards, np.clip(ranks-1,0,2), -1)
+    points[~placed] = 0
+    #first place gets 2 for their own grande and 2 for the king being in the region
+    grande_king = np.asarray(grande_king,dtype=np.int64)[...,None]
+    bonus = ((grande_king >> np.arange(num_players)) & 1) + ((grande_king >> _ST_MASK_KING) & 1)
+    points += 2 * bonus * (ranks==1)
+    return points
+
+def _score_row(cabs, rewards, grande_king):
+    """One region of _rank_regions/_score_regions with plain python lists, for rescoring a few changed regions.
+    Returns (ranks, points) lists, one entry per player.
+    """
+    ranks = [sum(1 for other in cabs if other>=c) if c>0 else 0 for c in cabs]
+    king_bonus = 2*((grande_king >> _ST_MASK_KING) & 1)
+    points = [rewards[r-1] if 0<r<=3 else 0 for r in ranks]
+    for p,r in enumerate(ranks):
+        if r==1:
+            points[p] += king_bonus + (2 if grande_king & (1<<p) else 0)
+    return ranks,points
+
+#regions changed since the last scoring above which rescoring everything at once is quicker than row by row
+_SCORE_ROWS_MAX = 4
+
+#Action card tables, compiled once from pieces._CARDS and indexed by card id
+
+def _compile_card_steps(card):
+    # return 0==instant,1=1-step,2=2 or more
+    if card['actiontype']=='move':
+        fromreg=card['details']['from']['region']
+        toreg=card['details']['to']['region']
+        if fromreg=='ownerchooseplus':
+            #Angry King
+            return _ST_STEPS_0
+        if fromreg in ['court','province'] and toreg in ['court','province']:
+            #Decay, Decayall, Court
+            return _ST_STEPS_0 
+        if fromreg=='ownerchoose' or toreg=='ownerchoose':
+            return _ST_STEPS_1
+    elif card['actiontype']=='score':
+        if card['details'].get('region','')=='selfchoose':
+            return _ST_STEPS_1
+        else:
+            return _ST_STEPS_0
+    elif card['actiontype']=='uniquescore':
+        return _ST_STEPS_1
+    elif card['actiontype'] in ['scoreboard','power','grande','king']:
+        return _ST_STEPS_1
+
+    #default is a multi-move, since this is the most common
+    return _ST_STEPS_MULTI 
+
+def _compile_card_move(details):
+    #one movement element of a card - 'from'/'to' are an area id, None for 'any region without the king',
+    #or the owner-choice placeholder string; 'pattern' is filled in with the current player when applied
+    move = {}
+    for v in ['from','to']:
+        region = details[v]['region']
+        if region in ['court','province']:
+            move[v] = pieces._REGIONS.index(region)
+        elif region=='selfchoose':
+            move[v] = None
+        else:
+            move[v] = region
+        move['lock'+v] = (details[v]['splitopt']=='all')
+    condition = details['from'].get('condition',None)
+    move['fromcondition'] = int(condition) if condition not in [None,'clock'] else 0
+    pattern = {}
+    if details['player'] in ['self','foreign']:
+        pattern['allowed'] = (details['player']=='self')
+    pattern['max'] = 150 if details['number']<0 else details['number']
+    pattern['min'] = 0 if details.get('numopt','lteq')=='lteq' else pattern['max']
+    move['player'] = details['player']
+    move['pattern'] = pattern
+    #'Provinceone' sends one caballero for each opponent, so needs a pattern per player
+    move['perplayer'] = (details['from']['region']=='selfchoose' and details['to']['region']=='province')
+    return move
+
+def _compile_card_moves(card):
+    #tuple of alternatives (two for 'choose' cards), each a tuple of movement elements
+    if card['actiontype']=='move':
+        return ((_compile_card_move(card['details']),),)
+    elif card['actiontype']=='all':
+        #only one card is an 'and' and it happens to have two move elements, with no 'numopt' given
+        return (tuple(_compile_card_move(dict(d['details'],numopt='lteq')) for d in card['details']),)
+    elif card['actiontype']=='choose':
+        return tuple((_compile_card_move(d['details']),) if d['type']=='move' else () for d in card['details'])
+    return ((),)
+
+_CARD_INFO = [pieces._CARDS[c] for c in pieces._CARDTRACK]
+_CARD_TYPE = [c['actiontype'] for c in _CARD_INFO]
+_CARD_STEPS = [_compile_card_steps(c) for c in _CARD_INFO]
+_CARD_MOVES = [_compile_card_moves(c) for c in _CARD_INFO]
+_CARD_CABS = [int(c['name'][4]) for c in _CARD_INFO] #caballeros placed with each card
+#cards needing a secret region choice from every player before movement
+_CARD_OWNERCHOOSE = [t=='move' and 'ownerchoose' in [c['details']['from']['region'],c['details']['to']['region']] for t,c in zip(_CARD_TYPE,_CARD_INFO)]
+
+#name->id maps for loading game documents
+_REGION_IDS = {name:i for i,name in enumerate(pieces._REGIONS)}
+_CARD_IDS = {guid:card['idx'] for guid,card in pieces._CARDS.items()}
+_PHASE_IDS = {name:i for i,name in enumerate(_PHASE_NAMES)}
+
+#search horizons - a state stops early, as a terminal state, at the end of the game, the next scoring round,
+#the end of the current round or the end of the current phase stage (power, action or scoring)
+_HORIZON_NAMES = ['game','scoring','round','phase']
+_HZ_GAME = 0
+_HZ_SCORING = 1
+_HZ_ROUND = 2
+_HZ_PHASE = 3
+_HORIZON_IDS = {name:i for i,name in enumerate(_HORIZON_NAMES)}
+#phase stage for each phase id - start/power, action and its sub-phases, scoring/end
+_PHASE_STAGE = [_ST_PHASE_POWER,_ST_PHASE_POWER]+[_ST_PHASE_ACTION]*6+[_ST_PHASE_SCORE,_ST_PHASE_SCORE]
+
+#parsed base states of recently loaded game documents, keyed by doc (_id,_rev)
+_DOC_STATE_CACHE = collections.OrderedDict()
+_DOC_STATE_CACHE_SIZE = 32
+
+def _doc_cache_key(doc):
+    #only documents that came from the database have a revision to key on
+    if '_id' in doc and '_rev' in doc:
+        return (doc['_id'],doc['_rev'])
+    return None
+
+def _legal_entry(actions):
+    #(sorted actions tuple, read-only mask) as kept in ElGrandeGameState._legal
+    actions = tuple(actions)
+    mask = np.zeros(_ACT_END,dtype=bool)
+    mask[list(actions)] = True
+    mask.flags.writeable = False
+    return (actions,mask)
+
+_NO_LEGAL_MASK = _legal_entry(())[1] #legal_actions_mask when there is nothing to play
+
+_ROLLOUT_SEEDS = 1 << 31 #playout seeds are drawn from [0,_ROLLOUT_SEEDS), see interleaved_rollouts
+
+def _make_rng(seed):
+    #per-state random stream - python's generator is much quicker than numpy's for the single draws the rules make
+    if not isinstance(seed,np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return random.Random(int.from_bytes(seed.generate_state(4).tobytes(),'little'))
+
+#compact state serialisation - fixed header, then the packed buffer, returns, movement tracker,
+#history, player names and cached legal actions. Bump the version whenever the packed layout changes.
+_SERIAL_MAGIC = b'ELG'
+_SERIAL_VERSION = 3
+_SERIAL_HEADER = struct.Struct('<3sBBBHHHH') #magic,version,players,end turn,tracker,history,names,legal actions lengths
+_OWNER_REGIONS = ['ownerchoose','ownerchooseplus'] #non-area 'regions' a movement tracker can hold
+
+_MAX_PATTERNS = _MAX_PLAYERS #one per opponent for 'Provinceone', otherwise at most two
+
+class _MoveTracker:
+    """Where caballeros may move from/to during a multi-step card or placement action,
+    and per-pattern counts of which caballeros may still move.
+    Trackers are shared between clones and undo frames until one of them changes it - get a
+    writable one from ElGrandeGameState._move_info_for_update before any change.
+    """
+    __slots__ = ('fromregs','toregs','lockfrom','lockto','moving','player','prev','fromcondition',
+                 'num_patterns','pat_player','pat_allowed','pat_max','pat_min','pat_cabs','shared','hash_key')
+
+    def __init__(self):
+        self.fromregs = []
+        self.toregs = []
+        self.lockfrom = False
+        self.lockto = False
+        self.moving = False
+        self.player = 0
+        self.prev = 0 #legal cab moves at the last substep as a bitset (see _cab_move_actions), so later substeps can't add new possibilities
+        self.fromcondition = 0
+        #patterns - player -1 means any player, otherwise 'allowed' says whether that player is included or excluded
+        self.num_patterns = 0
+        self.pat_player = [-1]*_MAX_PATTERNS
+        self.pat_allowed = [True]*_MAX_PATTERNS
+        self.pat_max = [0]*_MAX_PATTERNS
+        self.pat_min = [0]*_MAX_PATTERNS
+        self.pat_cabs = [0]*_MAX_PATTERNS
+        self.shared = False
+        self.hash_key = None #cached for ElGrandeGameState.zobrist_hash, cleared whenever the tracker is handed out for update
+
+    def copy(self):
+        #region lists are only ever replaced, so only the fixed-size pattern arrays are copied
+        other = _MoveTracker.__new__(_MoveTracker)
+        other.fromregs = self.fromregs
+        other.toregs = self.toregs
+        other.lockfrom = self.lockfrom
+        other.lockto = self.lockto
+        other.moving = self.moving
+        other.player = self.player
+        other.prev = self.prev
+        other.fromcondition = self.fromcondition
+        other.num_patterns = self.num_patterns
+        other.pat_player = self.pat_player.copy()
+        other.pat_allowed = self.pat_allowed.copy()
+        other.pat_max = self.pat_max.copy()
+        other.pat_min = self.pat_min.copy()
+        other.pat_cabs = self.pat_cabs.copy()
+        other.shared = False
+        other.hash_key = None
+        return other
+
+    def add_pattern(self,player,allowed,max_cabs,min_cabs):
+        i = self.num_patterns
+        assert(i<_MAX_PATTERNS)
+        self.pat_player[i] = player
+        self.pat_allowed[i] = allowed
+        self.pat_max[i] = max_cabs
+        self.pat_min[i] = min_cabs
+        self.pat_cabs[i] = 0
+        self.num_patterns = i+1
+
+    def matches(self,i,player):
+        #does pattern i cover caballeros of this player?
+        if self.pat_player[i] == -1:
+            return True #found an unrestricted pattern
+        #a pattern either says cabs of this colour are allowed, or cabs not of this colour are allowed
+        return (self.pat_player[i]==player) == self.pat_allowed[i]
+
+    def key(self):
+        #64-bit key of everything in the tracker
+        if self.hash_key is None:
+            self.hash_key = _mix64(hash(tuple(self.to_values())) & _MASK64)
+        return self.hash_key
+
+    def open_patterns(self):
+        #indices of patterns that can still take more caballeros
+        return [i for i in range(self.num_patterns) if self.pat_cabs[i]<self.pat_max[i]]
+
+    def to_values(self):
+        #flat list of small ints for serialisation - owner-choice placeholder regions become negative codes
+        regions = lambda regs: [len(regs)] + [r if isinstance(r,int) else -1-_OWNER_REGIONS.index(r) for r in regs]
+        prev = _cab_move_actions(self.prev)
+        return ([int(self.lockfrom),int(self.lockto),int(self.moving),self.player,self.fromcondition,self.num_patterns]
+                + self.pat_player + [int(a) for a in self.pat_allowed] + self.pat_max + self.pat_min + self.pat_cabs
+                + regions(self.fromregs) + regions(self.toregs) + [len(prev)] + prev)
+
+    @classmethod
+    def from_values(cls,values):
+        mt = cls()
+        mt.lockfrom,mt.lockto,mt.moving = bool(values[0]),bool(values[1]),bool(values[2])
+        mt.player,mt.fromcondition,mt.num_patterns = values[3:6]
+        pos = 6
+        for name in ['pat_player','pat_allowed','pat_max','pat_min','pat_cabs']:
+            setattr(mt,name,values[pos:pos+_MAX_PATTERNS])
+            pos += _MAX_PATTERNS
+        mt.pat_allowed = [bool(a) for a in mt.pat_allowed]
+        for name in ['fromregs','toregs','prev']:
+            n = values[pos]
+            items = values[pos+1:pos+1+n]
+            if name!='prev':
+                items = [r if r>=0 else _OWNER_REGIONS[-1-r] for r in items]
+            else:
+                items = _cab_move_bits(items)
+            setattr(mt,name,items)
+            pos += 1+n
+        return mt
+
 class ElGrandeGameState(pyspiel.State):
     """El Grande Game in open_spiel format
     """
 
-    def __init__(self, game):
+    def __init__(self, game, from_state=None, serialized=None):
         super().__init__(self,game)
         self._game = game
-        self._cur_player = 0
+        if from_state is not None:
+            #clone constructor - copy packed state across, skipping board loading/generation
+            self._copy_state(from_state)
+            return
+        if serialized is not None:
+            self._decode_state(serialized)
+            return
+        self._packed = np.zeros(_PK_END,_PK_DTYPE)
+        self._bind_views()
+        self._rng = game._spawn_rng() #this state's random stream, shared with its clones
         self._num_players = game._num_players
         self._game_state = game._game_state
-        self._is_terminal = False
-        self._history = []
+        self._history = None #shared-prefix chain of (previous,action) pairs
+        self._undo_stack = None #one frame per applied action once record_undo is called, for undo_action
+        self._legal = None #cached (actions,mask) for the current position, see _legal_cache
+        self._rollout = False #trusted rollout mode, see start_rollout
+        self._zobrist = None #hash of the packed buffer, kept up to date once first asked for - see zobrist_hash
+        self._score_cache = None #see _scored_regions
         self._winner = False
         #self._dealing = True #for games with card dealing on the fly and CHANCE mode on
         self._players = []
+        self._player_ids = {}
         self._end_turn = _MAX_TURNS #default end turn is 9
         if self._game_state != '':
+            #parse each document revision once, later states are copies of the parsed one
+            key = _doc_cache_key(self._game_state)
+            base = _DOC_STATE_CACHE.get(key) if key is not None else None
+            if base is not None:
+                _DOC_STATE_CACHE.move_to_end(key)
+                rng = self._rng
+                self._copy_state(base)
+                #keep this game's own document and random stream, not those of the game that loaded it first
+                self._game_state = game._game_state
+                self._rng = rng
+                return
             self._load_game_state(self._game_state)
+            if key is not None:
+                _DOC_STATE_CACHE[key] = self.clone()
+                if len(_DOC_STATE_CACHE) > _DOC_STATE_CACHE_SIZE:
+                    _DOC_STATE_CACHE.popitem(last=False)
         else:
             #start a game with a random player assortment
             self._players=["P"+str(i) for i in range(self._num_players)]
             self._generate_board({'Players':self._players})
 
     # Helper functions (not part of the OpenSpiel API).
+
+    def _copy_state(self,other):
+        #the packed buffer is copied, immutable data (players, history prefix) is shared
+        self._packed = other._packed.copy()
+        self._bind_views()
+        self._num_players = other._num_players
+        self._game_state = other._game_state
+        self._players = other._players
+        self._player_ids = other._player_ids
+        self._winner = other._winner
+        self._end_turn = other._end_turn
+        self._history = other._history
+        self._undo_stack = None #clones start with nothing to undo, and don't record it until asked
+        self._rollout = False
+        self._rng = other._rng
+        self._zobrist = other._zobrist
+        self._score_cache = other._score_cache
+        self._legal = other._legal #cached actions and mask are read-only, so can be shared
+        #returns are only ever replaced, never modified in place
+        self._win_points = other._win_points
+        self._state_returns = other._state_returns
+        self._movement_tracking = other._share_move_info()
+
+    def _decode_state(self,data):
+        #inverse of serialize - the packed buffer is a view onto data where data is writable
+        buf = memoryview(data)
+        magic,version,num_players,end_turn,tracker_len,history_len,names_len,legal_len = _SERIAL_HEADER.unpack_from(buf)
+        if magic != _SERIAL_MAGIC or version != _SERIAL_VERSION:
+            raise ValueError("Unsupported El Grande state format " + str((magic,version)))
+        pos = _SERIAL_HEADER.size
+        self._packed = np.frombuffer(buf,dtype='<i2',count=_PK_END,offset=pos)
+        if not self._packed.flags.writeable:
+            self._packed = self._packed.copy()
+        self._bind_views()
+        pos += _PK_END*2
+        returns = np.frombuffer(buf,dtype='<f8',count=2*num_players,offset=pos)
+        self._win_points = returns[:num_players].copy()
+        self._state_returns = returns[num_players:].copy()
+        pos += 16*num_players
+        self._movement_tracking = _MoveTracker.from_values(np.frombuffer(buf,dtype='<i2',count=tracker_len,offset=pos).tolist())
+        pos += 2*tracker_len
+        self._history = None
+        for action in np.frombuffer(buf,dtype='<i2',count=history_len,offset=pos).tolist():
+            self._history = (self._history,action)
+        pos += 2*history_len
+        self._players = bytes(buf[pos:pos+names_len]).decode('utf-8').split('\0')
+        pos += names_len
+        self._player_ids = {name:i for i,name in enumerate(self._players)}
+        self._num_players = num_players
+        self._end_turn = end_turn
+        self._game_state = self._game._game_state
+        self._undo_stack = None
+        #building the legal actions can narrow the tracker's cab moves, so a cached set is restored as it was rather than rebuilt
+        self._legal = _legal_entry(np.frombuffer(buf,dtype='<i2',count=legal_len,offset=pos).tolist()) if legal_len else None
+        self._rollout = False
+        self._zobrist = None
+        self._score_cache = None
+        self._rng = self._game._spawn_rng()
+        self._winner = False
+
+    def _bind_views(self):
+        #named views into the packed state buffer
+        pk = self._packed
+        self._board_state = pk[_PK_BOARD:_PK_ACARD].reshape(_ST_BDX_END,_ST_BDY_END)
+        self._acard_state = pk[_PK_ACARD:_PK_ACARD_ROUND]
+        self._acard_round = pk[_PK_ACARD_ROUND:_PK_PCARD]
+        self._pcard_state = pk[_PK_PCARD:_PK_PAST_PCARD]
+        self._past_pcard_state = pk[_PK_PAST_PCARD:_PK_TURN]
+        self._turn_state = pk[_PK_TURN:_PK_REWARDS]
+        self._rewards = pk[_PK_REWARDS:_PK_SCOREBOARDS].reshape(_NUM_EXT_REGIONS,3)
+        self._scoreboard_regions = pk[_PK_SCOREBOARDS:_PK_LEFT]
+        self._left_queue = pk[_PK_LEFT:_PK_DONE]
+        self._done_queue = pk[_PK_DONE:_PK_LOCATIONS]
+        self._locations = pk[_PK_LOCATIONS:_PK_META]
+        self._meta = pk[_PK_META:_PK_END]
+
+    #single values and player queues stored in the packed buffer
+
+    @property
+    def _chosen_card(self):
+        return self._meta.item(_PK_M_CARD)
+
+    @_chosen_card.setter
+    def _chosen_card(self,card_id):
+        self._meta[_PK_M_CARD] = card_id
+
+    @property
+    def _cur_player(self):
+        return self._meta.item(_PK_M_PLAYER)
+
+    @_cur_player.setter
+    def _cur_player(self,player):
+        self._meta[_PK_M_PLAYER] = player
+
+    @property
+    def _is_terminal(self):
+        return self._meta.item(_PK_M_TERMINAL) != 0
+
+    @_is_terminal.setter
+    def _is_terminal(self,terminal):
+        self._meta[_PK_M_TERMINAL] = terminal
+
+    @property
+    def _playersleft(self):
+        return self._left_queue[:self._meta[_PK_M_NUM_LEFT]].tolist()
+
+    @_playersleft.setter
+    def _playersleft(self,players):
+        self._left_queue[:len(players)] = players
+        self._meta[_PK_M_NUM_LEFT] = len(players)
+
+    @property
+    def _playersdone(self):
+        return self._done_queue[:self._meta[_PK_M_NUM_DONE]].tolist()
+
+    @_playersdone.setter
+    def _playersdone(self,players):
+        self._done_queue[:len(players)] = players
+        self._meta[_PK_M_NUM_DONE] = len(players)
+
+    def _next_in_queue(self):
+        #drop the head of the players-left queue in place, and make the new head the current player
+        left = self._meta.item(_PK_M_NUM_LEFT)
+        self._left_queue[:left-1] = self._left_queue[1:left]
+        self._meta[_PK_M_NUM_LEFT] = left-1
+        self._cur_player = self._left_queue.item(0)
     
     #info about card names and abilities, region names, player colours
     
     def _get_rid(self,regionName):
-        return pieces._REGIONS.index(regionName)
+        return _REGION_IDS[regionName]
     
     def _get_pid(self,playerName):
-        return self._players.index(playerName)
+        return self._player_ids[playerName]
     
     def _get_player_name(self,pid):
         assert(pid<self._num_players)
         return self._players[pid]
 
     def _get_cid(self,cardName):
-        return pieces._CARDS[cardName]['idx']
+        return _CARD_IDS[cardName]
 
     def _get_phaseid(self,phaseName):
-        return _PHASE_NAMES.index(phaseName)
+        return _PHASE_IDS[phaseName]
 
     def _get_current_card(self):
-        ccard = [c for c in range(_NUM_ACTION_CARDS) if self._acard_state[c] == _ST_AC_CHOSEN]
+        card_id = self._chosen_card
+        return None if card_id<0 else _CARD_INFO[card_id]
+
+    def _sync_chosen_card(self):
+        #find the chosen card after bulk changes to _acard_state
+        ccard = np.flatnonzero(self._acard_state == _ST_AC_CHOSEN)
         assert(len(ccard)<=1) #can have at most one card chosen at a time
-        if len(ccard)==0:
-            return None
-        else:
-            return pieces._CARDS[pieces._CARDTRACK[ccard[0]]]
+        self._chosen_card = ccard[0] if len(ccard)>0 else -1
 
     def _get_round(self):
-        return self._turn_state[_ST_TN_ROUND]
+        return self._turn_state.item(_ST_TN_ROUND)
+
+    def _get_phase(self):
+        return self._turn_state.item(_ST_TN_PHASE)
 
     def _get_current_phase_name(self):
-        return _PHASE_NAMES[self._turn_state[_ST_TN_PHASE]]
+        return _PHASE_NAMES[self._get_phase()]
 
     def _region_presence(self,player,withCastillo=True):
         #in how many regions does this player have any pieces?
@@ -200,55 +800,31 @@ class ElGrandeGameState(pyspiel.State):
 
     def _update_current_card_status(self,status):
         #work out which is the current action card, and set it to new status
-        ccard = [c for c in range(_NUM_ACTION_CARDS) if self._acard_state[c] == _ST_AC_CHOSEN]
-        assert(len(ccard)==1) #raise error if there isn't a card to update
-        self._acard_state[ccard[0]] = status
+        card_id = self._chosen_card
+        assert(card_id>=0) #raise error if there isn't a card to update
+        self._acard_state[card_id] = status
+        if status != _ST_AC_CHOSEN:
+            self._chosen_card = -1
        
     def _card_moves(self):
         # return 0==instant,1=1-step,2=2 or more
-        card = self._get_current_card()
-        if card['actiontype']=='move':
-            fromreg=card['details']['from']['region']
-            toreg=card['details']['to']['region']
-            if fromreg=='ownerchooseplus':
-                #Angry King
-                return _ST_STEPS_0
-            if fromreg in ['court','province'] and toreg in ['court','province']:
-                #Decay, Decayall, Court
-                return _ST_STEPS_0 
-            if fromreg=='ownerchoose' or toreg=='ownerchoose':
-                return _ST_STEPS_1
-        elif card['actiontype']=='score':
-            if card['details'].get('region','')=='selfchoose':
-                return _ST_STEPS_1
-            else:
-                return _ST_STEPS_0
-        elif card['actiontype']=='uniquescore':
-            return _ST_STEPS_1
-        elif card['actiontype'] in ['scoreboard','power','grande','king']:
-            return _ST_STEPS_1
-
-        #default is a multi-move, since this is the most common
-        return _ST_STEPS_MULTI 
+        return _CARD_STEPS[self._chosen_card]
 
     def _blank_board(self,deal=False):
-        self._board_state = np.full((_ST_BDX_END,_ST_BDY_END),0)
-        self._acard_state = np.full(_NUM_ACTION_CARDS,0)
-        self._acard_round = np.full(_NUM_ACTION_CARDS,0)
+        self._packed[:] = 0
         if deal:
             self._shuffle_acards() #for deterministic 'deal-at-start' card placement
-        self._pcard_state = np.full(_NUM_POWER_CARDS,0)
-        self._past_pcard_state = np.full(_NUM_POWER_CARDS,0)
-        self._turn_state = np.full(_ST_TN_END,0)
-        self._rewards = pieces._POINTS.copy() 
-        self._scoreboards = pieces._SCOREBOARDS.copy()
+        self._rewards[:] = pieces._POINTS
+        self._scoreboard_regions[:] = -1
+        self._locations[:] = -1
+        self._chosen_card = -1
         self._init_move_info()
 
     def _shuffle_acards(self):
         for i in range(_NUM_FULL_DECKS):
             deckname='Deck'+str(i+1)
             order = pieces._DECKTRACK[deckname].copy()
-            random.shuffle(order)
+            self._rng.shuffle(order)
             for j in range(len(order)):
                 cid = self._get_cid(order[j])
                 self._acard_round[cid]=j+1
@@ -264,30 +840,32 @@ class ElGrandeGameState(pyspiel.State):
         #random allocate players to region, put king,cabs and grandes down
         regions = [i for i in range(_NUM_REGIONS)]
         for i in range(self._num_players):
-            region = random.choice(regions)
+            region = self._rng.choice(regions)
             self._board_state[region,i]=2
             self._board_state[pieces._COURT,i]=7
             self._board_state[pieces._PROVINCE,i]=21
-            self._board_state[region,_ST_BDY_GRANDE_KING] |= (pow(2,i))
+            self._place_grande(region,i)
             regions = [i for i in regions if i!=region]
-        king_region = random.choice(regions)
-        self._board_state[king_region,_ST_BDY_GRANDE_KING] |= (pow(2,_ST_MASK_KING))
+        king_region = self._rng.choice(regions)
+        self._place_king(king_region)
         self._turn_state[_ST_TN_ROUND]=1
         self._turn_state[_ST_TN_PHASE] = _ST_PHASE_POWER 
 
     #turn all relevant state info from DB format into game format
     def _load_game_state(self,jsonData):
-        self._history = []
+        self._history = None
         self._blank_board()
         self._state_add_players(jsonData['players'])
         self._state_add_king(jsonData['king'])
         self._state_add_cabs_grandes(jsonData['pieces'])
         self._state_add_deck_info(jsonData['cards'],jsonData['pastcards'],jsonData['deckpositions'],jsonData['turninfo'])
         self._state_add_turn_info(jsonData['turninfo'])
+        self._sync_chosen_card()
 
        
     def _state_add_players(self, playerData):
         self._players = playerData
+        self._player_ids = {name:i for i,name in enumerate(playerData)}
         self._num_players = len(self._players)
         self._win_points = np.full(self._num_players, 0)
         self._state_returns = np.full(self._num_players, 0)
@@ -298,13 +876,17 @@ class ElGrandeGameState(pyspiel.State):
     def _state_add_king(self,region_name):
         region_id = self._get_rid(region_name)
         assert(region_id < _ST_BDX_CASTILLO )
-        self._board_state[(_ST_BDX_REGIONS+region_id),_ST_BDY_GRANDE_KING] |= (pow(2,_ST_MASK_KING))
+        self._place_king(region_id)
         
+    def _place_king(self,region_id):
+        self._board_state[(_ST_BDX_REGIONS+region_id),_ST_BDY_GRANDE_KING] |= _KING_BIT
+        self._locations[_LOC_KING] = region_id
+
     def _region_has_king(self,region_id):
-        return self._board_state[(_ST_BDX_REGIONS+region_id),_ST_BDY_GRANDE_KING] & (pow(2,_ST_MASK_KING)) == (pow(2,_ST_MASK_KING))
+        return self._locations.item(_LOC_KING) == region_id
     
     def _king_region(self):
-        return int(np.where(self._board_state[:,_ST_BDY_GRANDE_KING]& (pow(2,_ST_MASK_KING))>0)[0][0])
+        return self._locations.item(_LOC_KING)
     
     def _state_add_cabs_grandes(self,data):
         for player_name in data.keys():
@@ -313,17 +895,21 @@ class ElGrandeGameState(pyspiel.State):
                 if key=="grande":
                     region_id = self._get_rid(data[player_name][key])
                     assert(region_id < _ST_BDX_CASTILLO)
-                    self._board_state[(_ST_BDX_REGIONS+region_id),_ST_BDY_GRANDE_KING] |= (pow(2,player_id))
+                    self._place_grande(region_id,player_id)
                 else:
                     region_id = self._get_rid(key)
                     assert(region_id < _ST_BDX_END)
                     self._board_state[(_ST_BDX_REGIONS+region_id),_ST_BDY_CABS + player_id]=data[player_name][key]                                                                                                     
 
+    def _place_grande(self,region_id,player_id):
+        self._board_state[(_ST_BDX_REGIONS+region_id),_ST_BDY_GRANDE_KING] |= _PLAYER_BIT[player_id]
+        self._locations[_LOC_GRANDES+player_id] = region_id
+
     def _region_has_grande(self,region_id,player_id):
-        return self._board_state[(_ST_BDX_REGIONS+region_id),_ST_BDY_GRANDE_KING] & (pow(2,player_id)) == (pow(2,player_id))
+        return self._locations.item(_LOC_GRANDES+player_id) == region_id
 
     def _grande_region(self,player_id):
-        return int(np.where(self._board_state[:,_ST_BDY_GRANDE_KING]& (pow(2,player_id))>0)[0][0])
+        return self._locations.item(_LOC_GRANDES+player_id)
     
     def _region_cabcount(self,region_id,player_id):
         return self._board_state[(_ST_BDX_REGIONS+region_id),_ST_BDY_CABS + player_id]
@@ -331,20 +917,21 @@ class ElGrandeGameState(pyspiel.State):
     def _region_is_secret_choice(self,region_id,player_id=-1):
         if player_id<0:
             player_id=self._cur_player
-        return (self._board_state[region_id,_ST_BDY_SECRET] & pow(2,player_id) > 0)
+        return self._locations.item(_LOC_SECRETS+player_id) == region_id
 
     def _has_secret_region(self,player_id=-1):
         if player_id<0:
             player_id=self._cur_player
-        if len(np.where(self._board_state[:,_ST_BDY_SECRET]& pow(2,player_id) > 0)[0])>0:
-            return True
-        else:
-            return False
+        return self._locations.item(_LOC_SECRETS+player_id) >= 0
 
     def _secret_region(self,player_id=-1):
         if player_id<0:
             player_id=self._cur_player
-        return np.where(self._board_state[:,_ST_BDY_SECRET]& pow(2,player_id) > 0)[0][0]
+        return self._locations.item(_LOC_SECRETS+player_id)
+
+    def _clear_secret_regions(self):
+        self._board_state[:,_ST_BDY_SECRET]=0
+        self._locations[_LOC_SECRETS:] = -1
 
     def _set_rewards(self,new_scores):
         #support both TERMINAL and REWARD mode
@@ -357,7 +944,8 @@ class ElGrandeGameState(pyspiel.State):
     def _next_score_step_player(self):
         #find another player who needs to make a secret region choice in scoring round
         #return -1 if no such player
-        waiting_players = [i for i in range(self._num_players) if not self._has_secret_region(i) and self._board_state[pieces._CASTILLO,i]>0]
+        castillo = self._board_state[pieces._CASTILLO].tolist()
+        waiting_players = [i for i in range(self._num_players) if not self._has_secret_region(i) and castillo[i]>0]
         if len(waiting_players)>0:
             return waiting_players[0]
         else:
@@ -418,7 +1006,7 @@ class ElGrandeGameState(pyspiel.State):
                 player_id = self._get_pid(player_name)
                 power_id = int(data['powercards'][player_name]) 
                 assert((power_id-1) <= _NUM_POWER_CARDS and power_id > 0) #power_id from 1 to _NUM_POWER_CARDS
-                self._pcard_state[(power_id-1)] |= pow(2,player_id)
+                self._pcard_state[(power_id-1)] |= _PLAYER_BIT[player_id]
 
         #past power cards
         if len(data['powerplayed'])>0:
@@ -426,14 +1014,14 @@ class ElGrandeGameState(pyspiel.State):
                 player_id = self._get_pid(player_name)
                 for power_id in data['powerplayed'][player_name]:
                     assert((power_id-1) <= _NUM_POWER_CARDS and power_id > 0) #power_id from 1 to _NUM_POWER_CARDS
-                    self._past_pcard_state[(power_id-1)] |= pow(2,player_id)
+                    self._past_pcard_state[(power_id-1)] |= _PLAYER_BIT[player_id]
 
         #round
         self._turn_state[_ST_TN_ROUND]=data['round']
         #phase
         self._turn_state[_ST_TN_PHASE]=self._get_phaseid(data['phase'])
         #for 'deal all at game start' implementation, don't need explicit round start phase
-        if self._turn_state[_ST_TN_PHASE] == _ST_PHASE_START:
+        if self._get_phase() == _ST_PHASE_START:
             self._turn_state[_ST_TN_PHASE] = _ST_PHASE_POWER
             #ensure Deck5 always turned over at start
             self._acard_state[-1] = _ST_AC_DEALT
@@ -448,15 +1036,15 @@ class ElGrandeGameState(pyspiel.State):
         #player order - stored internally for ease of use, not strictly needed in _state_ elements
         if len(data['playersleft']) == 0:
             #nothing more to do in this phase, update to next
-            if self._turn_state[_ST_TN_PHASE] == _ST_PHASE_POWER:
+            if self._get_phase() == _ST_PHASE_POWER:
                 self._update_players_after_power()
             else:
                 self._update_players_after_action()
-        elif self._turn_state[_ST_TN_PHASE] == _ST_PHASE_SCORE and not _SCORING_ROUND[self._turn_state[_ST_TN_ROUND]]:
+        elif self._get_phase() == _ST_PHASE_SCORE and not _SCORING_ROUND[self._get_round()]:
             #scoring phase with no score action - skip to next
             self._turn_state[_ST_TN_PHASE] = _ST_PHASE_POWER
             self._turn_state[_ST_TN_ROUND] += 1
-            self._acard_state = np.array([1 if self._acard_round[i]==self._turn_state[_ST_TN_ROUND] else self._acard_state[i] for i in range(_NUM_ACTION_CARDS)])
+            self._acard_state[self._acard_round==self._turn_state[_ST_TN_ROUND]] = _ST_AC_DEALT
             self._acard_state[-1]=1
             self._playersleft=[self._get_pid(p) for p in data['playersleft']]
             self._playersdone=[self._get_pid(p) for p in data['playersdone']]
@@ -489,11 +1077,12 @@ class ElGrandeGameState(pyspiel.State):
     
     def _deal_cards_from_action(self,action):
         #mark previous cards as played
-        self._acard_state = [_ST_AC_UNPLAYED if c==_ST_AC_UNPLAYED else _ST_AC_DONE for c in self._acard_state]
+        self._acard_state[self._acard_state!=_ST_AC_UNPLAYED] = _ST_AC_DONE
         deck_positions = self._deck_pos_for_action(action)
         for i in range(len(deck_positions)):
             deck="Deck"+str(i+1)
             self._acard_state[self._get_cid(pieces._DECKTRACK[deck][deck_positions[i]])]=_ST_AC_DEALT
+        self._chosen_card = -1
         self._turn_state[_ST_TN_PHASE]=self._get_phaseid('power')
         self._dealing=False
              
@@ -504,46 +1093,48 @@ class ElGrandeGameState(pyspiel.State):
              
     def _assign_power(self,power_id):
         #power_id is array position 0..12
-        self._pcard_state[power_id] |= pow(2,self._cur_player)
-        self._past_pcard_state[power_id] |= pow(2,self._cur_player)
+        self._pcard_state[power_id] |= _PLAYER_BIT[self._cur_player]
+        self._past_pcard_state[power_id] |= _PLAYER_BIT[self._cur_player]
         
     def _retrieve_power(self,power_id):
-        self._past_pcard_state[power_id] -= pow(2,self._cur_player)
+        self._past_pcard_state[power_id] -= _PLAYER_BIT[self._cur_player]
        
     def _available_powers(self):
         #power cards available to current player in array position 0..12
         #check everyone's current cards, and current player's past 
-        in_deck = [p for p in range(_NUM_POWER_CARDS) if self._pcard_state[p]==0]
-        unused = [p for p in range(_NUM_POWER_CARDS) if self._past_pcard_state[p] & pow(2,self._cur_player)==0]
-        return [p for p in range(_NUM_POWER_CARDS) if p in in_deck and p in unused]
+        available = (self._pcard_state==0) & (self._past_pcard_state & _PLAYER_BIT[self._cur_player]==0)
+        return np.flatnonzero(available).tolist()
 
     def _set_secret_region(self,region_id,player_id=-1):
         if player_id==-1:
             player_id = self._cur_player
-        #ensure only one set at a time
-        mask = pow(2,(_MAX_PLAYERS+1))-pow(2,player_id)-1 #masks out everything except this player
-        self._board_state[:_ST_BDX_COURT,_ST_BDY_SECRET] &= np.full(_ST_BDX_COURT,mask)
-        self._board_state[region_id,_ST_BDY_SECRET] |= pow(2,player_id)
+        #ensure only one set at a time - clear this player's bit from their previous choice
+        old_region = self._locations.item(_LOC_SECRETS+player_id)
+        if old_region>=0:
+            self._board_state[old_region,_ST_BDY_SECRET] &= ~_PLAYER_BIT[player_id]
+        self._board_state[region_id,_ST_BDY_SECRET] |= _PLAYER_BIT[player_id]
+        self._locations[_LOC_SECRETS+player_id] = region_id
 
     def _move_grande(self,region_id):
-        #mask out current player's grande from everywhere else
-        #note the mask for this has to fit one entry per grande for all players, plus also king
-        mask = pow(2,(_MAX_PLAYERS+2))-pow(2,self._cur_player)-1 #masks out everything except this player
-        self._board_state[:_ST_BDX_COURT,_ST_BDY_GRANDE_KING] &= np.full(_ST_BDX_COURT,mask)
-        self._board_state[region_id,_ST_BDY_GRANDE_KING] |= pow(2,self._cur_player)
+        #clear current player's grande from where it was, then place it
+        old_region = self._grande_region(self._cur_player)
+        if old_region>=0:
+            self._board_state[old_region,_ST_BDY_GRANDE_KING] &= ~_PLAYER_BIT[self._cur_player]
+        self._place_grande(region_id,self._cur_player)
         
     def _move_king(self,region_id):
-        mask = pow(2,(_MAX_PLAYERS+2))-pow(2,_ST_MASK_KING)-1 #masks out everything except king
-        self._board_state[:_ST_BDX_COURT,_ST_BDY_GRANDE_KING] &= np.full(_ST_BDX_COURT,mask)
-        self._board_state[region_id,_ST_BDY_GRANDE_KING] |= pow(2,_ST_MASK_KING)
+        old_region = self._king_region()
+        if old_region>=0:
+            self._board_state[old_region,_ST_BDY_GRANDE_KING] &= ~_KING_BIT
+        self._place_king(region_id)
 
     def _move_scoreboard(self,board_id,region_id):
-        points = self._scoreboards[board_id]['points']
-        self._rewards[region_id]=points
-        oldregion = self._scoreboards[board_id].get('region',-1)
-        if oldregion>0 and oldregion<len(self._rewards):
+        points = pieces._SCOREBOARDS[board_id]['points']
+        oldregion = self._scoreboard_regions[board_id]
+        if oldregion>=0:
             self._rewards[oldregion] = pieces._POINTS[oldregion]
-        self._scoreboards[board_id]['region']=region_id
+        self._rewards[region_id]=points
+        self._scoreboard_regions[board_id]=region_id
 
     def _move_one_cab(self,from_region, to_region, of_player):
         assert(self._board_state[from_region,of_player]>0)
@@ -553,10 +1144,11 @@ class ElGrandeGameState(pyspiel.State):
         self._register_cab_moved(from_region,to_region,of_player)
       
         #ensure locks are enforced
-        if self._movement_tracking['lockfrom']:
-            self._movement_tracking['from']=[from_region]
-        if self._movement_tracking['lockto']:
-            self._movement_tracking['to']=[to_region]
+        mt = self._move_info_for_update()
+        if mt.lockfrom:
+            mt.fromregs=[from_region]
+        if mt.lockto:
+            mt.toregs=[to_region]
  
         #check if the patterns are all filled, and if so, set moving to false
         self._check_move_patterns_filled()
@@ -570,16 +1162,16 @@ class ElGrandeGameState(pyspiel.State):
             retstr = retstr + " K"
         retstr = retstr.ljust(18," ")+ "-  " + pieces._REGIONS[region_id].rjust(18," ")
         if region_id < _NUM_EXT_REGIONS:
-            retstr = retstr + str(self._rewards[region_id])
+            retstr = retstr + str(self._rewards[region_id].tolist())
         return retstr
     
     def _power_str(self,player_id):
-        current = np.where(self._pcard_state & pow(2,player_id) == pow(2,player_id))[0] 
+        current = np.where(self._pcard_state & _PLAYER_BIT[player_id] == _PLAYER_BIT[player_id])[0] 
         if len(current)==0:
             cstr = "X"
         else:
             cstr = str(current[0] + 1)
-        past = [str(p+1) for p in np.where(self._past_pcard_state & pow(2,player_id) == pow(2,player_id))[0]]
+        past = [str(p+1) for p in np.where(self._past_pcard_state & _PLAYER_BIT[player_id] == _PLAYER_BIT[player_id])[0]]
         return cstr + " (" + ",".join(past) + ")" + "  -  playerid " + str(player_id)
 
     def _acard_str(self,cardpos):
@@ -596,7 +1188,7 @@ class ElGrandeGameState(pyspiel.State):
         return "|".join(names)
     
     def _turn_info_str(self):
-        return "Round "+ str(self._turn_state[_ST_TN_ROUND]) + " " + _PHASE_NAMES[self._turn_state[_ST_TN_PHASE]] + "(player "+str(self._cur_player)+") - Cumulative Scores " +str(self._current_score())    
+        return "Round "+ str(self._get_round()) + " " + self._get_current_phase_name() + "(player "+str(self._cur_player)+") - Cumulative Scores " +str(self._current_score())    
    
     def _move_castillo_pieces(self):
         for i in range(self._num_players):
@@ -611,74 +1203,38 @@ class ElGrandeGameState(pyspiel.State):
         #choose a region for other players. For now, simulating other players
         #by choosing a "reasonable" action for each other player - the one in 
         #which they score the most
-
-        bestreg=[[] for i in range(self._num_players)]
-        hiscores = np.full(self._num_players,0)
-        for i in range(_NUM_REGIONS):
-            scores=self._score_one_region(i)
-            #throw out old 'bests' if the hiscore improved
-            bestreg = [bestreg[n] if scores[n]<=hiscores[n] else [] for n in range(self._num_players)]
-            hiscores = [max(hiscores[n],scores[n]) for n in range(self._num_players)]
-            bestreg = [bestreg[n]+[i] if scores[n]==hiscores[n] else bestreg[n] for n in range(self._num_players)]
-
-        regions = np.array([random.choice(bestreg[n]) if len(bestreg[n])>0 else random.choice(_NUM_REGIONS) for n in range(self._num_players)])
+        region_scores = self._region_scores()[:_NUM_REGIONS]
+        best = region_scores==region_scores.max(0)
+        regions = np.array([self._rng.choice(np.flatnonzero(best[:,n])) for n in range(self._num_players)])
         regions[self._cur_player]=region
 
-        #determine any doubles before scoring
-        score_regions=[]
-        for i in range(self._num_players):
-            if not any(regions[np.arange(len(regions))!=i]==regions[i]):
-                score_regions=score_regions+regions[i]
-        #print("Scored regions:")
-        #print(score_regions)
-        final_scores=np.full(self._num_players,0)
-        for r in score_regions:
-            final_scores += self._score_one_region(r)
-        self._set_rewards(final_scores)
+        #only regions chosen by exactly one player are scored
+        chosen,counts = np.unique(regions,return_counts=True)
+        self._set_rewards(region_scores[chosen[counts==1]].sum(0))
 
  
     def _special_score(self,details):
-        final_scores=np.full(self._num_players,0)
         choice_step=False
+        top_only=False
         region=details.get('region','')
+        top_points=self._rewards[:_NUM_EXT_REGIONS,0]
+        cab_totals=self._board_state[:_NUM_EXT_REGIONS,:self._num_players].sum(1)
+        scored=np.full(_NUM_EXT_REGIONS,False)
         if region=='fours':
-            for i in range(_NUM_EXT_REGIONS): 
-                if self._rewards[i][0]==4:
-                    final_scores = final_scores + self._score_one_region(i)
+            scored=top_points==4
         elif region=='fives':
-            for i in range(_NUM_EXT_REGIONS):
-                if self._rewards[i][0]==5:
-                    final_scores = final_scores + self._score_one_region(i)
+            scored=top_points==5
         elif region=='sixsevens':
-            for i in range(_NUM_EXT_REGIONS):
-                if self._rewards[i][0]==6 or self._rewards[i][0]==7:
-                    final_scores = final_scores + self._score_one_region(i)
+            scored=(top_points==6) | (top_points==7)
         elif region=='castillo':
-            final_scores = final_scores + self._score_one_region(pieces._CASTILLO)
+            scored[pieces._CASTILLO]=True
         elif region=='locab':
-            loregions=[]
-            currentlow=100
-            for i in range(_NUM_EXT_REGIONS):
-                this_count=sum(self._board_state[i,:self._num_players])
-                if this_count<currentlow and this_count>0:
-                    currentlow=this_count
-                    loregions=[i]
-                elif this_count==currentlow:
-                    loregions = loregions + [i]
-            for i in loregions:
-                final_scores = final_scores + self._score_one_region(i)
+            #fewest caballeros, of the regions that have any
+            occupied=cab_totals>0
+            if occupied.any():
+                scored=occupied & (cab_totals==cab_totals[occupied].min())
         elif region=='hicab':
-            hiregions=[]
-            currenthigh=0
-            for i in range(_NUM_EXT_REGIONS):
-                this_count=sum(self._board_state[i,:self._num_players])
-                if this_count>currenthigh:
-                    currenthigh=this_count
-                    hiregions=[i]
-                elif this_count==currenthigh:
-                    hiregions = hiregions + [i]
-            for i in hiregions:
-                final_scores = final_scores + self._score_one_region(i)
+            scored=cab_totals==cab_totals.max()
         elif region=='selfchoose':
             #choose a region to score - see if we did this already
             regions = [i for i in range(_NUM_REGIONS) if self._region_is_secret_choice(i)]
@@ -686,64 +1242,66 @@ class ElGrandeGameState(pyspiel.State):
             if len(regions)==0:
                 choice_step=True
             else:
-                final_scores = final_scores + self._score_one_region(regions[0])
+                scored[regions[0]]=True
         else:
             #last possibility is the one where we just score the top in all regions
-            for i in range(_NUM_EXT_REGIONS):
-                final_scores = final_scores + self._score_one_region(i,True)
+            scored[:]=True
+            top_only=True
                 
         if not choice_step:
-            self._set_rewards(final_scores)
+            self._set_rewards(self._region_scores(top_only)[scored].sum(0))
+
+    def _scored_regions(self):
+        #cached (regions x players) ranks and scores for all regions including the castillo, as read-only arrays.
+        #the cache keeps the board rows and rewards it was scored from, and only regions whose row or rewards
+        #have changed since are rescored - whatever changed them (moves, cards, scoreboards, undo)
+        n = self._num_players
+        rows = self._board_state[_ST_BDX_REGIONS:_ST_BDX_REGIONS+_NUM_EXT_REGIONS].tolist()
+        rewards = self._rewards[:_NUM_EXT_REGIONS].tolist()
+        cache = self._score_cache
+        if cache is not None:
+            if cache[0]==rows and cache[1]==rewards:
+                return cache[2],cache[3]
+            dirty = [r for r in range(_NUM_EXT_REGIONS) if rows[r]!=cache[0][r] or rewards[r]!=cache[1][r]]
+        if cache is None or len(dirty) > _SCORE_ROWS_MAX:
+            cabs = self._board_state[_ST_BDX_REGIONS:_ST_BDX_REGIONS+_NUM_EXT_REGIONS,_ST_BDY_CABS:_ST_BDY_CABS+n]
+            ranks = _rank_regions(cabs)
+            scores = _score_regions(cabs,self._rewards[:_NUM_EXT_REGIONS],self._board_state[_ST_BDX_REGIONS:_ST_BDX_REGIONS+_NUM_EXT_REGIONS,_ST_BDY_GRANDE_KING])
+        else:
+            #arrays may be shared with clones, so update copies
+            ranks = cache[2].copy()
+            scores = cache[3].copy()
+            for r in dirty:
+                row = rows[r]
+                ranks[r],scores[r] = _score_row(row[_ST_BDY_CABS:_ST_BDY_CABS+n],rewards[r],row[_ST_BDY_GRANDE_KING])
+        ranks.flags.writeable = False
+        scores.flags.writeable = False
+        self._score_cache = (rows,rewards,ranks,scores)
+        return ranks,scores
+
+    def _region_scores(self,top_only=False):
+        #(regions x players) score matrix for all regions including the castillo - read-only
+        ranks,scores = self._scored_regions()
+        if top_only:
+            #first place points and bonuses are the same either way
+            return np.where(ranks==1,scores,0)
+        return scores
+
+    def _region_ranks(self):
+        #(regions x players) rank matrix, 0 for players with no caballeros in a region - read-only
+        return self._scored_regions()[0]
 
     def _rank_region(self, region):
         assert(region>=0 and region<_NUM_EXT_REGIONS) 
-        cab_counts = self._board_state[_ST_BDX_REGIONS+region,_ST_BDY_CABS : (_ST_BDY_CABS+self._num_players) ]
-        ranks={}
-        for idx in range(len(cab_counts)):
-            cp=cab_counts[idx]
-            if cp>0:
-                ranks[idx]=1
-                anchor_rank=-1
-                for idx2 in ranks.keys():
-                    if idx!=idx2:
-                        if cab_counts[idx]>cab_counts[idx2]:
-                            #new one is bigger, push the old rank down
-                            ranks[idx2]=ranks[idx2]+1
-                        elif cab_counts[idx]==cab_counts[idx2]:
-                            ranks[idx2]=ranks[idx2]+1
-                            anchor_rank=ranks[idx2]
-                        else:
-                            ranks[idx]=ranks[idx]+1
-                if anchor_rank>0:
-                    ranks[idx]=anchor_rank
-        return ranks 
+        ranks = self._region_ranks()[region].tolist()
+        return {p:r for p,r in enumerate(ranks) if r>0}
 
     def _score_one_region(self,region,top_only=False):
         assert(region>=0 and region<_NUM_EXT_REGIONS) 
-        cab_counts = self._board_state[_ST_BDX_REGIONS+region,_ST_BDY_CABS : (_ST_BDY_CABS+self._num_players) ]
-    
-        #rank and score the counts
-        ranks = self._rank_region(region)
-        #score for all players
-        final_scores=np.full(self._num_players,0)
-        for k in ranks.keys():
-            if ranks[k]>0 and ranks[k]<=3:
-                if ranks[k]==1 or (not top_only):
-                    final_scores[k]=self._rewards[region][ranks[k]-1]
-            if ranks[k]==1:
-                if self._region_has_grande(region,k):
-                    final_scores[k]=final_scores[k]+2
-                if self._region_has_king(region):
-                    final_scores[k]=final_scores[k]+2
-        #print("rewards for region "+str(region))
-        #print(final_scores)
-        return final_scores
+        return self._region_scores(top_only)[region].copy()
     
     def _score_all_regions(self):
-        final_scores=np.full(self._num_players,0)
-        for r in range(_NUM_EXT_REGIONS):
-            final_scores = final_scores+self._score_one_region(r)
-        return final_scores
+        return self._region_scores().sum(0)
    
     def _scores_as_margins(self,player_scores):
         #represent all players' scores in margin format (distance from the midpoint between first and second)
@@ -757,7 +1315,7 @@ class ElGrandeGameState(pyspiel.State):
  
     def _pack_court(self):
         #move the correct number of caballeros from province to court, at the point where player action commences
-        power_id = np.where(self._pcard_state & pow(2,self._cur_player) == pow(2,self._cur_player))[0][0]
+        power_id = np.where(self._pcard_state & _PLAYER_BIT[self._cur_player] == _PLAYER_BIT[self._cur_player])[0][0]
         n_cabs = min(_POWER_CABS[power_id],self._board_state[_ST_BDX_PROVINCE,self._cur_player])
         self._board_state[_ST_BDX_PROVINCE,self._cur_player] -= n_cabs
         self._board_state[_ST_BDX_COURT,self._cur_player] += n_cabs
@@ -765,44 +1323,52 @@ class ElGrandeGameState(pyspiel.State):
         
     def _setup_caballero_placement(self):
         #set correct state information for where we will be allowed to place caballeros
-        self._movement_tracking['from']=[_ST_BDX_COURT]
-        self._movement_tracking['lockfrom']=False
-        self._movement_tracking['to']=pieces._NEIGHBORS[self._king_region()]+[_ST_BDX_CASTILLO]
-        self._movement_tracking['lockto']=False
-        self._movement_tracking['moving'] = True
-        card = self._get_current_card()
-        n_cabs = min(int(card["name"][4]),self._board_state[_ST_BDX_COURT,self._cur_player])
-        pattern = {'player':self._cur_player,'allowed':True,'max':n_cabs,'min':0}
-        self._movement_tracking['patterns']=[pattern]
-        self._movement_tracking['prev']=[] #no movements done in this set of substeps yet
+        mt = self._move_info_for_update()
+        mt.fromregs=[_ST_BDX_COURT]
+        mt.lockfrom=False
+        mt.toregs=pieces._NEIGHBORS[self._king_region()]+[_ST_BDX_CASTILLO]
+        mt.lockto=False
+        mt.moving = True
+        n_cabs = min(_CARD_CABS[self._chosen_card],self._board_state.item(_ST_BDX_COURT,self._cur_player))
+        mt.num_patterns = 0
+        mt.add_pattern(self._cur_player,True,n_cabs,0)
+        mt.prev=0 #no movements done in this set of substeps yet
  
     def _init_move_info(self):
-        self._movement_tracking = {'from':[],'to':[],'cabs':[],'patterns':[],'queue':[],'player':0,'lockfrom':False,'lockto':False,'moving':False,'prev':[],'fromcondition':0}
-        
+        self._movement_tracking = _MoveTracker()
+
+    def _share_move_info(self):
+        #hand out the tracker to a clone or undo frame - whoever changes it next takes a copy
+        self._movement_tracking.shared = True
+        return self._movement_tracking
+
+    def _move_info_for_update(self):
+        mt = self._movement_tracking
+        if mt.shared:
+            mt = self._movement_tracking = mt.copy()
+        mt.hash_key = None
+        return mt
+
+    def _undo_frame(self):
+        #everything do_apply_action can touch - the packed buffer is copied, the movement tracker is
+        #copy-on-write, anything that is only ever replaced is kept by reference
+        return (self._packed.copy(),self._share_move_info(),self._win_points,self._state_returns,self._history,self._legal,self._zobrist)
+
+    def _restore_frame(self,frame):
+        #copy back into the existing buffer, so that the named views stay valid
+        self._packed[:] = frame[0]
+        self._movement_tracking,self._win_points,self._state_returns,self._history,self._legal,self._zobrist = frame[1:]
+
     def _setup_action(self,alt_action=0):
         #set up info to enable multi-step actions, or flag instant actions
         
         self._init_move_info() #wipe out previous info on where caballeros were/were not allowed to move
-        card = self._get_current_card()
-        action_type = card['actiontype']
-        card_details = card.get('details',[])
-        if action_type=='choose':
-            action_type = card_details[alt_action]['type']
-            card_details = card_details[alt_action]['details']
-               
-        #additional setup for cab movement action types
-        if action_type == 'all':
-            #only one card is an 'and' and it happens to have two move elements
-            #HACK - forgot to put 'numopt' value in cards in TTS - till I fix this, shove it in here
-            #TODO - fix this properly in the other code
-            card_details[0]['details']['numopt']='lteq'
-            card_details[1]['details']['numopt']='lteq'
-
-            self._do_caballero_move_info(card_details[0]['details'])
-            self._add_caballero_move_info(card_details[1]['details'])
-            multi_step=True
-        elif action_type == 'move':
-            self._do_caballero_move_info(card_details)
+        #additional setup for cab movement action types - 'all' cards have more than one move element
+        moves = _CARD_MOVES[self._chosen_card][alt_action]
+        if len(moves)>0:
+            self._do_caballero_move_info(moves[0])
+            for move in moves[1:]:
+                self._add_caballero_move_info(move)
 
     def _apply_secret_choice(self,action):
         #figure out what action required a secret choice, and complete it
@@ -817,74 +1383,48 @@ class ElGrandeGameState(pyspiel.State):
             self._assess_secret_choices()
 
 
-    def _do_caballero_move_info(self,card_details):  
-        #make movable caballeros interactable
+    def _do_caballero_move_info(self,move):  
+        #make movable caballeros interactable, from a compiled card movement element
         #'from' values are court, or region of your choice
-        #self._movement_tracking = {['from']={},['to']={},['patterns']={},
-        #                     ['player']=None,['lockfrom']=false,['lockto']=false,['moving']=false}
-
-        self._movement_tracking['player']=self._cur_player
+        mt = self._move_info_for_update()
+        mt.player=self._cur_player
         for v in ['from','to']:
-            if card_details[v]['region'] in ['court','province']:
-                self._movement_tracking[v]=[self._get_rid(card_details[v]['region'])]
-            elif card_details[v]['region']=='selfchoose':
+            if move[v] is None:
                 #current King's region shouldn't be in the list
                 the_regions=[i for i in range(_NUM_REGIONS) if not self._region_has_king(i)]
                 if v=='to':
                     the_regions = the_regions + [_ST_BDX_CASTILLO]
-                self._movement_tracking[v]=the_regions
             else:
-                #placeholder for some sort of owner choice
-                self._movement_tracking[v]=[card_details[v]['region']]
-
-            if card_details[v]['splitopt']=="all":
-                self._movement_tracking['lock'+v]=True 
+                #court/province, or placeholder for some sort of owner choice
+                the_regions=[move[v]]
+            if v=='from':
+                mt.fromregs=the_regions
+                mt.lockfrom=move['lockfrom']
             else:
-                self._movement_tracking['lock'+v]=False 
-
-        #set the pattern for cabs to move
-        pattern={}
-        if card_details['player']=='foreign':
-            pattern['player']=self._cur_player
-            pattern['allowed']=False
-        if card_details['player']=='self':
-            pattern['player']=self._cur_player 
-            pattern['allowed']=True
-        if card_details['number']<0:
-            pattern['max']=150
-        else:
-            pattern['max']=card_details['number']
-        if card_details.get('numopt','lteq')=='lteq':
-            pattern['min']=0 
-        else:
-            pattern['min']=pattern['max']
+                mt.toregs=the_regions
+                mt.lockto=move['lockto']
 
         #assume that, yes, we are moving
-        self._movement_tracking['moving']=True
+        mt.moving=True
         
-        #there may be a condition on choice of 'from' region - check it
-        condition= card_details['from'].get('condition',None)
-        if condition != None and condition!='clock':
-            self._movement_tracking['fromcondition']=int(card_details['from']['condition'])
-        self._movement_tracking['patterns']=[pattern] 
+        #there may be a condition on choice of 'from' region
+        if move['fromcondition']>0:
+            mt.fromcondition=move['fromcondition']
+        mt.num_patterns=0
 
         #for 'Provinceone' card need to do some extra processing - one of these for each player, not one and done
-        if card_details['from']['region']=='selfchoose' and card_details['to']['region']=='province':
-            patterns=[]
-            foreign_players = [i for i in range(self._num_players) if i!=self._cur_player]
-            for p in foreign_players:
-                newpat=self._movement_tracking['patterns'][0].copy()
-                newpat['player']=p
-                newpat['allowed']=True
-                patterns=patterns+[newpat]
-            self._movement_tracking['patterns']=patterns  
-            self._movement_tracking['moving']=True
+        if move['perplayer']:
+            pattern=move['pattern']
+            for p in range(self._num_players):
+                if p!=self._cur_player:
+                    mt.add_pattern(p,True,pattern['max'],pattern['min'])
+        else:
+            self._add_caballero_move_info(move)
     
-       
     def _instant_move(self):
         #do a move that can be completed in one step, then null-out movement info
-        fromreg=self._movement_tracking['from']
-        toreg = self._movement_tracking['to']
+        fromreg=self._movement_tracking.fromregs
+        toreg = self._movement_tracking.toregs
         card = self._get_current_card()
         card_details = card['details']
         if card_details['from']['region'] =='ownerchooseplus':
@@ -894,14 +1434,18 @@ class ElGrandeGameState(pyspiel.State):
             players_to_choose = [(i+self._cur_player)%self._num_players for i in range(1,self._num_players)]
             number_to_send = int(card_details['number'])
             for p in players_to_choose:
-                for i in range(number_to_send):
-                    #send from court if possible, then wherever you have most cabs
-                    if self._board_state[pieces._COURT,p]>0:
-                        self._move_one_cab(pieces._COURT, pieces._PROVINCE,p)
-                    else:
-                        best_regions=np.where(self._board_state[:_NUM_EXT_REGIONS,p]==max(self._board_state[:_NUM_EXT_REGIONS,p]))        
-                        if max(self._board_state[:_NUM_EXT_REGIONS,p])>0:
-                            self._move_one_cab(random.choice(best_regions[0]), pieces._PROVINCE,p)
+                #send from court if possible, then wherever you have most cabs
+                cabs = self._board_state[:,_ST_BDY_CABS+p]
+                sent = min(number_to_send,cabs.item(pieces._COURT))
+                cabs[pieces._COURT] -= sent
+                for i in range(number_to_send-sent):
+                    counts = cabs[:_NUM_EXT_REGIONS].tolist()
+                    most = max(counts)
+                    if most==0:
+                        break
+                    cabs[self._rng.choice([r for r in range(_NUM_EXT_REGIONS) if counts[r]==most])] -= 1
+                    sent += 1
+                cabs[pieces._PROVINCE] += sent
 
         else:
             #'Decay','Decayall' and 'Court' 
@@ -919,30 +1463,29 @@ class ElGrandeGameState(pyspiel.State):
                     self._board_state[fromreg[0],_ST_BDY_CABS+pl] -= ncabs
                     self._board_state[toreg[0],_ST_BDY_CABS+pl] += ncabs
 
-            #null-out movement info, since we've done the move
-            self._init_move_info()
+        #null-out movement info, since we've done the move - even if opponents had too few caballeros to send
+        self._init_move_info()
 
  
-    def _add_caballero_move_info(self,card_details):         
-        pattern = {}
-        if card_details['player']=='foreign':
-            pattern['player']=self._cur_player
-            pattern['allowed']=False
-        elif card_details['player']=='self':
-            pattern['player']=self._cur_player
-            pattern['allowed']=True
-            
-        if card_details['number']<0:
-            pattern['max']=150 
-        else:
-            pattern['max']=card_details['number']
-        if card_details['numopt']=='lteq':
-            pattern['min']=0 
-        else:
-            pattern['min']=pattern['max']        
-        self._movement_tracking['patterns'] = self._movement_tracking.get('patterns',[]) + [pattern]
-
-
+    def _add_caballero_move_info(self,move):         
+        #the pattern for cabs to move - 'self' and 'foreign' templates refer to the current player
+        pattern = move['pattern']
+        player = self._cur_player if move['player'] in ['self','foreign'] else -1
+        self._move_info_for_update().add_pattern(player,pattern.get('allowed',True),pattern['max'],pattern['min'])
+
+
+
+    def _response_points(self,deltas):
+        #(players x regions) points each player would score in each region if their caballeros in every region
+        #changed by deltas[player] - regions score independently, so one hypothetical board per player covers
+        #every region that player could pick, and all players are scored together
+        n = self._num_players
+        board = self._board_state[:_NUM_REGIONS]
+        cabs = np.repeat(board[None,:,_ST_BDY_CABS:_ST_BDY_CABS+n],n,axis=0)
+        players = np.arange(n)
+        cabs[players,:,players] += deltas
+        points = _score_regions(cabs,self._rewards[:_NUM_REGIONS],board[:,_ST_BDY_GRANDE_KING])
+        return points[players,:,players]
 
     def _assess_secret_choices(self):
         #work out opponent choices, ultimately by running simulations, currently by random choice.
@@ -950,56 +1493,45 @@ class ElGrandeGameState(pyspiel.State):
         regions = [i for i in range(_NUM_REGIONS) if self._region_is_secret_choice(i)]
         assert(len(regions)<=1)
         card=self._get_current_card()
+        #opponents choose secretly, so all of them respond to the board as it is before anyone moves
+        current = self._region_scores()[:_NUM_REGIONS].T
+        cabs = self._board_state[:_NUM_REGIONS,_ST_BDY_CABS:_ST_BDY_CABS+self._num_players].T
         #code for 'Eviction' card
         if card['actiontype']=='move' and card['details']['to']['region']=='ownerchoose':
             #for each opponent, choose a region for simple maximising of their returns
-            region_points = [self._score_one_region(i) for i in range(_NUM_REGIONS)]
+            evicted = cabs[:,regions[0]].tolist()
+            improvement = self._response_points(np.repeat(cabs[:,regions[0],None],_NUM_REGIONS,axis=1)) - current
+            improvement[:,self._king_region()] = -100 #ensure king region is never 'best'
             for i in range(self._num_players):
-                if i!=self._cur_player and self._board_state[regions[0],i]>0:
+                if i!=self._cur_player and evicted[i]>0:
                     #figure out the most lucrative place to put cabs
-                    ncabs=self._board_state[regions[0],i]
-                    ts = self.clone()
-                    ts._board_state[:_NUM_REGIONS,i]+=ncabs
-                    ts_points = [ts._score_one_region(i) for i in range(_NUM_REGIONS)]
-                    improvement=np.array(ts_points)-np.array(region_points)
-                    imp_i=improvement[:,i]
-                    imp_i[self._king_region()]=-100 #ensure king region is never 'best'
-                    best_reg = np.where(imp_i==max(imp_i))[0]
-                    chosen = random.choice(best_reg)
+                    best_reg = np.flatnonzero(improvement[i]==improvement[i].max())
+                    chosen = self._rng.choice(best_reg)
                     self._board_state[regions[0],i] = 0
-                    self._board_state[chosen,i] += ncabs
+                    self._board_state[chosen,i] += evicted[i]
         elif card['actiontype']=='move' and card['details']['to']['region']=='province':
             #all players sending cabs to province  
             #for each opponent, choose a region for simple minimising of their losses 
-            #TODO - edge cases
-            region_points = [self._score_one_region(i) for i in range(_NUM_REGIONS)]
-            chosen_regions = np.full(self._num_players,-1)
+            two = self._movement_tracking.fromcondition==2
+            if two:
+                allowed = cabs>=2
+                loss = current - self._response_points(np.full(cabs.shape,-2))
+            else:
+                allowed = cabs>=1
+                loss = current - self._response_points(-cabs)
+            allowed[:,self._king_region()] = False
             for i in range(self._num_players):
                 if i==self._cur_player:
                     chosen=regions[0]
+                elif allowed[i].any():
+                    best_reg = np.flatnonzero((loss[i]==loss[i][allowed[i]].min()) & allowed[i])
+                    chosen = self._rng.choice(best_reg)
                 else:
-                    ts = self.clone()
-                    if self._movement_tracking.get('fromcondition',0)==2:
-                        allowed = [ts._board_state[j][i]>=2 for j in range(_NUM_REGIONS)]
-                        ts._board_state[:_NUM_REGIONS,i]-=2
-                    else:
-                        allowed = [ts._board_state[j][i]>=1 for j in range(_NUM_REGIONS)]
-                        ts._board_state[:_NUM_REGIONS,i]=0
-                    allowed[self._king_region()]=False
-                    ts_points = [ts._score_one_region(i) for i in range(_NUM_REGIONS)]
-                    loss=np.array(region_points) - np.array(ts_points)
-                    #set loss to effective infinity in disallowed regions
-                    loss_i=loss[:,i]
-                    loss_i=np.array([loss_i[j] if allowed[j] else 1000 for j in range(_NUM_REGIONS)])
-                    best_reg = np.where(loss_i==min(loss_i))[0]  
-                    chosen = random.choice(best_reg)
-                if self._movement_tracking['fromcondition']==2:
-                    self._board_state[pieces._PROVINCE,i]+=2
-                    self._board_state[chosen,i] -= 2
-                else:
-                    ncabs = self._board_state[chosen,i]
-                    self._board_state[pieces._PROVINCE,i]+=ncabs
-                    self._board_state[chosen,i] -=ncabs
+                    #nowhere this opponent can send from
+                    continue
+                ncabs = 2 if two else self._board_state.item(chosen,i)
+                self._board_state[pieces._PROVINCE,i]+=ncabs
+                self._board_state[chosen,i] -= ncabs
  
         self._init_move_info()
         return []
@@ -1013,68 +1545,50 @@ class ElGrandeGameState(pyspiel.State):
 
     def _set_valid_cab_movements(self,fromcard=True):
         #use movement tracking info to determine which from/to moves are okay
-        actions=[]
         #if secret choice is involved, interrupt to do this
-        ccard=self._get_current_card()
-        if fromcard and ccard['actiontype']=='move':
-            checkregionfrom = ccard['details']['from']['region']
-            checkregionto = ccard['details']['to']['region']
-            if checkregionfrom =='ownerchoose' or checkregionto == 'ownerchoose':
-                actions = [i + _ACT_CHOOSE_SECRETS for i in range(_NUM_REGIONS) if self._board_state[i,self._cur_player]>=self._movement_tracking.get('fromcondition',0) and not self._region_has_king(i)]
-                return sorted(actions)
-        for fromreg in self._movement_tracking['from']:
-            for toreg in self._movement_tracking['to']:
-                players=[]
-                for pattern in self._movement_tracking['patterns']:
-                    #add players from this pattern if it's not filled
-                    if pattern.get('cabs',0)<pattern['max']:
-                        mentioned_player = pattern.get('player',-1)
-                        if mentioned_player == -1:
-                            #any player is okay
-                            players = range(self._num_players)
-                        else:
-                            #a player is mentioned - see if it's include or exclude
-                            if pattern['allowed']:
-                                players = [i for i in range(self._num_players) if ((i in players) or i==mentioned_player)]
-                            else:
-                                players = [i for i in range(self._num_players) if ((i in players) or i!=mentioned_player)]
-                for player in players:
-                    if self._board_state[fromreg,player] >0:
-                        #there is a caballero here of the correct colour, so this move action is okay
-                        actions.append(_ACT_CAB_MOVES + player + _MAX_PLAYERS*(toreg + _NUM_CAB_AREAS*fromreg))
+        mt = self._movement_tracking
+        if fromcard and _CARD_OWNERCHOOSE[self._chosen_card]:
+            cabs = self._board_state[:_NUM_REGIONS,self._cur_player].tolist()
+            king = self._king_region()
+            return [i + _ACT_CHOOSE_SECRETS for i in range(_NUM_REGIONS) if cabs[i]>=mt.fromcondition and i!=king]
+        #players whose caballeros can be moved, from the patterns that aren't filled yet
+        players = 0
+        for i in mt.open_patterns():
+            players |= _PATTERN_PLAYER_BITS[mt.pat_player[i]+1][int(mt.pat_allowed[i])]
+        #moves as a bitset over cab move action offsets - multiplying a set of player bits by the spread
+        #of to regions broadcasts it to every to region, then it is shifted into place for the from region
+        spread = 0
+        for toreg in mt.toregs:
+            spread |= 1 << (toreg*_MAX_PLAYERS)
+        cabs = self._board_state[:,_ST_BDY_CABS:_ST_BDY_CABS+self._num_players].tolist()
+        moves = 0
+        for fromreg in mt.fromregs:
+            present = 0
+            for player,count in enumerate(cabs[fromreg]):
+                if count>0:
+                    present |= 1 << player
+            moves |= ((present & players)*spread) << (fromreg*_CAB_MOVES_PER_FROM)
         
         #during a movement_tracking episode (eg, moving cabs around the board)
         #restrict actions so we don't get extra possibilities from one substep
         #to the next
-        prev_acts = self._movement_tracking.get('prev',[])
-        if len(prev_acts)>0:
-            actions=list(set(actions).intersection(prev_acts))
-        self._movement_tracking['prev']=actions
-        return sorted(actions)
+        if mt.prev:
+            moves &= mt.prev
+        if moves != mt.prev:
+            self._move_info_for_update().prev=moves
+        return _cab_move_actions(moves)
 
     def _register_cab_moved(self,fromreg,toreg,ofplayer):
-        for pattern in self._movement_tracking['patterns']:
-            if self._matched_pattern(ofplayer,pattern):
-                pattern['cabs']=pattern.get('cabs',0)+1
+        mt = self._move_info_for_update()
+        for i in range(mt.num_patterns):
+            if mt.matches(i,ofplayer):
+                mt.pat_cabs[i]+=1
                 return
 
     def _check_move_patterns_filled(self):
-        for pattern in self._movement_tracking['patterns']:
-            if pattern.get('cabs',0)<pattern['max']:
-                return
-        #if we didn't find any free patterns, set moving false
-        self._movement_tracking['moving']=False
-        
-    def _matched_pattern(self,player,pattern):
-        if pattern.get('player',-1) == -1:
-            return True #found an unrestricted pattern
-        if pattern['player']==player and pattern['allowed']:
-            return True #found a pattern that says cabs of this colour are allowed
-        if pattern['player']!=player and not pattern['allowed']:
-            return True #found a pattern that says cabs not of this colour are allowed
-        #didn't find a match
-        return False
-        
+        if len(self._movement_tracking.open_patterns())==0:
+            #if we didn't find any free patterns, set moving false
+            self._move_info_for_update().moving=False
         
     def _set_valid_actions_from_card(self):
         #determine what sort of action is being done, then figure out the mask
@@ -1094,12 +1608,12 @@ class ElGrandeGameState(pyspiel.State):
             return actions
         elif valid_action=='choose':
             #check if there is a movement pattern - if so, follow it, if not, ask whether we're on 1 or 2
-            if self._movement_tracking['moving']:
+            if self._movement_tracking.moving:
                 return self._set_valid_cab_movements()
             else:
                 return[_ACT_DECIDE_ACT,_ACT_DECIDE_ACT_ALT]
         elif valid_action=='power':
-            actions = actions + [(_ACT_RETRIEVE_POWERS + i) for i in range(_NUM_POWER_CARDS) if self._past_pcard_state[i] & pow(2,self._cur_player) > 0]
+            actions = actions + (np.flatnonzero(self._past_pcard_state & _PLAYER_BIT[self._cur_player]) + _ACT_RETRIEVE_POWERS).tolist()
             return actions
         elif valid_action=='grande':
             actions = actions + [(i + _ACT_MOVE_GRANDES) for i in range(_NUM_REGIONS) if not self._region_has_king(i)]
@@ -1111,11 +1625,9 @@ class ElGrandeGameState(pyspiel.State):
 
     def _after_power_choice(self):
         #functions to determine if we should move to the next phase and/or the next player, and who that player might be
-        if len(self._playersleft) > 1:
-            #set current player
-            self._cur_player = self._playersleft[1]
-            #move all players up one
-            self._playersleft = self._playersleft[1:]
+        if self._meta.item(_PK_M_NUM_LEFT) > 1:
+            #move all players up one, and set current player
+            self._next_in_queue()
         else:
             #redo the whole queue, and move on to 'action' phase
             self._update_players_after_power()
@@ -1124,17 +1636,17 @@ class ElGrandeGameState(pyspiel.State):
         #functions to determine if we should move to the next phase and/or the next player, 
         #and who that player might be
         #if still in the process of moving caballeros then don't do anything
-        if self._movement_tracking.get('moving',False):
+        if self._movement_tracking.moving:
             return
         
         #if we have some cabs to move, ensure we do that
-        if self._turn_state[_ST_TN_PHASE]==_ST_PHASE_CARD1:
+        if self._get_phase()==_ST_PHASE_CARD1:
             self._turn_state[_ST_TN_PHASE]=_ST_PHASE_CAB2
             self._setup_caballero_placement()
             return
         
         #if we were moving cabs and now have to do the action card, do that
-        if self._turn_state[_ST_TN_PHASE]==_ST_PHASE_CAB1:
+        if self._get_phase()==_ST_PHASE_CAB1:
             self._turn_state[_ST_TN_PHASE]=_ST_PHASE_CARD2
             #set up the action except in the one case were we need to decide between act1 and act2
             if self._get_current_card()['actiontype']!='choose':
@@ -1144,19 +1656,17 @@ class ElGrandeGameState(pyspiel.State):
         #otherwise we're done, update the queue however we need to
         self._update_current_card_status(_ST_AC_DONE)
         
-        if len(self._playersleft) > 1:
-            #set current player
-            self._cur_player = self._playersleft[1]
-            #move all players up one
-            self._playersleft = self._playersleft[1:]
+        if self._meta.item(_PK_M_NUM_LEFT) > 1:
+            #move all players up one, and set current player
+            self._next_in_queue()
             self._turn_state[_ST_TN_PHASE]=_ST_PHASE_ACTION
         else:
             #redo the whole queue, and move to 'scoring' phase if appropriate, 
             #next power choosing phase otherwise
-            if _SCORING_ROUND[self._turn_state[_ST_TN_ROUND]]:
+            if _SCORING_ROUND[self._get_round()]:
                 self._turn_state[_ST_TN_PHASE]=_ST_PHASE_SCORE
                 #make sure secret region choices are all blank before we start this
-                self._board_state[:,_ST_BDY_SECRET]=0
+                self._clear_secret_regions()
             else:
                 self._update_players_after_action()
                 
@@ -1168,8 +1678,9 @@ class ElGrandeGameState(pyspiel.State):
         new_scores+=self._score_all_regions()
         self._set_rewards(new_scores)
         final_scores = self._current_score()
-        self._board_state[:,_ST_BDY_SECRET]=0 
-        if self._turn_state[_ST_TN_ROUND]==self._end_turn:
+        self._clear_secret_regions()
+        #every horizon but the end of the game is reached once scoring is done, so stop on the actual scores
+        if self._get_round()==self._end_turn or self._meta.item(_PK_M_HORIZON)!=_HZ_GAME:
             # turn scores into win points
             self._win_points = self._scores_as_margins(final_scores)
             self._cur_player = pyspiel.PlayerId.TERMINAL
@@ -1177,8 +1688,24 @@ class ElGrandeGameState(pyspiel.State):
         else:
             self._update_players_after_action()
 
+    def _check_horizon(self):
+        #after each action - end the game early, on projected scores, once its horizon is reached
+        meta = self._meta
+        plies = meta.item(_PK_M_PLIES_LEFT)
+        if plies:
+            meta[_PK_M_PLIES_LEFT] = plies-1
+        if self._is_terminal:
+            return
+        horizon = meta.item(_PK_M_HORIZON)
+        if (plies==1 or (horizon==_HZ_ROUND and self._get_round()!=meta.item(_PK_M_HORIZON_MARK))
+                or (horizon==_HZ_PHASE and _PHASE_STAGE[self._get_phase()]!=meta.item(_PK_M_HORIZON_MARK))):
+            #score as if every region were scored now
+            self._win_points = self._scores_as_margins(self._current_score()+self._score_all_regions())
+            self._cur_player = pyspiel.PlayerId.TERMINAL
+            self._is_terminal=True
+
     def _update_players_after_power(self):
-        powcards = {i:self._pcard_state[i] for i in range(_NUM_POWER_CARDS) if self._pcard_state[i]>0} 
+        powcards = {i:p for i,p in enumerate(self._pcard_state.tolist()) if p>0}
         order=[]
         keys = sorted(powcards.keys(),reverse=True)
         for i in keys:
@@ -1190,7 +1717,7 @@ class ElGrandeGameState(pyspiel.State):
         
     def _update_players_after_action(self):
         #get everything ready for next round
-        powcards = {i:self._pcard_state[i] for i in range(_NUM_POWER_CARDS) if self._pcard_state[i]>0} 
+        powcards = {i:p for i,p in enumerate(self._pcard_state.tolist()) if p>0}
         lowest = sorted(powcards.keys())[0]
         start_player = int(np.log2(powcards[lowest]))
         self._cur_player = start_player
@@ -1200,15 +1727,12 @@ class ElGrandeGameState(pyspiel.State):
         self._playersleft = order
         self._turn_state[_ST_TN_PHASE]=_ST_PHASE_POWER
         self._turn_state[_ST_TN_ROUND]+=1
-        self._pcard_state = np.full(_NUM_POWER_CARDS,0)
+        self._pcard_state[:] = 0
         #self._dealing = True #next state will be "chance" and we will deal cards
         #make the right cards dealt
-        round = self._turn_state[_ST_TN_ROUND]
-        for i in range(_NUM_ACTION_CARDS):
-            if self._acard_round[i]==round:
-                self._acard_state[i] = _ST_AC_DEALT
-            elif self._acard_round[i]==(round-1):
-                self._acard_state[i] = _ST_AC_DONE
+        round = self._get_round()
+        self._acard_state[self._acard_round==round] = _ST_AC_DEALT
+        self._acard_state[self._acard_round==(round-1)] = _ST_AC_DONE
         self._acard_state[-1] = _ST_AC_DEALT
 
     def scoring_order(self,player=-1):
@@ -1222,7 +1746,7 @@ class ElGrandeGameState(pyspiel.State):
 
     def castillo_game_string(self,player=-1):
         #translate game state into CastilloGame format, for running tiny sims
-        state_vals={"players":self._num_players,"rewards":self._rewards,"king":self._king_region()+1}
+        state_vals={"players":self._num_players,"rewards":self._rewards.tolist(),"king":self._king_region()+1}
         #put player state into castillo game state in order, starting from current player
         #region 0 is the castillo
         board=np.full(self._num_players*_NUM_EXT_REGIONS,0)
@@ -1269,31 +1793,109 @@ class ElGrandeGameState(pyspiel.State):
         #elif self._dealing:
         #    return self._deal_actions()
         else:
-            actions = []
-            if self._turn_state[_ST_TN_PHASE]==_ST_PHASE_POWER:
-                cards = self._available_powers()
-                actions = actions + [c+_ACT_POWERS for c in cards]
-            elif self._turn_state[_ST_TN_PHASE]==_ST_PHASE_ACTION:
-                cards = [c for c in range(_NUM_ACTION_CARDS) if self._acard_state[c]==_ST_AC_DEALT]
-                actions = actions + [c +_ACT_CARDS for c in cards]
-            elif self._turn_state[_ST_TN_PHASE]==_ST_PHASE_CHOOSE:
-                actions.append(_ACT_DECIDE_CAB)
-                actions.append(_ACT_DECIDE_ACT)
-                if self._get_current_card()['actiontype']=='choose':
-                    actions.append(_ACT_DECIDE_ACT_ALT)
-            elif self._turn_state[_ST_TN_PHASE] in [_ST_PHASE_CARD1,_ST_PHASE_CARD2]:
-                if self._card_moves()==_ST_STEPS_0:
-                    actions = [_ACT_SKIP,_ACT_TRIGGER]
-                else:
-                    actions = actions + self._set_valid_actions_from_card() + [_ACT_SKIP]
-            elif self._turn_state[_ST_TN_PHASE] in [_ST_PHASE_CAB1,_ST_PHASE_CAB2]:
-                actions = actions + self._set_valid_cab_movements(False) + [_ACT_SKIP]
+            return list(self._legal_cache()[0])
+
+    def _legal_cache(self):
+        #legal actions (sorted tuple) and boolean mask for this position, built once and kept until the state changes
+        if self._legal is None:
+            self._legal = _legal_entry(sorted(self._generate_legal_actions()))
+        return self._legal
+
+    def _generate_legal_actions(self):
+        actions = []
+        if self._get_phase()==_ST_PHASE_POWER:
+            cards = self._available_powers()
+            actions = actions + [c+_ACT_POWERS for c in cards]
+        elif self._get_phase()==_ST_PHASE_ACTION:
+            cards = np.flatnonzero(self._acard_state==_ST_AC_DEALT).tolist()
+            actions = actions + [c +_ACT_CARDS for c in cards]
+        elif self._get_phase()==_ST_PHASE_CHOOSE:
+            actions.append(_ACT_DECIDE_CAB)
+            actions.append(_ACT_DECIDE_ACT)
+            if self._get_current_card()['actiontype']=='choose':
+                actions.append(_ACT_DECIDE_ACT_ALT)
+        elif self._get_phase() in [_ST_PHASE_CARD1,_ST_PHASE_CARD2]:
+            if self._card_moves()==_ST_STEPS_0:
+                actions = [_ACT_SKIP,_ACT_TRIGGER]
             else:
-                #must be score - choose a secret region (not one with the King)
-                actions = actions + [(i + _ACT_CHOOSE_SECRETS) for i in range (_NUM_REGIONS) if not self._region_has_king(i)]
-            
-            return actions
+                actions = actions + self._set_valid_actions_from_card() + [_ACT_SKIP]
+        elif self._get_phase() in [_ST_PHASE_CAB1,_ST_PHASE_CAB2]:
+            actions = actions + self._set_valid_cab_movements(False) + [_ACT_SKIP]
+        else:
+            #must be score - choose a secret region (not one with the King)
+            actions = actions + [(i + _ACT_CHOOSE_SECRETS) for i in range (_NUM_REGIONS) if not self._region_has_king(i)]
+        
+        return actions
     
+    def seed(self, seed):
+        """Give this state (and clones made from now on) its own random stream.
+        seed - an int, or a np.random.SeedSequence, e.g. one of SeedSequence(base).spawn(workers) per worker
+        """
+        self._rng = _make_rng(seed)
+
+    def set_horizon(self, horizon='game', plies=0):
+        """Make this state (and its clones and successors) end early, for shorter simulations.
+        horizon - 'game' plays to the end turn, 'scoring' to the end of the next scoring round, 'round' to the end of
+        the current round and 'phase' to the end of the current power, action or scoring phase
+        plies - if > 0, also end after this many more actions
+        States stopped after a scoring round return margins of the actual scores, others margins of the scores
+        projected by scoring every region as it stands.
+        """
+        if horizon not in _HORIZON_IDS or plies < 0:
+            raise ValueError("Unknown horizon "+str((horizon,plies)))
+        horizon = _HORIZON_IDS[horizon]
+        self._meta[_PK_M_HORIZON] = horizon
+        self._meta[_PK_M_HORIZON_MARK] = self._get_round() if horizon==_HZ_ROUND else _PHASE_STAGE[self._get_phase()]
+        self._meta[_PK_M_PLIES_LEFT] = plies
+        self._zobrist = None
+
+    def zobrist_hash(self):
+        """64-bit hash of the position - packed state (board, cards, powers, phase, round, players, scores, horizon),
+        movement tracking progress and end turn. Equal states have equal hashes.
+        The packed part is computed once, then updated incrementally by do_apply_action.
+        """
+        self._settle_move_info()
+        if self._zobrist is None:
+            self._zobrist = _packed_zobrist(self._packed)
+        return self._zobrist ^ self._movement_tracking.key() ^ _mix64(self._end_turn)
+
+    def _settle_move_info(self):
+        #generating legal moves records them in the movement tracker, as every action does before it is
+        #applied - do it first so that states compare the same whether or not their moves were asked for yet
+        if not self._is_terminal and not self._rollout:
+            self._legal_cache()
+
+    def __hash__(self):
+        return self.zobrist_hash()
+
+    def __eq__(self, other):
+        if not isinstance(other,ElGrandeGameState):
+            return NotImplemented
+        self._settle_move_info()
+        other._settle_move_info()
+        if self._zobrist is not None and other._zobrist is not None and self._zobrist != other._zobrist:
+            return False
+        return (self._num_players == other._num_players and self._end_turn == other._end_turn
+                and np.array_equal(self._packed,other._packed)
+                and self._movement_tracking.to_values() == other._movement_tracking.to_values())
+
+    def start_rollout(self):
+        """Switch this state to trusted rollout mode, for throwaway playouts.
+        Actions are applied without validation, history or undo information - callers must only
+        apply legal actions, e.g. from random_legal_action, and should not use the state for anything else.
+        """
+        self._rollout = True
+        self._undo_stack = None
+        self._zobrist = None
+
+    def random_legal_action(self, u):
+        """Legal action picked by u, uniform in [0,1), without sorting or building the action mask."""
+        if self._legal is not None:
+            actions = self._legal[0]
+        else:
+            actions = self._generate_legal_actions()
+        return actions[int(u*len(actions))]
+
     def chance_outcomes(self):
         """Returns the possible chance outcomes and their probabilities."""
         return []
@@ -1303,24 +1905,23 @@ class ElGrandeGameState(pyspiel.State):
         #p = 1.0 / len(outcomes)
         #return [(o, p) for o in outcomes]
 
+    def information_state_tensor(self, player=None):
+        """Observation tensor for this state, as built by ElGrandeGameObserver (same for all players)."""
+        return _encode_observations(self._packed[None],np.zeros((1,_OBS_SIZE),np.float32))[0]
+
     def legal_actions_mask(self, player=None):
-        """Get a list of legal actions.
+        """Get a mask of legal actions.
         Args:
           player: the player whose moves we want; defaults to the current player.
         Returns:
-          A list of legal moves, where each move is in [0, num_distinct_actios - 1].
-          Returns an empty list at terminal states, or if it is not the specified
+          A read-only numpy bool array of length num_distinct_actions, shared between calls
+          until the state changes. All False at terminal states, or if it is not the specified
           player's turn.
         """
-        if player is not None and player != self._cur_player:
-            return []
-        elif self.is_terminal():
-            return []
+        if (player is not None and player != self._cur_player) or self.is_terminal():
+            return _NO_LEGAL_MASK
         else:
-            action_mask = [0] * _ACT_END
-            for action in self.legal_actions():
-                action_mask[action] = 1
-            return action_mask
+            return self._legal_cache()[1]
 
 
     def do_apply_action(self, action):
@@ -1331,125 +1932,145 @@ class ElGrandeGameState(pyspiel.State):
         # _ACT_DECIDE_CAB, _ACT_DECIDE_ACT = _ACT_DECIDE_CAB + 1, _ACT_CHOOSE_SECRETS (+ _NUM_REGIONS), _ACT_MOVE_GRANDES (+ _NUM_REGIONS), 
         # _ACT_MOVE_KINGS (+ _NUM_REGIONS), _ACT_CAB_MOVES (+ _NUM_CAB_AREAS * _NUM_CAB_AREAS * _MAX_PLAYERS), _ACT_SKIP
 
-        #don't apply an illegal action
-        if not action in self.legal_actions():
-            return
+        old = None #packed buffer before the action, for updating the hash
+        if self._rollout:
+            self._zobrist = None #rollouts are never hashed, so don't pay for keeping it up to date
+        else:
+            #don't apply an illegal action
+            if self.is_terminal() or not (0 <= action < _ACT_END and self._legal_cache()[1][action]):
+                return
+            if self._undo_stack is not None:
+                frame = self._undo_frame()
+                self._undo_stack.append(frame)
+                old = frame[0]
+            elif self._zobrist is not None:
+                old = self._packed.copy()
+            self._history = (self._history,action)
+        self._legal = None
 
         #initialise rewards to zero
-        self._set_rewards(np.full(self._num_players,0))
-        #if self._dealing:
-        #    self._deal_cards_from_action(action)
-        #el
-        if action>=_ACT_CARDS and action < _ACT_CARDS + _NUM_ACTION_CARDS:
-            self._acard_state[action - _ACT_CARDS] = _ST_AC_CHOSEN
-            self._turn_state[_ST_TN_PHASE] = _ST_PHASE_CHOOSE
-        elif action >= _ACT_POWERS and action < _ACT_POWERS + _NUM_POWER_CARDS:
-            self._assign_power(action - _ACT_POWERS)
-            self._after_power_choice() #find next player to pick power card, or move on one phase
-        elif action >= _ACT_RETRIEVE_POWERS and action < _ACT_RETRIEVE_POWERS + _NUM_POWER_CARDS:
-            self._retrieve_power(action - _ACT_RETRIEVE_POWERS) #one-step action always
-            self._after_action_step() #check if we need to move to next player, or next step, or keep playing actions
-        elif action == _ACT_DECIDE_CAB:
-            self._turn_state[_ST_TN_PHASE]=_ST_PHASE_CAB1
+        self._state_returns = _NO_REWARDS[self._num_players]
+        kind,arg1,arg2,arg3 = _ACT_DECODE[action]
+        _APPLY_JUMP[kind](self,arg1,arg2,arg3)
+        if self._meta.item(_PK_M_HORIZON) or self._meta.item(_PK_M_PLIES_LEFT):
+            self._check_horizon()
+
+        if self._zobrist is not None:
+            #swap the keys of the slots this action changed
+            zobrist = self._zobrist
+            for slot in np.flatnonzero(old != self._packed).tolist():
+                zobrist ^= _mix64((slot << 16) | (old.item(slot) & 0xFFFF)) ^ _mix64((slot << 16) | (self._packed.item(slot) & 0xFFFF))
+            self._zobrist = zobrist
+
+    #do_apply_action handlers, one per action kind - see _APPLY_JUMP
+
+    def _apply_card(self,card,_arg2,_arg3):
+        self._acard_state[card] = _ST_AC_CHOSEN
+        self._chosen_card = card
+        self._turn_state[_ST_TN_PHASE] = _ST_PHASE_CHOOSE
+
+    def _apply_power(self,card,_arg2,_arg3):
+        self._assign_power(card)
+        self._after_power_choice() #find next player to pick power card, or move on one phase
+
+    def _apply_retrieve(self,card,_arg2,_arg3):
+        self._retrieve_power(card) #one-step action always
+        self._after_action_step() #check if we need to move to next player, or next step, or keep playing actions
+
+    def _apply_decide_cab(self,_arg1,_arg2,_arg3):
+        self._turn_state[_ST_TN_PHASE]=_ST_PHASE_CAB1
+        self._pack_court()
+        self._setup_caballero_placement()
+
+    def _apply_decide_act(self,alt,_arg2,_arg3):
+        if self._get_phase()!=_ST_PHASE_CARD2:
+            self._turn_state[_ST_TN_PHASE]=_ST_PHASE_CARD1
             self._pack_court()
-            self._setup_caballero_placement()
-        elif action in [_ACT_DECIDE_ACT,_ACT_DECIDE_ACT_ALT]:
-            if self._turn_state[_ST_TN_PHASE]!=_ST_PHASE_CARD2:
-                self._turn_state[_ST_TN_PHASE]=_ST_PHASE_CARD1
-                self._pack_court()
-            self._setup_action(1 if action==_ACT_DECIDE_ACT_ALT else 0)
-        elif action >= _ACT_CHOOSE_SECRETS and action < _ACT_CHOOSE_SECRETS + _NUM_REGIONS:
-            self._set_secret_region(action - _ACT_CHOOSE_SECRETS)
-            if self._turn_state[_ST_TN_PHASE]==_ST_PHASE_SCORE:
-                next_player = self._next_score_step_player()
-                if next_player>=0:
-                    self._cur_player = next_player
-                else:
-                    self._after_score_step()
-            else:
-                #if we weren't chosing for cab movement in scoring, we were choosing for a card action
-                self._apply_secret_choice(action)
-                self._after_action_step() 
-        elif action >= _ACT_MOVE_GRANDES and action < _ACT_MOVE_GRANDES + _NUM_REGIONS:
-            self._move_grande(action - _ACT_MOVE_GRANDES) #1-step action always
-            self._after_action_step() 
-        elif action >= _ACT_MOVE_KINGS and action < _ACT_MOVE_KINGS + _NUM_REGIONS:
-            self._move_king(action - _ACT_MOVE_KINGS) #1-step action always
-            self._after_action_step() 
-        elif action >= _ACT_MOVE_SCOREBOARDS and action < _ACT_MOVE_SCOREBOARDS + (_NUM_SCOREBOARDS*_NUM_REGIONS):
-            board = (action - _ACT_MOVE_SCOREBOARDS)//_NUM_REGIONS
-            region = (action - _ACT_MOVE_SCOREBOARDS)%_NUM_REGIONS
-            self._move_scoreboard(board,region)
-            self._after_action_step() 
-        elif action == _ACT_TRIGGER:
-            #trigger an instant action
-            card = self._get_current_card()
-            if card['actiontype']=='score':
-                self._special_score(card['details'])
+        self._setup_action(alt)
+
+    def _apply_secret(self,region,_arg2,_arg3):
+        self._set_secret_region(region)
+        if self._get_phase()==_ST_PHASE_SCORE:
+            next_player = self._next_score_step_player()
+            if next_player>=0:
+                self._cur_player = next_player
             else:
-                #instant actions are all either move or score
-                self._instant_move()
-            self._after_action_step()
-        elif action == _ACT_SKIP:
-            #skip an instant action
-            self._init_move_info()
-            self._after_action_step()
+                self._after_score_step()
         else:
-            #moving a caballero fromregion, toregion, ofplayer
-            fromRegion = (action- _ACT_CAB_MOVES)//(_NUM_CAB_AREAS * _MAX_PLAYERS)
-            toRegion = ((action- _ACT_CAB_MOVES)%(_NUM_CAB_AREAS * _MAX_PLAYERS))//_MAX_PLAYERS
-            ofPlayer = (action- _ACT_CAB_MOVES)%_MAX_PLAYERS
-            self._move_one_cab(fromRegion, toRegion, ofPlayer)        
+            #if we weren't chosing for cab movement in scoring, we were choosing for a card action
+            self._apply_secret_choice(region + _ACT_CHOOSE_SECRETS)
             self._after_action_step() 
+
+    def _apply_grande(self,region,_arg2,_arg3):
+        self._move_grande(region) #1-step action always
+        self._after_action_step() 
+
+    def _apply_king(self,region,_arg2,_arg3):
+        self._move_king(region) #1-step action always
+        self._after_action_step() 
+
+    def _apply_scoreboard(self,board,region,_arg3):
+        self._move_scoreboard(board,region)
+        self._after_action_step() 
+
+    def _apply_cab_move(self,fromRegion,toRegion,ofPlayer):
+        #moving a caballero fromregion, toregion, ofplayer
+        self._move_one_cab(fromRegion, toRegion, ofPlayer)        
+        self._after_action_step() 
+
+    def _apply_skip(self,_arg1,_arg2,_arg3):
+        #skip an instant action
+        self._init_move_info()
+        self._after_action_step()
+
+    def _apply_trigger(self,_arg1,_arg2,_arg3):
+        #trigger an instant action
+        card = self._get_current_card()
+        if card['actiontype']=='score':
+            self._special_score(card['details'])
+        else:
+            #instant actions are all either move or score
+            self._instant_move()
+        self._after_action_step()
     
-    
+    def record_undo(self):
+        """Start keeping what each applied action changes, so that the actions applied from now on can be undone.
+        Off by default, as the stack grows by a copy of the state per action until they are undone.
+        """
+        if self._undo_stack is None:
+            self._undo_stack = []
+
+    def undo_action(self, player=None, action=None):
+        """Steps back out of the most recently applied action - only actions applied since record_undo can be undone.
+        Args (player, action) are accepted for compatibility with the pyspiel API but are not needed -
+        the state keeps its own stack of what each applied action changed.
+        """
+        if not self._undo_stack:
+            raise ValueError("No recorded action to undo, see record_undo")
+        self._restore_frame(self._undo_stack.pop())
+
     def action_to_string(self, arg0, arg1=None, withPlayer=True):
         """Action -> string. Args either (player, action) or (action)."""
         player = self.current_player() if arg1 is None else arg0
         action = arg0 if arg1 is None else arg1
-        actionString=""
-        #if self._dealing:
-        #    actionString = "Deal " + "|".join([pieces._CARDS[c]['name'] for c in self._cards_for_action(action)])
-        #el
-        if action>=_ACT_CARDS and action < _ACT_CARDS + _NUM_ACTION_CARDS:
-            cardname = pieces._CARDS[pieces._CARDTRACK[action-_ACT_CARDS]]['name']
-            actionString = "Action "+cardname
-        elif action >= _ACT_POWERS and action < _ACT_POWERS + _NUM_POWER_CARDS:
-            actionString = "Power "+str(action + 1 - _ACT_POWERS)
-        elif action >= _ACT_RETRIEVE_POWERS and action < _ACT_RETRIEVE_POWERS + _NUM_POWER_CARDS:
-            actionString = "Retrieve Power "+str(action + 1 - _ACT_RETRIEVE_POWERS)
-        elif action == _ACT_DECIDE_CAB:
-            actionString = "Caballero placement before card action"
-        elif action == _ACT_DECIDE_ACT:
-            actionString = "Card action before caballero placement"
-        elif action == _ACT_DECIDE_ACT_ALT:
-            actionString = "Card action (2nd choice) before caballero placement"
-        elif action >= _ACT_CHOOSE_SECRETS and action < _ACT_CHOOSE_SECRETS + _NUM_REGIONS:
-            actionString = "Choose "+ pieces._REGIONS[action - _ACT_CHOOSE_SECRETS]
-        elif action >= _ACT_MOVE_GRANDES and action < _ACT_MOVE_GRANDES + _NUM_REGIONS:
-            actionString = "Grande to "+ pieces._REGIONS[action - _ACT_MOVE_GRANDES]
-        elif action >= _ACT_MOVE_KINGS and action < _ACT_MOVE_KINGS + _NUM_REGIONS:
-            actionString = "King to "+ pieces._REGIONS[action - _ACT_MOVE_KINGS]
-        elif action >= _ACT_MOVE_SCOREBOARDS and action < _ACT_MOVE_SCOREBOARDS + (_NUM_SCOREBOARDS*_NUM_REGIONS):
-            board = (action - _ACT_MOVE_SCOREBOARDS)//_NUM_REGIONS
-            region = (action - _ACT_MOVE_SCOREBOARDS)%_NUM_REGIONS
-            actionString = "Move scoreboard "+ str(self._scoreboards[board]['points']) +" to " + pieces._REGIONS[region]   
-        elif action == _ACT_SKIP:
-            actionString = "Skip this step"
-        elif action == _ACT_TRIGGER:
-            actionString = "Trigger card action"
-        else:
-            #moving a caballero fromregion, toregion, ofplayer
-            fromRegion = (action- _ACT_CAB_MOVES)//(_NUM_CAB_AREAS * _MAX_PLAYERS)
-            toRegion = ((action- _ACT_CAB_MOVES)%(_NUM_CAB_AREAS * _MAX_PLAYERS))//_MAX_PLAYERS
-            ofPlayer = (action- _ACT_CAB_MOVES)%_MAX_PLAYERS
-            actionString = self._players[ofPlayer] + " caballero from " + pieces._REGIONS[fromRegion] + " to " + pieces._REGIONS[toRegion]        
-       
+        actionString = _action_labels(self._players)[0][action]
         if withPlayer: 
             return "{} ({})".format(self._players[player],actionString)
         else:
             return actionString
 
+    def string_to_action(self, arg0, arg1=None):
+        """String -> action, the inverse of action_to_string with or without the player. Args either (player, string) or (string)."""
+        action_str = arg0 if arg1 is None else arg1
+        index = _action_labels(self._players)[1]
+        action = index.get(action_str)
+        if action is None and action_str.endswith(")"):
+            #'player (action)' form
+            action = index.get(action_str[action_str.find(" (")+2:-1])
+        if action is None:
+            raise ValueError("Unknown action "+action_str)
+        return action
+
     def is_terminal(self):
         return self._is_terminal
 
@@ -1477,10 +2098,16 @@ class ElGrandeGameState(pyspiel.State):
         return False
 
     def history(self):
-        return self._history
+        actions = []
+        node = self._history
+        while node is not None:
+            node,action = node
+            actions.append(action)
+        actions.reverse()
+        return actions
 
     def history_str(self):
-        return str(self._history)
+        return str(self.history())
 
     def child(self, action):
         cloned_state = self.clone()
@@ -1503,7 +2130,17 @@ class ElGrandeGameState(pyspiel.State):
         return self._game.get_type()
 
     def serialize(self):
-        return pickle.dumps(self)
+        """Compact versioned byte encoding of this state - see ElGrandeGame.deserialize_state"""
+        tracker = self._movement_tracking.to_values()
+        history = self.history()
+        names = '\0'.join(self._players).encode('utf-8')
+        legal = self._legal[0] if self._legal is not None else () #a cached set always has at least one action
+        returns = np.concatenate([np.asarray(self._win_points,'<f8'),np.asarray(self._state_returns,'<f8')])
+        header = _SERIAL_HEADER.pack(_SERIAL_MAGIC,_SERIAL_VERSION,self._num_players,self._end_turn,
+                                     len(tracker),len(history),len(names),len(legal))
+        return b''.join([header,self._packed.astype('<i2').tobytes(),returns.tobytes(),
+                         np.array(tracker,'<i2').tobytes(),np.array(history,'<i2').tobytes(),names,
+                         np.array(legal,'<i2').tobytes()])
 
     def resample_from_infostate(self):
         return [self.clone()]
@@ -1524,40 +2161,48 @@ class ElGrandeGameState(pyspiel.State):
 
 
     def clone(self):
-        #TODO - see if we can do this without needing explicit statements
-        my_copy = self._game.new_initial_state()
-        my_copy._acard_state = self._acard_state.copy()
-        my_copy._acard_round = self._acard_round.copy()
-        my_copy._board_state = self._board_state.copy()
-        my_copy._cur_player=self._cur_player
-        #my_copy._dealing = self._dealing
-        my_copy._end_turn = self._end_turn
-        my_copy._history=self._history.copy()
-        my_copy._is_terminal=self._is_terminal
-        my_copy._movement_tracking = copy.deepcopy(self._movement_tracking)
-        my_copy._num_players=self._num_players
-        my_copy._past_pcard_state = self._past_pcard_state.copy()
-        my_copy._pcard_state = self._pcard_state.copy()
-        my_copy._players = self._players.copy()
-        my_copy._playersdone = self._playersdone.copy()
-        my_copy._playersleft = self._playersleft.copy()
-        my_copy._rewards = self._rewards.copy()
-        my_copy._scoreboards = self._scoreboards.copy()
-        my_copy._turn_state = self._turn_state.copy()
-        my_copy._win_points = self._win_points.copy()
-        my_copy._state_returns = self._state_returns.copy()
-        my_copy._winner=self._winner
-        return my_copy
+        return ElGrandeGameState(self._game,self)
+
+    def rollout(self, seed=None):
+        """Plays this state to the end in place, in rollout mode, with uniformly random legal actions drawn from
+        its random stream (reseeded first if seed is given). Returns the returns.
+        """
+        if seed is not None:
+            self.seed(seed)
+        self.start_rollout()
+        rng = self._rng
+        while not self._is_terminal:
+            self.do_apply_action(self.random_legal_action(rng.random()))
+        return self.returns()
+
+    def rollouts(self, n, random_state=None):
+        """Returns (n x players) returns from n random playouts of this state, see interleaved_rollouts."""
+        return interleaved_rollouts([self.clone() for _ in range(n)],random_state)
+
+    @staticmethod
+    def batch_rollouts(states, n, random_state=None):
+        """Returns (states x n x players) returns from n random playouts of each of states, see interleaved_rollouts."""
+        returns = interleaved_rollouts([state.clone() for state in states for _ in range(n)],random_state)
+        return returns.reshape(len(states),n,-1)
+
+#do_apply_action dispatch, indexed by action kind (_AK_*)
+_APPLY_JUMP = [ElGrandeGameState._apply_card, ElGrandeGameState._apply_power, ElGrandeGameState._apply_retrieve,
+               ElGrandeGameState._apply_decide_cab, ElGrandeGameState._apply_decide_act, ElGrandeGameState._apply_secret,
+               ElGrandeGameState._apply_grande, ElGrandeGameState._apply_king, ElGrandeGameState._apply_scoreboard,
+               ElGrandeGameState._apply_cab_move, ElGrandeGameState._apply_skip, ElGrandeGameState._apply_trigger]
 
 class ElGrandeGame(pyspiel.Game):
     """El Grande Game
     """
 
-    def __init__(self,params={"players":pyspiel.GameParameter(_DEFAULT_PLAYERS),"game_state":pyspiel.GameParameter(''),"game_state_json":pyspiel.GameParameter('')}):
-        couchip = '127.0.0.1:5984'
-        credentials = 'admin:elderberry'
-        couch = couchdb.Server('http://'+credentials+'@'+couchip)
+    def __init__(self,params={"players":pyspiel.GameParameter(_DEFAULT_PLAYERS),"game_state":pyspiel.GameParameter(''),"game_state_json":pyspiel.GameParameter('')},game_state_doc=None,seed=None):
+        """game_state_doc - an already-parsed game history document, used in preference to the
+        game_state/game_state_json parameters and skipping the round trip through a json string
+        seed - int or np.random.SeedSequence; each new state gets its own stream spawned from it.
+        None draws fresh entropy, so runs are only reproducible with a seed.
+        """
         super().__init__(self, _GAME_TYPE, _GAME_INFO, params or dict())
+        self._seed_seq = seed if isinstance(seed,np.random.SeedSequence) else np.random.SeedSequence(seed)
         self._num_players=4
         if params.get("players",None) is not None:
             self._num_players=params["players"].int_value()
@@ -1568,19 +2213,39 @@ class ElGrandeGame(pyspiel.Game):
             game_state=params["game_state"].string_value()
         if params.get("game_state_json",None) is not None:
             game_state_json=params["game_state_json"].string_value()
+        #search horizon for new states - see ElGrandeGameState.set_horizon
+        self._horizon='game'
+        self._horizon_plies=0
+        if params.get("horizon",None) is not None:
+            self._horizon=params["horizon"].string_value()
+        if params.get("horizon_plies",None) is not None:
+            self._horizon_plies=params["horizon_plies"].int_value()
+        if self._horizon not in _HORIZON_IDS:
+            raise ValueError("Unknown horizon "+self._horizon)
 
         #there is no need for _state and _state_json to both be given as parameters - if they are, use _state_json
-        if game_state == '' and game_state_json == '':
+        if game_state_doc is not None:
+            self._game_state = game_state_doc
+        elif game_state == '' and game_state_json == '':
             self._game_state=''
         elif game_state_json != '':
             #parameter is actually a string - convert to json doc for compatibility
             self._game_state = json.loads(game_state_json)
         else:
+            couchip = '127.0.0.1:5984'
+            credentials = 'admin:elderberry'
+            couch = couchdb.Server('http://'+credentials+'@'+couchip)
             gamehistdb = couch['game_history']
             self._game_state = gamehistdb[game_state]
 
     def new_initial_state(self):
-        return ElGrandeGameState(self)
+        state = ElGrandeGameState(self)
+        if self._horizon != 'game' or self._horizon_plies:
+            state.set_horizon(self._horizon,self._horizon_plies)
+        return state
+
+    def _spawn_rng(self):
+        return _make_rng(self._seed_seq.spawn(1)[0])
 
     def num_distinct_actions(self):
         return _ACT_END
@@ -1616,7 +2281,13 @@ class ElGrandeGame(pyspiel.Game):
         return pyspiel.TensorLayout.CHW
 
     def deserialize_state(self, string):
-        return pickle.loads(string)
+        """Decode ElGrandeGameState.serialize output - accepts bytes, bytearray or memoryview.
+        States decoded from writable buffers share memory with them rather than copying.
+        """
+        if bytes(memoryview(string)[:1]) == b'\x80':
+            #older pickled states
+            return pickle.loads(string)
+        return ElGrandeGameState(self,serialized=string)
 
     #def max_game_length(self):
     #    #9 turns, 6 phases per turn, 5 players
@@ -1631,6 +2302,55 @@ class ElGrandeGame(pyspiel.Game):
         return ElGrandeGameObserver()
 
 
+def interleaved_rollouts(states, random_state=None):
+    """Plays every state in states to the end with uniformly random legal actions, in place and in rollout mode.
+    State i is first reseeded with random_state.randint(_ROLLOUT_SEEDS,size=N)[i], then the states take turns at one
+    action each. Actions and chance outcomes come from each state's own stream, so every state plays out exactly as
+    ElGrandeGameState.rollout with that seed would - this is sequential play, interleaved, not a vectorised step.
+    Returns an (N x players) numpy array of returns.
+    """
+    rng = random_state or np.random
+    for state,seed in zip(states,rng.randint(_ROLLOUT_SEEDS,size=len(states)).tolist()):
+        state.seed(seed)
+        state.start_rollout()
+    active = states
+    while True:
+        active = [state for state in active if not state._is_terminal]
+        if not active:
+            break
+        for state in active:
+            state.do_apply_action(state.random_legal_action(state._rng.random()))
+    return np.array([state.returns() for state in states],dtype=float)
+
+
+#observation tensor layout - see ElGrandeGameObserver
+_OBS_BOARD_SIZE = _ST_IDCH*_ST_BDX_PROVINCE*_MAX_PLAYERS
+_OBS_GK_SIZE = _NUM_REGIONS*(_MAX_PLAYERS+1)
+_OBS_CARDS_SIZE = _NUM_ACTION_CARDS*2
+_OBS_PHASE_SIZE = 3
+_OBS_GK = _OBS_BOARD_SIZE
+_OBS_CARDS = _OBS_GK + _OBS_GK_SIZE
+_OBS_PHASE = _OBS_CARDS + _OBS_CARDS_SIZE
+_OBS_SIZE = _OBS_PHASE + _OBS_PHASE_SIZE
+_OBS_PHASE_BITS = np.array([[0,0,0],[0,0,0],[0,0,1],[0,1,0],[0,1,1],[1,0,0],[1,0,1],[1,1,0],[1,1,1],[1,1,1]],np.float32)
+
+def _encode_observations(packed, out):
+    """Fills out (N x _OBS_SIZE) from the packed state buffers of N states, stacked as (N x _PK_END)."""
+    n = packed.shape[0]
+    board = packed[:,_PK_BOARD:_PK_ACARD].reshape(n,_ST_BDX_END,_ST_BDY_END)
+    #caballero counts as _ST_IDCH bit channels, least significant first
+    cabs = np.ascontiguousarray(board[:,:_ST_BDX_PROVINCE,_ST_BDY_CABS:_ST_BDY_CABS+_MAX_PLAYERS],dtype='<u4')
+    bits = np.unpackbits(cabs.view(np.uint8),axis=-1,bitorder='little').reshape(n,_ST_BDX_PROVINCE,_MAX_PLAYERS,_ST_IDCH)
+    out[:,:_OBS_GK].reshape(n,_ST_IDCH,_ST_BDX_PROVINCE,_MAX_PLAYERS)[:] = bits.transpose(0,3,1,2)
+    gk = board[:,:_ST_BDX_CASTILLO,_ST_BDY_GRANDE_KING,None] >> np.arange(_MAX_PLAYERS+1)
+    out[:,_OBS_GK:_OBS_CARDS].reshape(n,_NUM_REGIONS,_MAX_PLAYERS+1)[:] = gk & 1
+    #2 bits per card, from the card state 0-3
+    cards = packed[:,_PK_ACARD:_PK_ACARD_ROUND]
+    out[:,_OBS_CARDS:_OBS_CARDS+_NUM_ACTION_CARDS] = cards >= _ST_AC_CHOSEN
+    out[:,_OBS_CARDS+_NUM_ACTION_CARDS:_OBS_PHASE] = cards & 1
+    out[:,_OBS_PHASE:] = _OBS_PHASE_BITS[packed[:,_PK_TURN+_ST_TN_PHASE]]
+    return out
+
 class ElGrandeGameObserver:
     """Observer, conforming to the PyObserver interface (see observer.py).
        Board representation - 5 bits per player per region, representing 0-30 caballeros
@@ -1638,39 +2358,31 @@ class ElGrandeGameObserver:
        Card representation - 2 bits per card - 00=Unplayed, 01=Dealt, 10=Chosen, 11=Done
        Phase representation - 000=Power/Start, 001=Action, 010=Choose, 011=Card1, 100=Cab1, 101=Card2, 110=Cab2, 111=Score/End 
     """
-    _PHASES=[[0,0,0],[0,0,0],[0,0,1],[0,1,0],[0,1,1],[1,0,0],[1,0,1],[1,1,0],[1,1,1],[1,1,1]]
+    _PHASES=_OBS_PHASE_BITS.tolist()
 
     def __init__(self):
-        board_size=(_ST_IDCH*_ST_BDX_PROVINCE*_MAX_PLAYERS)
-        gk_size=(_NUM_REGIONS*(_MAX_PLAYERS+1))
-        cards_size=(_NUM_ACTION_CARDS*2)
-        phase_size=3
-
-        self.tensor = np.zeros(board_size + gk_size + cards_size + phase_size, np.float32)
-        self._board = self.tensor[:board_size].reshape(_ST_IDCH, _ST_BDX_PROVINCE, _MAX_PLAYERS)
-        self._gk = self.tensor[board_size:(board_size+gk_size)].reshape(_NUM_REGIONS,_MAX_PLAYERS+1)
-        self._cards = self.tensor[(board_size+gk_size):(board_size+gk_size+cards_size)]
-        self._phase = self.tensor[(board_size+gk_size+cards_size):]
+        self.tensor = np.zeros(_OBS_SIZE, np.float32)
+        self._board = self.tensor[:_OBS_GK].reshape(_ST_IDCH, _ST_BDX_PROVINCE, _MAX_PLAYERS)
+        self._gk = self.tensor[_OBS_GK:_OBS_CARDS].reshape(_NUM_REGIONS,_MAX_PLAYERS+1)
+        self._cards = self.tensor[_OBS_CARDS:_OBS_PHASE]
+        self._phase = self.tensor[_OBS_PHASE:]
         self.dict = {"board": self._board,"grande_king":self._gk,"cards":self._cards,"phase":self._phase}
 
-
-
     def set_from(self, state, player):
         del player
-        for channel in range(_ST_IDCH):
-            chmat = (state._board_state[:_ST_BDX_PROVINCE,:_MAX_PLAYERS] >> channel)%2
-            self._board[channel,:,:]=chmat
-
-        for channel in range(_MAX_PLAYERS+1):
-            chvec = (state._board_state[:_ST_BDX_CASTILLO,_ST_BDY_GRANDE_KING] >> channel)%2
-            self._gk[:,channel]=chvec
+        _encode_observations(state._packed[None],self.tensor[None])
 
-        cards_ud_cd = [state._acard_state[s] in [_ST_AC_CHOSEN,_ST_AC_DONE] for s in range(_NUM_ACTION_CARDS)]
-        cards_uc_dd = [state._acard_state[s] in [_ST_AC_DEALT,_ST_AC_DONE] for s in range(_NUM_ACTION_CARDS)]
-        self._cards[:_NUM_ACTION_CARDS]=cards_ud_cd
-        self._cards[_NUM_ACTION_CARDS:]=cards_uc_dd
-
-        self._phase[:]=self._PHASES[state._turn_state[_ST_TN_PHASE]]
+    def set_from_batch(self, states, out=None):
+        """Encodes N states at once.
+        Args:
+          states: sequence of ElGrandeGameState
+          out: optional preallocated float32 array of shape (N, tensor size) to write into
+        Returns:
+          The (N, tensor size) array of observation tensors
+        """
+        if out is None:
+            out = np.zeros((len(states),_OBS_SIZE),np.float32)
+        return _encode_observations(np.stack([s._packed for s in states]),out)
 
     def string_from(self, state, player):
         del player
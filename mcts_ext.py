@@ -19,12 +19,15 @@ from __future__ import division
 from __future__ import print_function
 
 import math
+import multiprocessing
 import time
 
 import numpy as np
 
 import pyspiel
 
+_CHANCE = int(pyspiel.PlayerId.CHANCE)
+
 
 class Evaluator(object):
   """Abstract class representing an evaluation function for a game.
@@ -38,6 +41,14 @@ class Evaluator(object):
     """Returns evaluation on given state."""
     raise NotImplementedError
 
+  def evaluate_batch(self, states):
+    """Returns evaluations of several states, one row per state.
+
+    Evaluators that can share work between states, e.g. by vectorising or
+    farming it out, should override this; by default each is evaluated alone.
+    """
+    return np.array([self.evaluate(state) for state in states])
+
   def prior(self, state):
     """Returns a probability for each legal action in the given state."""
     raise NotImplementedError
@@ -57,6 +68,9 @@ class RandomRolloutEvaluator(Evaluator):
 
   def evaluate(self, state):
     """Returns evaluation on given state."""
+    # Games that play their own random rollouts do all of them in one call.
+    if hasattr(state, "rollouts"):
+      return state.rollouts(self.n_rollouts, self._random_state).mean(axis=0)
     result = None
     for _ in range(self.n_rollouts):
       working_state = state.clone()
@@ -73,6 +87,14 @@ class RandomRolloutEvaluator(Evaluator):
 
     return result / self.n_rollouts
 
+  def evaluate_batch(self, states):
+    """Returns evaluations of several states, one row per state."""
+    # Games that play their own random rollouts do every state's in one call.
+    if hasattr(type(states[0]), "batch_rollouts"):
+      return states[0].batch_rollouts(states, self.n_rollouts,
+                                      self._random_state).mean(axis=1)
+    return super(RandomRolloutEvaluator, self).evaluate_batch(states)
+
   def prior(self, state):
     """Returns equal probability for all actions."""
     if state.is_chance_node():
@@ -82,15 +104,261 @@ class RandomRolloutEvaluator(Evaluator):
       return [(action, 1.0 / len(legal_actions)) for action in legal_actions]
 
 
+def _search_state(state):
+  """Returns the state to run simulations on, and whether it is undoable.
+
+  States whose undo_action steps back out of the last action without
+  arguments, as El Grande's do, are searched on a single clone recording undo
+  information, walking down the tree and back up again. Other states are
+  searched from as they are, cloned for every simulation.
+  """
+  if type(state).undo_action is pyspiel.State.undo_action:
+    return state, False
+  search_state = state.clone()
+  if hasattr(search_state, "record_undo"):
+    search_state.record_undo()
+  return search_state, True
+
+
+def _same_position(state, other):
+  """Whether two states are the same game position.
+
+  Games defining state equality, as El Grande does, are compared with it, as
+  their serialisations can also carry caches and history. Others are compared
+  by serialisation.
+  """
+  if type(state).__eq__ is not object.__eq__:
+    return state == other
+  return state.serialize() == other.serialize()
+
+
+class SearchTree(object):
+  """Pool of search nodes, stored as parallel arrays indexed by node.
+
+  The children of a node are allocated together, so they occupy the
+  contiguous index range `first_child[node]` to
+  `first_child[node] + num_children[node]`, and the values of all of them can
+  be computed at once from slices of the arrays.
+
+  Attributes:
+    action: The action leading to each node, -1 for a root.
+    player: Which player made the action.
+    prior: A prior probability for how likely the action will be selected.
+    explore_count: How many times each node was explored.
+    total_reward: The sum of rewards of rollouts through each node, from the
+      parent node's perspective.
+    solved: Whether a node is terminal or its subtree has been proven.
+    outcome: The rewards for all players of solved nodes.
+    first_child: Index of each node's first child.
+    num_children: Number of children of each node, 0 if not expanded.
+    size: Number of nodes allocated.
+    max_children: The most children any node has been expanded with.
+  """
+
+  def __init__(self, num_players, capacity=1024):
+    self.size = 0
+    self.max_children = 0
+    self.action = np.zeros(capacity, np.int64)
+    self.player = np.zeros(capacity, np.int64)
+    self.prior = np.zeros(capacity)
+    self.explore_count = np.zeros(capacity, np.int64)
+    self.total_reward = np.zeros(capacity)
+    self.solved = np.zeros(capacity, bool)
+    self.outcome = np.zeros((capacity, num_players))
+    self.first_child = np.zeros(capacity, np.int64)
+    self.num_children = np.zeros(capacity, np.int64)
+
+  _FIELDS = ("action", "player", "prior", "explore_count", "total_reward",
+             "solved", "outcome", "first_child", "num_children")
+
+  def _allocate(self, n):
+    """Returns the index of a new block of n zeroed nodes."""
+    start = self.size
+    if start + n > len(self.action):
+      capacity = max(2 * len(self.action), start + n)
+      for field in self._FIELDS:
+        old = getattr(self, field)
+        new = np.zeros((capacity,) + old.shape[1:], old.dtype)
+        new[:start] = old[:start]
+        setattr(self, field, new)
+    self.size = start + n
+    return start
+
+  def add_root(self, player):
+    """Adds a root node for a state where player is to play."""
+    root = self._allocate(1)
+    self.action[root] = -1
+    self.player[root] = player
+    self.prior[root] = 1
+    return root
+
+  def expand(self, node, player, actions_and_priors):
+    """Gives node one child per (action, prior) pair, played by player."""
+    n = len(actions_and_priors)
+    start = self._allocate(n)
+    if n:
+      actions, priors = zip(*actions_and_priors)
+      self.action[start:start + n] = actions
+      self.prior[start:start + n] = priors
+    self.player[start:start + n] = player
+    self.first_child[node] = start
+    self.num_children[node] = n
+    self.max_children = max(self.max_children, n)
+
+  def children(self, node):
+    """Returns the index range of node's children."""
+    start = self.first_child[node]
+    return range(start, start + self.num_children[node])
+
+  def set_outcome(self, node, outcome):
+    self.solved[node] = True
+    self.outcome[node] = outcome
+
+  def trim(self):
+    """Releases the unused capacity, e.g. before pickling."""
+    for field in self._FIELDS:
+      setattr(self, field, getattr(self, field)[:self.size].copy())
+
+  def collect(self, root, max_nodes=None):
+    """Compacts the tree to the nodes reachable from root.
+
+    Nodes that aren't descendants of root are dropped. If max_nodes is given,
+    the least visited subtrees are then evicted until at most max_nodes remain.
+    Their roots are kept with their statistics, but lose their children, so
+    that they get expanded afresh if visited again. The root's own children
+    are never evicted.
+
+    Args:
+      root: The node to keep the tree under.
+      max_nodes: Optional number of nodes to keep at most.
+
+    Returns:
+      The new index of root, always 0.
+    """
+    # Breadth-first order of reachable nodes, with each node's parent.
+    order = [root]
+    parents = [-1]
+    i = 0
+    while i < len(order):
+      n = self.num_children.item(order[i])
+      if n:
+        start = self.first_child.item(order[i])
+        order.extend(range(start, start + n))
+        parents.extend([i] * n)
+      i += 1
+
+    evicted = np.zeros(len(order), bool)
+    if max_nodes is not None and len(order) > max_nodes:
+      # Descendants of each node, and how many of those are already evicted.
+      descendants = [0] * len(order)
+      for i in range(len(order) - 1, 0, -1):
+        descendants[parents[i]] += descendants[i] + 1
+      removed = [0] * len(order)
+      excess = len(order) - max_nodes
+      expanded = [i for i in range(1, len(order)) if descendants[i]]
+      explore_count = self.explore_count[np.array(order)]
+      expanded.sort(key=lambda i: explore_count[i])
+      for i in expanded:
+        if excess <= 0:
+          break
+        ancestors = []
+        parent = parents[i]
+        while parent >= 0 and not evicted[parent]:
+          ancestors.append(parent)
+          parent = parents[parent]
+        if parent >= 0:
+          continue  # Already gone with an evicted ancestor.
+        freed = descendants[i] - removed[i]
+        evicted[i] = True
+        excess -= freed
+        for parent in ancestors:
+          removed[parent] += freed
+      # Keep only the nodes with no evicted ancestor.
+      gone = np.zeros(len(order), bool)
+      for i in range(1, len(order)):
+        if gone[parents[i]] or evicted[parents[i]]:
+          gone[i] = True
+      keep = np.flatnonzero(~gone)
+    else:
+      keep = np.arange(len(order))
+
+    old = np.array(order)[keep]
+    new_index = np.zeros(self.size, np.int64)
+    new_index[old] = np.arange(len(old))
+    for field in self._FIELDS:
+      setattr(self, field, getattr(self, field)[old])
+    self.num_children[evicted[keep]] = 0
+    self.first_child = np.where(self.num_children > 0,
+                                new_index[self.first_child], 0)
+    self.size = len(old)
+    return 0
+
+  def merge(self, node, other, other_node):
+    """Adds the statistics of other's subtree at other_node into node.
+
+    Visit counts and total rewards are summed for nodes reached by the same
+    actions, proven outcomes are kept from whichever tree has one, and
+    children only the other tree expanded are copied over.
+    """
+    stack = [(node, other_node)]
+    while stack:
+      node, other_node = stack.pop()
+      self.explore_count[node] += other.explore_count[other_node]
+      self.total_reward[node] += other.total_reward[other_node]
+      if not self.solved[node] and other.solved[other_node]:
+        self.set_outcome(node, other.outcome[other_node])
+      other_children = other.children(other_node)
+      if not other_children:
+        continue
+      if not self.num_children[node]:
+        self.expand(node, other.player[other_children[0]],
+                    list(zip(other.action[other_children],
+                             other.prior[other_children])))
+      by_action = {self.action.item(c): c for c in self.children(node)}
+      stack.extend((by_action[other.action.item(c)], c) for c in other_children)
+
+
+def _uct_values(tree, node, uct_c):
+  """UCT values of all of node's children, see SearchNode.uct_value."""
+  children = slice(tree.first_child[node],
+                   tree.first_child[node] + tree.num_children[node])
+  counts = tree.explore_count[children]
+  # An unvisited node's children are all unvisited too, and valued inf below.
+  parent_count = max(tree.explore_count.item(node), 1)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    values = (tree.total_reward[children] / counts + uct_c *
+              np.sqrt(math.log(parent_count) / counts))
+  values[counts == 0] = np.inf
+  solved = tree.solved[children]
+  if solved.any():
+    values[solved] = tree.outcome[children][solved, tree.player[children][solved]]
+  return values
+
+
+def _puct_values(tree, node, uct_c):
+  """PUCT values of all of node's children, see SearchNode.puct_value."""
+  children = slice(tree.first_child[node],
+                   tree.first_child[node] + tree.num_children[node])
+  counts = tree.explore_count[children]
+  values = (tree.total_reward[children] / np.maximum(counts, 1) +
+            uct_c * tree.prior[children] *
+            math.sqrt(tree.explore_count[node]) / (counts + 1))
+  solved = tree.solved[children]
+  if solved.any():
+    values[solved] = tree.outcome[children][solved, tree.player[children][solved]]
+  return values
+
+
 class SearchNode(object):
   """A node in the search tree.
 
   A SearchNode represents a state and possible continuations from it. Each child
-  represents a possible action, and the expected result from doing so.
+  represents a possible action, and the expected result from doing so. Nodes
+  are views of one entry of a SearchTree.
 
   Attributes:
-    action: The action from the parent node's perspective. Not important for the
-      root node, as the actions that lead to it are in the past.
+    action: The action from the parent node's perspective. None for the root
+      node, as the actions that lead to it are in the past.
     player: Which player made this action.
     prior: A prior probability for how likely this action will be selected.
     explore_count: How many times this node was explored.
@@ -102,24 +370,42 @@ class SearchNode(object):
     children: A list of SearchNodes representing the possible actions from this
       node, along with their expected rewards.
   """
-  __slots__ = [
-      "action",
-      "player",
-      "prior",
-      "explore_count",
-      "total_reward",
-      "outcome",
-      "children",
-  ]
-
-  def __init__(self, action, player, prior):
-    self.action = action
-    self.player = player
-    self.prior = prior
-    self.explore_count = 0
-    self.total_reward = 0.0
-    self.outcome = None
-    self.children = []
+  __slots__ = ["tree", "index"]
+
+  def __init__(self, tree, index):
+    self.tree = tree
+    self.index = index
+
+  @property
+  def action(self):
+    action = self.tree.action.item(self.index)
+    return None if action < 0 else action
+
+  @property
+  def player(self):
+    return self.tree.player.item(self.index)
+
+  @property
+  def prior(self):
+    return self.tree.prior.item(self.index)
+
+  @property
+  def explore_count(self):
+    return self.tree.explore_count.item(self.index)
+
+  @property
+  def total_reward(self):
+    return self.tree.total_reward.item(self.index)
+
+  @property
+  def outcome(self):
+    if not self.tree.solved[self.index]:
+      return None
+    return self.tree.outcome[self.index].copy()
+
+  @property
+  def children(self):
+    return [SearchNode(self.tree, c) for c in self.tree.children(self.index)]
 
   def uct_value(self, parent_explore_count, uct_c):
     """Returns the UCT value of child."""
@@ -185,17 +471,44 @@ class SearchNode(object):
     action = (
         state.action_to_string(state.current_player(), self.action)
         if state and self.action is not None else str(self.action))
+    outcome = self.outcome
     return ("{:>6}: player: {}, prior: {:5.3f}, value: {:6.3f}, sims: {:5d}, "
             "outcome: {}, {:3d} children").format(
                 action, self.player, self.prior, self.explore_count and
                 self.total_reward / self.explore_count, self.explore_count,
-                ("{:4.1f}".format(self.outcome[self.player])
-                 if self.outcome else "none"), len(self.children))
+                ("{:4.1f}".format(outcome[self.player])
+                 if outcome is not None else "none"),
+                self.tree.num_children.item(self.index))
 
   def __str__(self):
     return self.to_str(None)
 
 
+# Vectorised versions of the per-node child selection functions.
+_CHILD_VALUES = {
+    SearchNode.uct_value: _uct_values,
+    SearchNode.puct_value: _puct_values,
+}
+
+
+# How many simulations a deadline-driven search runs between checks on
+# whether its best move can still be overtaken.
+_EARLY_STOP_INTERVAL = 16
+
+
+# The bot, state and root expansion of a root-parallel search, set just
+# before the worker processes are forked so that they inherit them rather
+# than having them pickled.
+_WORKER_SEARCH = None
+
+
+def _worker_search(args):
+  """Runs one root-parallel worker's search, see MCTSBot.mcts_search."""
+  seed, num_simulations = args
+  bot, state, expansion = _WORKER_SEARCH
+  return bot._seeded_search(state, seed, num_simulations, expansion)  # pylint: disable=protected-access
+
+
 class MCTSBot(pyspiel.Bot):
   """Bot that uses Monte-Carlo Tree Search algorithm."""
 
@@ -208,7 +521,12 @@ class MCTSBot(pyspiel.Bot):
                random_state=None,
                child_selection_fn=SearchNode.uct_value,
                dirichlet_noise=None,
-               verbose=False):
+               verbose=False,
+               num_workers=1,
+               batch_size=1,
+               reuse_tree=True,
+               time_limit=None,
+               max_nodes=None):
     """Initializes a MCTS Search algorithm in the form of a bot.
 
     In multiplayer games, or non-zero-sum games, the players will play the
@@ -232,9 +550,31 @@ class MCTSBot(pyspiel.Bot):
       verbose: Whether to print information about the search tree before
         returning the action. Useful for confirming the search is working
         sensibly.
+      num_workers: Number of processes to search with. Above 1, each worker
+        runs an independent search of its share of max_simulations from the
+        same root with its own random stream, and their trees are merged.
+        Needs the 'fork' start method.
+      batch_size: Number of leaves to collect before evaluating them together
+        with `evaluator.evaluate_batch`. Above 1, nodes on the path to a leaf
+        waiting for evaluation carry a virtual loss, steering the following
+        descents elsewhere.
+      reuse_tree: Whether to keep the last search tree, and carry on from its
+        matching subtree when next asked about a state reached from the last
+        searched one by the actions played since.
+      time_limit: Optional wall-clock budget for each search, in seconds. The
+        search then stops at the deadline or max_simulations, whichever comes
+        first, or earlier once the most visited root child can't be overtaken
+        in the simulations left, at the rate seen so far.
+      max_nodes: Optional cap on the number of nodes in the search tree. When
+        the next expansions could take the tree past it, the least visited
+        subtrees are evicted, their roots keeping their statistics and being
+        expanded again if revisited. It should comfortably exceed the
+        branching factor times batch_size: the root's children are never
+        evicted, and smaller caps are overrun by a batch's expansions.
 
     Raises:
-      ValueError: if the game type isn't supported.
+      ValueError: if the game type isn't supported, or num_workers > 1 where
+        processes can't be forked.
     """
     pyspiel.Bot.__init__(self)
     # Check that the game satisfies the conditions for this MCTS implemention.
@@ -243,6 +583,9 @@ class MCTSBot(pyspiel.Bot):
       raise ValueError("Game must have terminal rewards.")
     if game_type.dynamics != pyspiel.GameType.Dynamics.SEQUENTIAL:
       raise ValueError("Game must have sequential turns.")
+    if (num_workers > 1 and
+        "fork" not in multiprocessing.get_all_start_methods()):
+      raise ValueError("Root-parallel search needs forked processes.")
 
     self._game = game
     self.uct_c = uct_c
@@ -254,9 +597,20 @@ class MCTSBot(pyspiel.Bot):
     self._dirichlet_noise = dirichlet_noise
     self._random_state = random_state or np.random.RandomState()
     self._child_selection_fn = child_selection_fn
+    self.num_workers = num_workers
+    self.batch_size = batch_size
+    self.reuse_tree = reuse_tree
+    self.time_limit = time_limit
+    self._deadline = None
+    self.max_nodes = max_nodes
+    # Vectorised child selection, if there is one for child_selection_fn.
+    self._child_values = _CHILD_VALUES.get(child_selection_fn)
+    # (root state, its history, tree, root index) of the last search, if kept.
+    self._tree = None
+    self._virtual_loss = game.min_utility()
 
   def restart_at(self, state):
-    pass
+    self._tree = None
 
   def multi_step(self, state,step_to_end=False):
     """Returns bot's next action at given state.
@@ -303,7 +657,9 @@ class MCTSBot(pyspiel.Bot):
     best = root.best_child()
 
     mcts_action = best.action
-    rewards =[c.total_reward/c.explore_count for c in reversed(sorted(root.children, key=SearchNode.sort_key))]
+    #a search stopped early can leave children unvisited - count those as no reward
+    rewards = [c.total_reward/c.explore_count if c.explore_count else 0.0
+               for c in reversed(sorted(root.children, key=SearchNode.sort_key))]
 
     return mcts_action,(rewards[0]-rewards[1])
 
@@ -338,56 +694,66 @@ class MCTSBot(pyspiel.Bot):
   def step(self, state):
     return self.step_with_policy(state)[1]
 
-  def _apply_tree_policy(self, root, state):
+  def _apply_tree_policy(self, tree, root, state, undoable):
     """Applies the UCT policy to play the game until reaching a leaf node.
 
     A leaf node is defined as a node that is terminal or has not been evaluated
     yet. If it reaches a node that has been evaluated before but hasn't been
-    expanded, then expand it's children and continue.
+    expanded, then expand it's children and continue. Nodes given children
+    before any visits, as root-parallel workers' roots are, count as evaluated.
 
     Args:
-      root: The root node in the search tree.
+      tree: The SearchTree being searched.
+      root: Index of the root node in the search tree.
       state: The state of the game at the root node.
+      undoable: Whether state is descended in place, see `_search_state`. The
+        caller is then responsible for undoing the actions along
+        `visit_path`; otherwise state is cloned.
 
     Returns:
-      visit_path: A list of nodes descending from the root node to a leaf node.
+      visit_path: A list of node indices descending from the root node to a
+        leaf node.
       working_state: The state of the game at the leaf node.
     """
     visit_path = [root]
-    working_state = state.clone()
+    working_state = state if undoable else state.clone()
     current_node = root
-    while not working_state.is_terminal() and current_node.explore_count > 0:
-      if not current_node.children:
+    while (not working_state.is_terminal() and
+           (tree.explore_count.item(current_node) > 0 or
+            tree.num_children.item(current_node))):
+      if not tree.num_children.item(current_node):
         # For a new node, initialize its state, then choose a child as normal.
         legal_actions = self.evaluator.prior(working_state)
-        if current_node is root and self._dirichlet_noise:
+        if current_node == root and self._dirichlet_noise:
           epsilon, alpha = self._dirichlet_noise
           noise = self._random_state.dirichlet([alpha] * len(legal_actions))
           legal_actions = [(a, (1 - epsilon) * p + epsilon * n)
                            for (a, p), n in zip(legal_actions, noise)]
         # Reduce bias from move generation order.
         self._random_state.shuffle(legal_actions)
-        player = working_state.current_player()
-        current_node.children = [
-            SearchNode(action, player, prior) for action, prior in legal_actions
-        ]
+        tree.expand(current_node, working_state.current_player(), legal_actions)
 
+      children = tree.children(current_node)
       if working_state.is_chance_node():
         # For chance nodes, rollout according to chance node's probability
         # distribution
         outcomes = working_state.chance_outcomes()
         action_list, prob_list = zip(*outcomes)
         action = self._random_state.choice(action_list, p=prob_list)
-        chosen_child = next(
-            c for c in current_node.children if c.action == action)
+        chosen_child = children.start + int(np.flatnonzero(
+            tree.action[children.start:children.stop] == action)[0])
+      elif self._child_values is not None:
+        # Otherwise choose node with largest UCT value, all at once
+        chosen_child = children.start + int(
+            np.argmax(self._child_values(tree, current_node, self.uct_c)))
       else:
-        # Otherwise choose node with largest UCT value
+        parent_explore_count = tree.explore_count.item(current_node)
         chosen_child = max(
-            current_node.children,
+            children,
             key=lambda c: self._child_selection_fn(  # pylint: disable=g-long-lambda
-                c, current_node.explore_count, self.uct_c))
+                SearchNode(tree, c), parent_explore_count, self.uct_c))
 
-      working_state.apply_action(chosen_child.action)
+      working_state.apply_action(tree.action.item(chosen_child))
       current_node = chosen_child
       visit_path.append(current_node)
 
@@ -436,57 +802,315 @@ class MCTSBot(pyspiel.Bot):
     - Winands, Bjornsson, and Saito, "Monte-Carlo Tree Search Solver", 2008.
       https://dke.maastrichtuniversity.nl/m.winands/documents/uctloa.pdf
 
+    With num_workers > 1 the simulations are shared out between independent
+    searches in worker processes, and the root returned is their merged tree.
+    With batch_size > 1 leaves are evaluated batch_size at a time, see
+    `_batched_search`. With reuse_tree, a search from a state that follows on
+    from the last one continues in the matching subtree of the last tree.
+
     Arguments:
       state: pyspiel.State object, state to search from
 
     Returns:
-      The most visited move from the root node.
+      The root SearchNode. With reuse_tree, it is only valid until the next
+      search.
+    """
+    reused = self._reusable_root(state) if self.reuse_tree else None
+    if reused is None:
+      tree = SearchTree(len(state.returns()))
+      root = tree.add_root(state.current_player())
+    else:
+      tree, root = reused
+    # Set before any workers are forked, so they share the deadline.
+    self._deadline = (time.time() + self.time_limit
+                      if self.time_limit is not None else None)
+    if self.num_workers > 1:
+      root = self._root_parallel_search(state, tree, root)
+    else:
+      root = self._search(state, self.max_simulations, tree, root)
+    if self.reuse_tree:
+      self._tree = (state.clone(), state.history(), tree, root)
+    return SearchNode(tree, root)
+
+  def _reusable_root(self, state):
+    """Returns the kept tree and its node for state, or None if there isn't one.
+
+    The state must be the last searched state, or reached from it by the
+    actions added to its history since, and all of those actions must have
+    been expanded in the tree. The tree is compacted to the node's subtree.
+    """
+    if self._tree is None:
+      return None
+    last_state, last_history, tree, node = self._tree
+    history = state.history()
+    if history[:len(last_history)] != last_history:
+      return None
+    replayed = last_state.clone()
+    for action in history[len(last_history):]:
+      node = next((c for c in tree.children(node)
+                   if tree.action.item(c) == action), None)
+      if node is None:
+        return None
+      replayed.apply_action(action)
+    # Histories alone can't tell apart states that weren't played from the
+    # start, such as positions loaded mid-game.
+    if not _same_position(replayed, state):
+      return None
+    return tree, tree.collect(node, self.max_nodes)
+
+  def _root_parallel_search(self, state, tree, root):
+    """Root-parallel search over num_workers forked processes.
+
+    Workers always search afresh, from the root expanded as in tree, and their
+    trees are merged into tree. Simulations of an unexpanded root run here
+    until they expand it, so that the workers' simulations all go to the
+    root's children, as in a single-process search.
+    """
+    global _WORKER_SEARCH
+    num_simulations = self.max_simulations
+    while (num_simulations and not tree.num_children[root] and
+           not tree.solved[root]):
+      root = self._search(state, 1, tree, root)
+      num_simulations -= 1
+    if not num_simulations or not tree.num_children[root] or tree.solved[root]:
+      return root
+    children = tree.children(root)
+    expansion = (tree.player.item(children[0]),
+                 list(zip(tree.action[children].tolist(),
+                          tree.prior[children].tolist())))
+    seeds = np.random.SeedSequence(
+        self._random_state.randint(2**31)).spawn(self.num_workers)
+    shares = [
+        num_simulations // self.num_workers +
+        (i < num_simulations % self.num_workers)
+        for i in range(self.num_workers)
+    ]
+    _WORKER_SEARCH = (self, state, expansion)
+    try:
+      with multiprocessing.get_context("fork").Pool(self.num_workers) as pool:
+        results = pool.map(_worker_search, list(zip(seeds, shares)))
+    finally:
+      _WORKER_SEARCH = None
+    for other, other_root in results:
+      tree.merge(root, other, other_root)
+    if self.max_nodes is not None and tree.size > self.max_nodes:
+      root = tree.collect(root, self.max_nodes)
+    return root
+
+  def _seeded_search(self, state, seed, num_simulations, expansion):
+    """Searches with random streams drawn from seed, in a worker process.
+
+    The search starts from a root expanded with expansion, the player and
+    (action, prior) pairs of its children.
+
+    Returns:
+      The search tree, trimmed for sending back, and its root index.
+    """
+    bot_seed, evaluator_seed, state_seed = seed.spawn(3)
+    self._random_state = np.random.RandomState(np.random.MT19937(bot_seed))
+    if hasattr(self.evaluator, "_random_state"):
+      self.evaluator._random_state = np.random.RandomState(  # pylint: disable=protected-access
+          np.random.MT19937(evaluator_seed))
+    if hasattr(state, "seed"):
+      state.seed(state_seed)
+    tree = SearchTree(len(state.returns()))
+    root = tree.add_root(state.current_player())
+    tree.expand(root, *expansion)
+    root = self._search(state, num_simulations, tree, root)
+    tree.trim()
+    return tree, root
+
+  def _make_room(self, tree, root):
+    """Evicts subtrees if the next expansions could take tree past max_nodes.
+
+    Only called between simulations, as eviction renumbers the nodes.
+
+    Returns:
+      The index of root afterwards.
+    """
+    if self.max_nodes is None:
+      return root
+    # Caps too small for a batch's expansions reserve a quarter of the cap
+    # instead, and are overrun by the expansions, rather than being emptied
+    # before every simulation.
+    headroom = min(tree.max_children * self.batch_size, self.max_nodes // 4)
+    if tree.size + headroom <= self.max_nodes:
+      return root
+    # Free a quarter more than needed, so that evictions aren't too frequent,
+    # but always keep the root and its children.
+    keep = max((self.max_nodes - headroom) * 3 // 4,
+               1 + tree.num_children.item(root))
+    return tree.collect(root, keep)
+
+  def _search(self, state, num_simulations, tree, root):
+    """Single-process search of num_simulations, see mcts_search.
+
+    Args:
+      state: pyspiel.State object, state to search from
+      num_simulations: Number of simulations to run.
+      tree: The SearchTree to search in.
+      root: Index of the node in tree for state.
+
+    Returns:
+      The index of the root node, which moves if subtrees are evicted.
     """
+    if self.batch_size > 1:
+      return self._batched_search(state, num_simulations, tree, root)
     root_player = state.current_player()
-    root = SearchNode(None, state.current_player(), 1)
-    for _ in range(self.max_simulations):
-      visit_path, working_state = self._apply_tree_policy(root, state)
+    # Games that can undo actions run every simulation on a single working
+    # state, walking down the tree and back up again instead of cloning.
+    search_state, undoable = _search_state(state)
+    start = time.time()
+    for simulations in range(1, num_simulations + 1):
+      root = self._make_room(tree, root)
+      visit_path, working_state = self._apply_tree_policy(
+          tree, root, search_state, undoable)
       if working_state.is_terminal():
         returns = working_state.returns()
-        visit_path[-1].outcome = returns
+        tree.set_outcome(visit_path[-1], returns)
         solved = self.solve
       else:
         returns = self.evaluator.evaluate(working_state)
         solved = False
+      self._backup(tree, visit_path, returns, solved, root_player)
+      if undoable:
+        for _ in range(len(visit_path) - 1):
+          working_state.undo_action()
+      if tree.solved[root]:
+        break
+      if (self._deadline is not None and self._budget_spent(
+          tree, root, simulations, num_simulations, start,
+          simulations % _EARLY_STOP_INTERVAL == 0)):
+        break
+
+    return root
+
+  def _budget_spent(self, tree, root, simulations, num_simulations, start,
+                    check_lead):
+    """Whether a deadline-driven search should stop.
+
+    Args:
+      tree: The SearchTree being searched.
+      root: Index of the root node.
+      simulations: Number of simulations run so far.
+      num_simulations: Most simulations the search may run.
+      start: Time the search started.
+      check_lead: Whether to check the lead of the most visited root child,
+        rather than just the deadline.
+
+    Returns:
+      True once the deadline has passed, or the most visited root child is
+      further ahead of the next than the simulations that are left.
+    """
+    now = time.time()
+    if now >= self._deadline:
+      return True
+    children = tree.children(root)
+    if not check_lead or not children:
+      return False
+    if len(children) == 1:
+      return True
+    remaining = min(num_simulations - simulations,
+                    simulations * (self._deadline - now) /
+                    max(now - start, 1e-6))
+    second, first = np.partition(
+        tree.explore_count[children.start:children.stop], -2)[-2:]
+    return first - second > remaining
+
+  def _batched_search(self, state, num_simulations, tree, root):
+    """Search evaluating up to batch_size leaves at a time.
+
+    Each round descends from the root batch_size times before evaluating
+    anything. Every node on the path to a leaf awaiting evaluation carries a
+    virtual loss - an extra visit with the game's minimum utility - so later
+    descents in the round favour other paths. Terminal leaves are backed up
+    straight away. The non-terminal ones are then evaluated together with
+    `evaluator.evaluate_batch`, their virtual losses are removed and their
+    results backed up.
 
-      for node in reversed(visit_path):
-        node.total_reward += returns[root_player if node.player ==
-                                     pyspiel.PlayerId.CHANCE else node.player]
-        node.explore_count += 1
-
-        if solved and node.children:
-          player = node.children[0].player
-          if player == pyspiel.PlayerId.CHANCE:
-            # Only back up chance nodes if all have the same outcome.
-            # An alternative would be to back up the weighted average of
-            # outcomes if all children are solved, but that is less clear.
-            outcome = node.children[0].outcome
-            if (outcome is not None and
-                all(np.array_equal(c.outcome, outcome) for c in node.children)):
-              node.outcome = outcome
-            else:
-              solved = False
-          else:
-            # If any have max utility (won?), or all children are solved,
-            # choose the one best for the player choosing.
-            best = None
-            all_solved = True
-            for child in node.children:
-              if child.outcome is None:
-                all_solved = False
-              elif best is None or child.outcome[player] > best.outcome[player]:
-                best = child
-            if (best is not None and
-                (all_solved or best.outcome[player] == self.max_utility)):
-              node.outcome = best.outcome
-            else:
-              solved = False
-      if root.outcome is not None:
+    Args:
+      state: pyspiel.State object, state to search from
+      num_simulations: Number of leaves to reach.
+      tree: The SearchTree to search in.
+      root: Index of the node in tree for state.
+
+    Returns:
+      The index of the root node, which moves if subtrees are evicted.
+    """
+    root_player = state.current_player()
+    search_state, undoable = _search_state(state)
+    start = time.time()
+    simulations = 0
+    while simulations < num_simulations and not tree.solved[root]:
+      if (simulations and self._deadline is not None and self._budget_spent(
+          tree, root, simulations, num_simulations, start, True)):
         break
+      root = self._make_room(tree, root)
+      pending = []
+      leaves = []
+      for _ in range(min(self.batch_size, num_simulations - simulations)):
+        simulations += 1
+        visit_path, working_state = self._apply_tree_policy(
+            tree, root, search_state, undoable)
+        if working_state.is_terminal():
+          returns = working_state.returns()
+          tree.set_outcome(visit_path[-1], returns)
+          self._backup(tree, visit_path, returns, self.solve, root_player)
+        else:
+          tree.explore_count[visit_path] += 1
+          tree.total_reward[visit_path] += self._virtual_loss
+          pending.append(visit_path)
+          # The working state is unwound below, so keep a copy of the leaf.
+          leaves.append(working_state.clone() if undoable else working_state)
+        if undoable:
+          for _ in range(len(visit_path) - 1):
+            working_state.undo_action()
+        if tree.solved[root]:
+          break
+      if not pending:
+        continue
+      for visit_path, returns in zip(pending,
+                                     self.evaluator.evaluate_batch(leaves)):
+        tree.explore_count[visit_path] -= 1
+        tree.total_reward[visit_path] -= self._virtual_loss
+        self._backup(tree, visit_path, returns, False, root_player)
 
     return root
+
+  def _backup(self, tree, visit_path, returns, solved, root_player):
+    """Adds returns to the nodes along visit_path, proving them if solved."""
+    players = tree.player[visit_path]
+    tree.total_reward[visit_path] += np.asarray(returns, float)[
+        np.where(players == _CHANCE, root_player, players)]
+    tree.explore_count[visit_path] += 1
+    if not solved:
+      return
+
+    for node in reversed(visit_path):
+      children = tree.children(node)
+      if not children:
+        continue
+      children = slice(children.start, children.stop)
+      player = tree.player.item(children.start)
+      if player == _CHANCE:
+        # Only back up chance nodes if all have the same outcome.
+        # An alternative would be to back up the weighted average of
+        # outcomes if all children are solved, but that is less clear.
+        outcome = tree.outcome[children.start]
+        if (tree.solved[children].all() and
+            (tree.outcome[children] == outcome).all()):
+          tree.set_outcome(node, outcome)
+        else:
+          return
+      else:
+        # If any have max utility (won?), or all children are solved,
+        # choose the one best for the player choosing.
+        child_solved = tree.solved[children]
+        if not child_solved.any():
+          return
+        values = np.where(child_solved, tree.outcome[children, player], -np.inf)
+        best = int(np.argmax(values))
+        if child_solved.all() or values[best] == self.max_utility:
+          tree.set_outcome(node, tree.outcome[children.start + best])
+        else:
+          return
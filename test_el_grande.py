@@ -0,0 +1,392 @@
+import collections
+import copy
+import random
+
+import numpy as np
+import pyspiel
+import pytest
+
+import el_grande
+import el_grande_pieces as pieces
+
+
+def _new_state(players=3, seed=0):
+    game = el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(players)},seed=seed)
+    state = game.new_initial_state()
+    state.set_horizon('scoring')
+    return game,state
+
+def _random_walk(state, rng, steps=400):
+    #(state before, action) pairs along a random playout of state, which is advanced in place
+    for _ in range(steps):
+        if state.is_terminal():
+            return
+        before = state.clone()
+        action = int(rng.choice(state.legal_actions()))
+        state.apply_action(action)
+        yield before,action
+
+
+@pytest.mark.parametrize("seed",range(4))
+def test_undo_restores_every_position(seed):
+    _,state = _new_state(seed%3+2,seed)
+    state.record_undo()
+    rng = np.random.RandomState(seed)
+    path = list(_random_walk(state,rng))
+    for before,action in reversed(path):
+        state.undo_action()
+        assert state == before
+        assert state.zobrist_hash() == before.zobrist_hash()
+        assert state.legal_actions() == before.legal_actions()
+        assert state.history() == before.history()
+    #and forward again
+    for before,action in path:
+        assert state == before
+        state.apply_action(action)
+
+def test_undo_needs_recording():
+    _,state = _new_state()
+    state.apply_action(state.legal_actions()[0])
+    assert state._undo_stack is None
+    with pytest.raises(ValueError):
+        state.undo_action()
+    state.record_undo()
+    with pytest.raises(ValueError):
+        state.undo_action()
+
+def test_clones_start_without_undo_information():
+    _,state = _new_state()
+    state.record_undo()
+    state.apply_action(state.legal_actions()[0])
+    clone = state.clone()
+    with pytest.raises(ValueError):
+        clone.undo_action()
+
+@pytest.mark.parametrize("seed",[0,1,14,15])
+def test_serialize_round_trip(seed):
+    #whole games, so cab movement episodes whose moves narrow to nothing are covered
+    game = el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(seed%4+2)},seed=seed)
+    state = game.new_initial_state()
+    rng = np.random.RandomState(seed)
+    while not state.is_terminal():
+        for computed in (False,True):
+            if computed:
+                state.legal_actions()
+            data = state.serialize()
+            copy = game.deserialize_state(data)
+            assert copy == state
+            assert copy.zobrist_hash() == state.zobrist_hash()
+            assert copy.legal_actions() == state.legal_actions()
+            assert copy.history() == state.history()
+            assert copy.serialize() == state.serialize()
+        state.apply_action(int(rng.choice(state.legal_actions())))
+    copy = game.deserialize_state(state.serialize())
+    assert copy.is_terminal() and list(copy.returns()) == list(state.returns())
+
+def test_legal_actions_mask():
+    _,state = _new_state()
+    rng = np.random.RandomState(1)
+    for before,action in _random_walk(state,rng):
+        mask = before.legal_actions_mask()
+        assert mask.shape == (el_grande._ACT_END,) and not mask.flags.writeable
+        assert np.flatnonzero(mask).tolist() == before.legal_actions()
+        assert before.legal_actions_mask() is mask #cached until the state changes
+        other = (before.current_player()+1) % before.num_players()
+        assert not before.legal_actions_mask(other).any()
+    assert state.is_terminal()
+    mask = state.legal_actions_mask()
+    assert mask.shape == (el_grande._ACT_END,) and not mask.any()
+
+def test_illegal_actions_are_ignored():
+    _,state = _new_state()
+    illegal = np.flatnonzero(~state.legal_actions_mask())[0]
+    before = state.clone()
+    state.apply_action(int(illegal))
+    assert state == before and state.history() == before.history()
+
+def _play_out(state, rng):
+    #non-terminal states along a random playout of state, which is advanced in place
+    seen = []
+    while not state.is_terminal():
+        seen.append(state.clone())
+        state.apply_action(int(rng.choice(state.legal_actions())))
+    return seen
+
+def _is_margins(returns):
+    #returns relative to the midpoint between first and second place
+    top = sorted(returns,reverse=True)
+    return top[0] + top[1] == 0
+
+@pytest.mark.parametrize("seed",range(3))
+def test_round_and_phase_horizons(seed):
+    rng = np.random.RandomState(seed)
+    for horizon,mark in [('round',lambda s: s._get_round()),('phase',lambda s: el_grande._PHASE_STAGE[s._get_phase()])]:
+        game = el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(seed+2)},seed=seed)
+        state = game.new_initial_state()
+        for _ in range(40+seed*7): #into the middle of the game
+            state.apply_action(int(rng.choice(state.legal_actions())))
+        state.set_horizon(horizon)
+        start = mark(state)
+        seen = _play_out(state,rng)
+        assert all(mark(s) == start for s in seen)
+        assert state._get_round() < state._end_turn
+        assert _is_margins(state.returns())
+
+def test_scoring_horizon_stops_on_actual_scores():
+    _,state = _new_state()
+    seen = _play_out(state,np.random.RandomState(0))
+    assert seen[-1]._get_current_phase_name() == 'scoring'
+    assert state._get_round() < state._end_turn
+    assert list(state.returns()) == list(state._scores_as_margins(state._current_score()))
+
+@pytest.mark.parametrize("plies",[1,5,30])
+def test_ply_horizon(plies):
+    _,state = _new_state()
+    state.set_horizon('game',plies)
+    seen = _play_out(state,np.random.RandomState(plies))
+    assert len(seen) == plies
+    assert _is_margins(state.returns())
+
+def test_horizon_is_kept_by_clones_serialisation_and_undo():
+    game,state = _new_state()
+    state.set_horizon('game',12)
+    rng = np.random.RandomState(2)
+    for _ in range(4):
+        state.apply_action(int(rng.choice(state.legal_actions())))
+    copies = [state.clone(),game.deserialize_state(state.serialize())]
+    state.record_undo()
+    seen = _play_out(state,rng)
+    assert len(seen) == 8
+    actions = state.history()[-8:]
+    for copy in copies:
+        for action in actions:
+            assert not copy.is_terminal()
+            copy.apply_action(action)
+        assert copy.is_terminal() and copy == state
+    state.undo_action()
+    assert not state.is_terminal()
+    state.apply_action(actions[-1])
+    assert state.is_terminal()
+
+def test_horizon_game_parameter():
+    game = el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(3),"horizon":pyspiel.GameParameter('round')},seed=0)
+    state = game.new_initial_state()
+    seen = _play_out(state,np.random.RandomState(0))
+    assert {s._get_round() for s in seen} == {seen[0]._get_round()}
+    with pytest.raises(ValueError):
+        state.set_horizon('turn')
+    with pytest.raises(ValueError):
+        el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(3),"horizon":pyspiel.GameParameter('turn')})
+
+@pytest.mark.parametrize("seed",range(3))
+def test_incremental_zobrist_hash(seed):
+    _,state = _new_state(seed+3,seed)
+    state.zobrist_hash()
+    rng = np.random.RandomState(seed)
+    hashes = set()
+    for before,action in _random_walk(state,rng):
+        assert before._zobrist == el_grande._packed_zobrist(before._packed)
+        assert before.zobrist_hash() == before.clone().zobrist_hash()
+        hashes.add(before.zobrist_hash())
+    assert state._zobrist == el_grande._packed_zobrist(state._packed)
+    assert state.zobrist_hash() not in hashes
+
+def test_zobrist_hash_covers_end_turn_and_horizon():
+    _,state = _new_state()
+    other = state.clone()
+    other._end_turn += 1
+    assert other != state and other.zobrist_hash() != state.zobrist_hash()
+    other = state.clone()
+    other.set_horizon('round')
+    assert other != state and other.zobrist_hash() != state.zobrist_hash()
+
+def test_interleaved_rollouts_match_sequential_playouts():
+    _,state = _new_state(4,1)
+    for action in [state.legal_actions()[0]]*3:
+        state.apply_action(action)
+    states = [state.clone() for _ in range(6)]
+    interleaved = el_grande.interleaved_rollouts(states,np.random.RandomState(7))
+    seeds = np.random.RandomState(7).randint(el_grande._ROLLOUT_SEEDS,size=6).tolist()
+    sequential = np.array([state.clone().rollout(seed) for seed in seeds])
+    assert np.array_equal(interleaved,sequential)
+    assert len({tuple(r) for r in sequential.tolist()}) > 1 #the playouts differ
+    assert np.array_equal(state.rollouts(6,np.random.RandomState(7)),interleaved)
+    batched = el_grande.ElGrandeGameState.batch_rollouts([state,state.clone()],3,np.random.RandomState(7))
+    assert np.array_equal(batched.reshape(6,-1),interleaved)
+
+
+def _game_doc(seed, rev=1):
+    #game history document, as the database holds them, for a power phase position
+    rng = random.Random(seed)
+    players = ['Red','Blue','Green','Yellow'][:rng.randint(2,4)]
+    regions = list(pieces._REGIONS[:9])
+    rng.shuffle(regions)
+    decks = {deck:list(cards) for deck,cards in pieces._DECKTRACK.items()}
+    for cards in decks.values():
+        rng.shuffle(cards)
+    return {'_id':'game%d' % seed,'_rev':'%d-a' % rev,'players':players,'king':regions[-1],
+            'pieces':{p:{'grande':regions[i],regions[i]:2,'court':7,'province':21} for i,p in enumerate(players)},
+            'cards':{deck:cards[0] for deck,cards in decks.items()},
+            'pastcards':{deck:[] for deck in decks if deck!='Deck5'},'deckpositions':decks,
+            'turninfo':{'round':1,'phase':'power','playersleft':players,'playersdone':[],'actionsdone':{},'cabsdone':{},
+                        'powercards':{},'powerplayed':{p:[] for p in players},'scores':{p:0 for p in players},'actioncards':{}}}
+
+def test_document_cache(monkeypatch):
+    monkeypatch.setattr(el_grande,'_DOC_STATE_CACHE',collections.OrderedDict())
+    cache = el_grande._DOC_STATE_CACHE
+    doc = _game_doc(0)
+    first = el_grande.ElGrandeGame({},game_state_doc=doc).new_initial_state()
+    assert list(cache) == [('game0','1-a')]
+    #an equal document loaded again is a cache hit, but keeps its own document
+    again = copy.deepcopy(doc)
+    game = el_grande.ElGrandeGame({},game_state_doc=again)
+    state = game.new_initial_state()
+    assert state == first
+    assert state._game_state is again and state.get_game() is game
+    #copies are independent of the cached base and of each other
+    base = cache[('game0','1-a')].clone()
+    state.apply_action(state.legal_actions()[0])
+    assert cache[('game0','1-a')] == base and first == base and state != base
+    #a new revision is a miss, and the least recently used document goes once the cache is full
+    el_grande.ElGrandeGame({},game_state_doc=_game_doc(0,2)).new_initial_state()
+    assert len(cache) == 2
+    for seed in range(1,el_grande._DOC_STATE_CACHE_SIZE):
+        el_grande.ElGrandeGame({},game_state_doc=_game_doc(seed)).new_initial_state()
+    assert len(cache) == el_grande._DOC_STATE_CACHE_SIZE
+    assert ('game0','1-a') not in cache and ('game0','2-a') in cache
+    el_grande.ElGrandeGame({},game_state_doc=_game_doc(0,2)).new_initial_state() #a hit, so now most recent
+    el_grande.ElGrandeGame({},game_state_doc=_game_doc(99)).new_initial_state()
+    assert list(cache)[-2:] == [('game0','2-a'),('game99','1-a')] and ('game1','1-a') not in cache
+
+def _seeded_playout(game_seed, global_seed):
+    #string of every position along a random playout, with actions picked by a fixed stream
+    random.seed(global_seed)
+    np.random.seed(global_seed)
+    game = el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(4)},seed=game_seed)
+    state = game.new_initial_state()
+    state._end_turn = 3
+    rng = np.random.RandomState(0)
+    positions = []
+    while not state.is_terminal():
+        positions.append(str(state))
+        random.random(),np.random.random_sample() #global draws between actions change nothing
+        state.apply_action(int(rng.choice(state.legal_actions())))
+    return positions + [list(state.returns())]
+
+def test_game_seed_fixes_chance_outcomes():
+    assert _seeded_playout(5,0) == _seeded_playout(5,1)
+    assert _seeded_playout(5,0)[0] != _seeded_playout(6,0)[0] #boards are dealt from the seed
+    game = el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(4)},seed=5)
+    assert str(game.new_initial_state()) != str(game.new_initial_state()) #each new state gets its own stream
+
+def test_clones_share_the_stream_until_seeded():
+    _,state = _new_state()
+    clone = state.clone()
+    assert clone._rng is state._rng
+    expected = random.Random()
+    expected.setstate(state._rng.getstate())
+    expected.random()
+    clone._rng.random()
+    assert state._rng.getstate() == expected.getstate()
+    #seed gives the state a stream of its own, which clones made afterwards share
+    state.seed(3)
+    assert clone._rng is not state._rng and state.clone()._rng is state._rng
+    other = clone.clone()
+    other.seed(3)
+    assert [state._rng.random() for _ in range(5)] == [other._rng.random() for _ in range(5)]
+    other.seed(np.random.SeedSequence(3).spawn(2)[1])
+    assert state._rng.random() != other._rng.random()
+
+def _secret_choice_positions(monkeypatch, seeds):
+    #(card name, state) just before opponents' responses to Eviction/Province are worked out, from random games
+    positions = []
+    assess = el_grande.ElGrandeGameState._assess_secret_choices
+    def recording_assess(state):
+        positions.append((state._get_current_card()['name'],state.clone()))
+        return assess(state)
+    monkeypatch.setattr(el_grande.ElGrandeGameState,'_assess_secret_choices',recording_assess)
+    for seed in seeds:
+        game = el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(seed%3+3)},seed=seed)
+        state = game.new_initial_state()
+        rng = np.random.RandomState(seed)
+        while not state.is_terminal():
+            state.apply_action(int(rng.choice(state.legal_actions())))
+    return positions
+
+def test_response_points_match_rescoring_clones(monkeypatch):
+    positions = _secret_choice_positions(monkeypatch,range(8))
+    assert {name for name,_ in positions} == {'Deck4_Eviction','Deck2_Province','Deck2_Provinceall'}
+    regions = el_grande._NUM_REGIONS
+    for name,state in positions:
+        cabs = state._board_state[:regions,el_grande._ST_BDY_CABS:el_grande._ST_BDY_CABS+state._num_players].T
+        if name == 'Deck4_Eviction':
+            secret = [r for r in range(regions) if state._region_is_secret_choice(r)][0]
+            deltas = np.repeat(cabs[:,secret,None],regions,axis=1) #evicted caballeros go to any one region
+        elif name == 'Deck2_Province':
+            deltas = np.full(cabs.shape,-2)
+        else:
+            deltas = -cabs
+        points = state._response_points(deltas)
+        for player in range(state._num_players):
+            #the clone-and-rescore way, one hypothetical board per player
+            clone = state.clone()
+            clone._board_state[:regions,el_grande._ST_BDY_CABS+player] += deltas[player]
+            assert points[player].tolist() == clone._region_scores()[:regions,player].tolist()
+
+def test_angry_king_ends_the_move_without_enough_caballeros():
+    #opponents with no caballeros left to send still leave the King's move done, rather than offering it again
+    triggered = 0
+    for seed in range(1,5):
+        game = el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(seed%4+2)},seed=seed)
+        state = game.new_initial_state()
+        rng = np.random.RandomState(seed)
+        while not state.is_terminal():
+            legal = state.legal_actions()
+            if el_grande._ACT_TRIGGER in legal and state._get_current_card()['name']=='Deck2_Angry':
+                angry = state.clone()
+                for p in range(angry._num_players):
+                    if p != angry._cur_player:
+                        angry._board_state[:,el_grande._ST_BDY_CABS+p] = 0
+                angry.apply_action(el_grande._ACT_TRIGGER)
+                assert not angry._movement_tracking.moving
+                assert el_grande._ACT_TRIGGER not in angry.legal_actions()
+                triggered += 1
+            state.apply_action(int(rng.choice(legal)))
+    assert triggered > 0
+
+def _unique_score_points(state, region):
+    #points each player gets when the current player picks region for a unique-score card
+    before = state._current_score().copy()
+    state._unique_score(region+el_grande._ACT_CHOOSE_SECRETS)
+    return (state._current_score()-before).tolist()
+
+def test_unique_score_scores_regions_picked_by_one_player():
+    _,state = _new_state(3)
+    state._cur_player = 0
+    cabs = state._board_state[:el_grande._NUM_REGIONS,el_grande._ST_BDY_CABS:el_grande._ST_BDY_CABS+3]
+    cabs[:] = 0
+    #players 1 and 2 only score in region 5, so both pick it and cancel each other out
+    cabs[2,0] = 2
+    cabs[5,1] = 2
+    cabs[5,2] = 1
+    scores = state._region_scores()
+    assert _unique_score_points(state.clone(),2) == scores[2].tolist()
+    assert scores[2,0] > 0
+    assert _unique_score_points(state.clone(),5) == [0,0,0]
+
+@pytest.mark.parametrize("seed",range(4))
+def test_score_regions_matches_score_row(seed):
+    #the batched kernels against the row-by-row scoring, on random boards of random sizes
+    rng = np.random.RandomState(seed)
+    for _ in range(50):
+        players = rng.randint(2,el_grande._MAX_PLAYERS+1)
+        cabs = rng.randint(0,4,size=(3,el_grande._NUM_EXT_REGIONS,players))
+        rewards = rng.randint(0,9,size=(el_grande._NUM_EXT_REGIONS,3))
+        grande_king = rng.randint(0,1<<(el_grande._ST_MASK_KING+1),size=(3,el_grande._NUM_EXT_REGIONS))
+        ranks = el_grande._rank_regions(cabs)
+        points = el_grande._score_regions(cabs,rewards,grande_king)
+        for board in range(3):
+            for region in range(el_grande._NUM_EXT_REGIONS):
+                row_ranks,row_points = el_grande._score_row(cabs[board,region].tolist(),rewards[region].tolist(),int(grande_king[board,region]))
+                assert ranks[board,region].tolist() == row_ranks
+                assert points[board,region].tolist() == row_points
@@ -0,0 +1,212 @@
+import numpy as np
+import pyspiel
+import pytest
+
+import castillo_game
+import el_grande
+import mcts_ext
+
+
+def _el_grande_state(players=3, moves=5, seed=4):
+    game = el_grande.ElGrandeGame(params={"players":pyspiel.GameParameter(players)},seed=seed)
+    state = game.new_initial_state()
+    state.set_horizon('scoring')
+    rng = np.random.RandomState(3)
+    for _ in range(moves):
+        state.apply_action(int(rng.choice(state.legal_actions())))
+    return game,state
+
+def _bot(game, simulations=100, **kwargs):
+    rng = np.random.RandomState(5)
+    return mcts_ext.MCTSBot(game,2,simulations,mcts_ext.RandomRolloutEvaluator(2,rng),random_state=rng,**kwargs)
+
+def _check_tree(tree, root):
+    #every node reachable once from root, child visits within their parent's, returns the node count
+    seen = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        assert node not in seen
+        seen.add(node)
+        children = tree.children(node)
+        if len(children):
+            assert tree.explore_count[node] >= tree.explore_count[children.start:children.stop].sum()
+        stack.extend(children)
+    return len(seen)
+
+
+def test_castillo_search():
+    #scoring round castillo choice, as castilloAdvice sets it up
+    game,state = _el_grande_state(moves=0)
+    rng = np.random.RandomState(1)
+    while state._get_current_phase_name() != 'scoring':
+        state.apply_action(int(rng.choice(state.legal_actions())))
+    #a loaded document queues every player for the castillo choice
+    state._playersleft = list(range(state._num_players))
+    cg = castillo_game.CastilloGame({"state":pyspiel.GameParameter(state.castillo_game_string())})
+    assert cg.num_players() == state._num_players
+    bot = _bot(cg,200,reuse_tree=False)
+    action,actions,values = bot.multi_step(cg.new_initial_state(),True)
+    assert action in range(castillo_game._NUM_REGIONS)
+
+def test_players_taken_from_state():
+    #games loaded from a document report the default player count, whatever the state's
+    game,state = _el_grande_state(players=3)
+    game._num_players = 4
+    root = _bot(game).mcts_search(state)
+    assert root.tree.outcome.shape[1] == 3
+
+@pytest.mark.parametrize("kwargs",[{},{"batch_size":4},{"max_nodes":150},{"max_nodes":150,"batch_size":4}])
+def test_search_tree_is_consistent(kwargs):
+    game,state = _el_grande_state()
+    bot = _bot(game,300,**kwargs)
+    root = bot.mcts_search(state)
+    assert root.explore_count == 300
+    nodes = _check_tree(root.tree,root.index)
+    if "max_nodes" in kwargs:
+        assert nodes <= kwargs["max_nodes"]
+    else:
+        assert nodes == root.tree.size
+
+def test_reuse_continues_in_subtree():
+    game,state = _el_grande_state()
+    bot = _bot(game,200)
+    best = bot.mcts_search(state).best_child()
+    count,action = best.explore_count,best.action
+    state.apply_action(action)
+    root = bot.mcts_search(state)
+    assert root.explore_count == count + 200
+    assert _check_tree(root.tree,root.index) == root.tree.size
+
+def test_collect_evicts_least_visited():
+    tree = mcts_ext.SearchTree(2)
+    root = tree.add_root(0)
+    tree.explore_count[root] = 10
+    tree.expand(root,1,[(0,0.5),(1,0.5)])
+    busy,quiet = tree.children(root)
+    tree.explore_count[busy],tree.explore_count[quiet] = 8,2
+    tree.expand(busy,0,[(a,0.25) for a in range(4)])
+    tree.expand(quiet,0,[(a,0.25) for a in range(4)])
+    tree.explore_count[tree.children(busy)] = 2
+    tree.explore_count[tree.children(quiet)] = 1
+    root = tree.collect(root,7)
+    assert tree.size == 7
+    quiet = mcts_ext.SearchNode(tree,root).children[1]
+    assert quiet.explore_count == 2 and not quiet.children
+    assert len(mcts_ext.SearchNode(tree,root).children[0].children) == 4
+
+def test_collect_drops_other_branches():
+    tree = mcts_ext.SearchTree(2)
+    root = tree.add_root(0)
+    tree.expand(root,0,[(0,0.5),(1,0.5)])
+    kept = tree.children(root)[1]
+    tree.expand(kept,1,[(5,1.0)])
+    new_root = tree.collect(kept)
+    assert new_root == 0 and tree.size == 2
+    assert tree.action[tree.children(new_root)[0]] == 5
+
+def test_merge_adds_counts_and_copies_subtrees():
+    trees = []
+    for visits in (3,5):
+        tree = mcts_ext.SearchTree(2)
+        root = tree.add_root(0)
+        tree.explore_count[root] = visits
+        tree.total_reward[root] = visits
+        tree.expand(root,0,[(0,0.5),(1,0.5)])
+        trees.append((tree,root))
+    (tree,root),(other,other_root) = trees
+    child = other.children(other_root)[1]
+    other.explore_count[child] = 4
+    other.expand(child,1,[(7,1.0)])
+    other.set_outcome(other.children(child)[0],[1.0,-1.0])
+    tree.merge(root,other,other_root)
+    merged = mcts_ext.SearchNode(tree,root)
+    assert merged.explore_count == 8 and merged.total_reward == 8
+    child = [c for c in merged.children if c.action == 1][0]
+    assert child.explore_count == 4
+    assert child.children[0].action == 7
+    assert list(child.children[0].outcome) == [1.0,-1.0]
+
+def test_recommend_gap_with_unvisited_children():
+    game,state = _el_grande_state()
+    assert len(state.legal_actions()) > 2
+    action,gap = _bot(game,2).step_with_recommend_gap(state)
+    assert action in state.legal_actions()
+    assert np.isfinite(gap)
+
+def test_step_then_search_reuses_the_tree():
+    game,state = _el_grande_state()
+    bot = _bot(game,100)
+    bot.step(state)
+    assert bot.mcts_search(state).explore_count == 200
+    #an equal position loaded separately, with a different history, is not reused
+    loaded = game.deserialize_state(state.serialize())
+    loaded._history = None
+    assert loaded == state
+    assert bot.mcts_search(loaded).explore_count == 100
+
+@pytest.mark.parametrize("max_nodes,batch_size",[(5,1),(5,4),(10,4)])
+def test_caps_below_the_branching_factor(max_nodes, batch_size):
+    game,state = _el_grande_state(moves=0)
+    branching = len(state.legal_actions())
+    assert branching > max_nodes
+    bot = _bot(game,200,max_nodes=max_nodes,batch_size=batch_size)
+    collects = []
+    collect = mcts_ext.SearchTree.collect
+    def counted(tree, root, max_nodes=None):
+        collects.append(max_nodes)
+        return collect(tree,root,max_nodes)
+    mcts_ext.SearchTree.collect = counted
+    try:
+        root = bot.mcts_search(state)
+    finally:
+        mcts_ext.SearchTree.collect = collect
+    #the root and its children are always kept, and the rest stays under a batch of expansions
+    assert len(root.children) == branching
+    assert _check_tree(root.tree,root.index) <= 1 + branching + branching*batch_size
+    assert root.explore_count == 200
+    assert all(keep > branching for keep in collects if keep is not None)
+
+def _parallel_search(monkeypatch, simulations=200, workers=3, seed=5, state=None):
+    #root-parallel search from state, returning the root and the seeds the workers searched with
+    if state is None:
+        game,state = _el_grande_state()
+    else:
+        game = state.get_game()
+    seeded,merge = mcts_ext.MCTSBot._seeded_search,mcts_ext.SearchTree.merge
+    seeds = []
+    def tagged_search(bot, state, seed, num_simulations, expansion):
+        tree,root = seeded(bot,state,seed,num_simulations,expansion)
+        tree.seed = (seed.entropy,seed.spawn_key) #sent back from the worker with the tree
+        return tree,root
+    def recording_merge(tree, node, other, other_node):
+        seeds.append(other.seed)
+        return merge(tree,node,other,other_node)
+    monkeypatch.setattr(mcts_ext.MCTSBot,"_seeded_search",tagged_search)
+    monkeypatch.setattr(mcts_ext.SearchTree,"merge",recording_merge)
+    rng = np.random.RandomState(seed)
+    bot = mcts_ext.MCTSBot(game,2,simulations,mcts_ext.RandomRolloutEvaluator(2,rng),random_state=rng,num_workers=workers)
+    return bot.mcts_search(state.clone()),seeds
+
+def test_root_parallel_search(monkeypatch):
+    game,state = _el_grande_state()
+    root,seeds = _parallel_search(monkeypatch,state=state)
+    assert root.explore_count == 200
+    #the first simulation expands the root, every later one visits a child - as in a single process
+    assert sum(c.explore_count for c in root.children) == 199
+    assert _check_tree(root.tree,root.index) == root.tree.size
+    assert len(seeds) == 3 and len(set(seeds)) == 3
+    again,_ = _parallel_search(monkeypatch,state=state)
+    assert [(c.action,c.explore_count,c.total_reward) for c in again.children] == \
+        [(c.action,c.explore_count,c.total_reward) for c in root.children]
+    other,_ = _parallel_search(monkeypatch,state=state,seed=6)
+    assert [c.explore_count for c in other.children] != [c.explore_count for c in root.children]
+
+def test_root_parallel_search_continues_a_reused_tree(monkeypatch):
+    game,state = _el_grande_state()
+    rng = np.random.RandomState(1)
+    bot = mcts_ext.MCTSBot(game,2,60,mcts_ext.RandomRolloutEvaluator(2,rng),random_state=rng,num_workers=2)
+    bot.mcts_search(state)
+    root = bot.mcts_search(state)
+    assert root.explore_count == 120
+    assert sum(c.explore_count for c in root.children) == 119